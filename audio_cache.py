@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本地音频缓存。
+
+下载完成的音频按 (bvid, cid, 音轨 id) 保存在 TEMP_DIR/audio_cache，任务重试、换参数重新转录时直接从缓存取，
+不再重新下载。每个音频旁边有一个 .json 记录大小和 sha256，取出时检查大小（verify 为 "hash" 时同时检查 sha256），
+不一致的条目删除。缓存总大小超过 max_bytes 时按最近使用时间淘汰。
+放入和取出都优先用硬链接，工作目录和缓存在同一个文件系统时不复制数据。
+
+在 config.json 中配置（以下是默认值）：
+
+    "audio_cache": {"enabled": true, "max_bytes": 5000000000, "verify": "size"}
+
+命令行：
+    python audio_cache.py stats
+    python audio_cache.py clear
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import dp_metrics
+
+AUDIO_SUFFIX = ".m4s"
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _link_or_copy(src: Path, dst: Path):
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+class AudioCache:
+    def __init__(self, cache_dir: Path, max_bytes: int = 5_000_000_000, verify: str = "size"):
+        """
+        Args:
+            cache_dir (Path): 缓存目录。
+            max_bytes (int, optional): 缓存的总大小上限（字节）. 默认为 5GB.
+            verify (str, optional): 取出时的完整性检查，"size" 只检查大小，"hash" 同时检查 sha256. 默认为 "size".
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.verify = verify
+
+    @contextmanager
+    def _locked(self):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_dir / ".lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _entry(self, bvid, cid, track_id) -> Path:
+        return self.cache_dir / f"{bvid}_{cid}_{track_id}{AUDIO_SUFFIX}"
+
+    def _valid(self, audio: Path) -> bool:
+        meta_file = audio.with_suffix(".json")
+        try:
+            meta = json.loads(meta_file.read_text(encoding='utf-8'))
+            if audio.stat().st_size != meta['size']:
+                return False
+            return self.verify != "hash" or file_sha256(audio) == meta['sha256']
+        except (OSError, KeyError, json.JSONDecodeError):
+            return False
+
+    def _remove(self, audio: Path):
+        audio.unlink(missing_ok=True)
+        audio.with_suffix(".json").unlink(missing_ok=True)
+
+    def fetch(self, bvid, cid, track_id, dst: Path) -> bool:
+        """
+        把缓存的同一音轨的音频放到 dst。其他音轨（例如换了 audio_track 策略之后）不算命中。
+
+        Returns:
+            bool: 命中返回 True。
+        """
+        audio = self._entry(bvid, cid, track_id)
+        with self._locked():
+            if audio.exists():
+                if self._valid(audio):
+                    _link_or_copy(audio, dst)
+                    # 用 .json 的修改时间记录最近使用时间
+                    os.utime(audio.with_suffix(".json"))
+                    dp_metrics.incr('audio_cache_hits')
+                    return True
+                self._remove(audio)
+        dp_metrics.incr('audio_cache_misses')
+        return False
+
+    def put(self, bvid, cid, track_id, src: Path):
+        """把下载完成的 src 放入缓存，然后按需淘汰最久没有使用的条目。"""
+        if self.max_bytes <= 0 or src.stat().st_size > self.max_bytes:
+            return
+        audio = self._entry(bvid, cid, track_id)
+        with self._locked():
+            tmp = audio.with_name(f".{audio.name}.{os.getpid()}.tmp")
+            _link_or_copy(src, tmp)
+            meta = {'size': tmp.stat().st_size, 'sha256': file_sha256(tmp), 'created': time.time()}
+            os.replace(tmp, audio)
+            audio.with_suffix(".json").write_text(json.dumps(meta), encoding='utf-8')
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for audio in self.cache_dir.glob(f"*{AUDIO_SUFFIX}"):
+            meta_file = audio.with_suffix(".json")
+            try:
+                size = audio.stat().st_size
+                used = meta_file.stat().st_mtime
+            except OSError:
+                self._remove(audio)
+                continue
+            entries.append((used, size, audio))
+            total += size
+        for used, size, audio in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(audio)
+            total -= size
+
+    def stats(self) -> dict:
+        files = list(self.cache_dir.glob(f"*{AUDIO_SUFFIX}"))
+        return {'entries': len(files), 'bytes': sum(f.stat().st_size for f in files), 'max_bytes': self.max_bytes}
+
+    def clear(self):
+        with self._locked():
+            for audio in self.cache_dir.glob(f"*{AUDIO_SUFFIX}"):
+                self._remove(audio)
+
+def get_audio_cache():
+    """按 config.json 中的 "audio_cache" 创建缓存，关闭时返回 None。"""
+    from dp_config import get_config, get_temp_directory
+    config = get_config()
+    conf = config.get("audio_cache", {})
+    if not conf.get("enabled", True):
+        return None
+    return AudioCache(get_temp_directory(config) / "audio_cache", int(conf.get("max_bytes", 5_000_000_000)), conf.get("verify", "size"))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地音频缓存")
+    parser.add_argument("cmd", choices=["stats", "clear"])
+    args = parser.parse_args(argv)
+    cache = get_audio_cache()
+    if cache is None:
+        print("音频缓存已关闭")
+        return
+    if args.cmd == "stats":
+        print(json.dumps(cache.stats(), ensure_ascii=False))
+    else:
+        cache.clear()
+        print("已清空")
+
+if __name__ == "__main__":
+    main()
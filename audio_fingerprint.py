@@ -0,0 +1,611 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+音频指纹去重。
+
+同一段音频经常以不同的 bvid 出现（转载、下架后重新上传、同一个讲座发在多个频道）。下载完成后用 ffmpeg 的
+chromaprint 输出计算音频指纹（每 ~0.124 秒一个 32 位的色度特征），在指纹索引中查找近似重复的已转录视频，
+找到时直接复用它的转录结果（按新视频的 bvid 命名），不再转录。
+
+指纹索引是一个 sqlite 数据库（默认和 sqlite 队列放在一起），多个进程共用：
+- fingerprints 表保存每个视频的完整指纹和紧凑格式的转录结果（见 transcript_store），其他机器的条目两者都为空；
+- terms 表是倒排索引：指纹项的高 20 位作为检索词，只收录哈希值能被 sample 整除的检索词。
+  按内容而不是位置抽样，片头长度不同的两份音频抽到的检索词仍然大部分相同，索引大小约为指纹长度的 1/sample。
+
+查找时先在时长相近的视频中按共同检索词的个数选出 candidates 个候选，再用检索词的位置差投票得到对齐偏移，
+逐项比较对齐后的指纹，位错误率不超过 max_ber、重叠部分覆盖两个视频的 min_overlap 以上时认为是重复。
+复用的转录结果按对齐偏移平移时间轴。
+
+索引文件在每台机器本地。share 为 true 时，新加入的条目同时发布给其他机器。发布的不是完整指纹和转录结果，而是紧凑的
+检索词列表：抽样检索词中哈希值最小的 postings 个（检索词和位置），每个视频约 2KB。条目先追加到本地的
+TEMP_DIR/fingerprints/<worker>_<session>.jsonl，上传结果时把还没推送的部分追加到队列仓库的
+fingerprints/<worker>_<日期>.jsonl（每台机器每天一个文件），推送成功后记录已推送的位置，推送完且不再写入的本地文件删除。
+仓库中超过 retention_days 天的文件在上传时删除（已经导入的条目仍然留在各机器的本地索引中）。
+
+查找前最多每 sync_interval 秒把队列仓库中其他机器的条目导入本地索引，每个文件只读取上次导入的字节位置之后追加的内容。
+其他机器的条目没有完整指纹，不能逐项比较：对齐偏移上（±1 项）共同检索词的个数达到该条目检索词个数的 min_votes
+以上、重叠部分覆盖两个视频的 min_overlap 以上时认为是重复，转录结果从队列仓库的 from_stt 中按 bvid 读取，
+找不到时（结果已经被取走）按普通流程转录。本机转录过的条目优先于其他机器的条目。
+sqlite 队列后端没有这个目录，只能找到本机转录过的视频。
+
+在 config.json 中配置（以下是默认值）：
+
+    "fingerprint": {"enabled": true, "index_path": "fingerprints.sqlite3", "sample": 8, "candidates": 5,
+                    "duration_tolerance": 0.1, "max_ber": 0.2, "min_overlap": 0.9, "share": false, "sync_interval": 300,
+                    "postings": 256, "min_votes": 0.1, "retention_days": 30}
+
+命令行：
+    python audio_fingerprint.py stats
+    python audio_fingerprint.py match <音频文件>
+"""
+
+import argparse
+import array
+import base64
+import json
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import dp_metrics
+
+ITEM_SECONDS = 0.1238
+TERM_SHIFT = 12
+
+class FingerprintUnavailable(RuntimeError):
+    """ffmpeg 不存在或不支持 chromaprint，本机无法计算任何指纹。"""
+
+def compute_fingerprint(audio_path: Path, ffmpeg: str = "ffmpeg") -> array.array:
+    """
+    计算音频指纹。
+
+    Returns:
+        array.array: 无符号 32 位整数数组。
+
+    Raises:
+        FingerprintUnavailable: ffmpeg 不可用或不支持 chromaprint 时。
+        RuntimeError: 这个音频文件无法解码时。
+    """
+    cmd = [ffmpeg, '-v', 'error', '-i', str(audio_path), '-ac', '1', '-f', 'chromaprint', '-fp_format', 'raw', '-']
+    try:
+        result = subprocess.run(cmd, capture_output=True, check=True)
+    except OSError as e:
+        raise FingerprintUnavailable(f"无法运行 ffmpeg: {e}") from e
+    except subprocess.CalledProcessError as e:
+        stderr = (e.stderr or b'').decode('utf-8', 'replace').strip()
+        if 'chromaprint' in stderr and ('format' in stderr.lower() or 'unknown' in stderr.lower()):
+            raise FingerprintUnavailable(f"ffmpeg 不支持 chromaprint: {stderr}") from e
+        raise RuntimeError(f"计算指纹失败: {e} {stderr}") from e
+    fp = array.array('I')
+    fp.frombytes(result.stdout[:len(result.stdout) // 4 * 4])
+    return fp
+
+def _hash(term: int) -> int:
+    # 乘法哈希打散高位
+    return (term * 2654435761) & 0xffffffff
+
+def _terms(fp, sample: int):
+    """返回 {检索词: 第一次出现的位置}，只保留抽样的检索词。"""
+    terms = {}
+    for pos, item in enumerate(fp):
+        term = item >> TERM_SHIFT
+        if (_hash(term) >> 16) % sample == 0:
+            terms.setdefault(term, pos)
+    return terms
+
+def postings(fp, sample: int, limit: int):
+    """
+    发布给其他机器的紧凑检索词列表：抽样检索词中哈希值最小的 limit 个。
+    和抽样一样按内容选择，同一段音频的两份拷贝选出的检索词大部分相同。
+
+    Returns:
+        dict: {检索词: 位置}。
+    """
+    terms = _terms(fp, sample)
+    return {term: terms[term] for term in sorted(terms, key=_hash)[:limit]}
+
+def compare(fp1, fp2, offset: int):
+    """
+    按偏移对齐后比较两个指纹：fp1[i] 对应 fp2[i + offset]。
+
+    Returns:
+        tuple[float, int]: (位错误率, 重叠的指纹项数)。
+    """
+    start = max(0, -offset)
+    end = min(len(fp1), len(fp2) - offset)
+    if end <= start:
+        return 1.0, 0
+    errors = sum((fp1[i] ^ fp2[i + offset]).bit_count() for i in range(start, end))
+    overlap = end - start
+    return errors / (32 * overlap), overlap
+
+def best_offset(terms1: dict, terms2: dict):
+    """用共同检索词的位置差投票，返回得票最多的偏移，没有共同检索词时返回 None。"""
+    votes = {}
+    for term, pos in terms1.items():
+        other = terms2.get(term)
+        if other is not None:
+            votes[other - pos] = votes.get(other - pos, 0) + 1
+    if not votes:
+        return None
+    return max(votes.items(), key=lambda kv: kv[1])[0]
+
+def aligned_votes(terms1: dict, terms2: dict, offset: int) -> int:
+    """位置差与 offset 相差不超过 1 项的共同检索词个数。"""
+    return sum(1 for term, pos in terms1.items() if term in terms2 and abs(terms2[term] - pos - offset) <= 1)
+
+def overlap_length(len1: int, len2: int, offset: int) -> int:
+    """按 compare 的方式对齐后重叠的指纹项数。"""
+    return max(0, min(len1, len2 - offset) - max(0, -offset))
+
+class FingerprintIndex:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        bvid TEXT UNIQUE NOT NULL,
+        duration REAL NOT NULL,
+        fp BLOB NOT NULL,
+        transcript BLOB NOT NULL,
+        created REAL NOT NULL,
+        length INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_fingerprints_duration ON fingerprints(duration);
+    CREATE TABLE IF NOT EXISTS terms (
+        term INTEGER NOT NULL,
+        fid INTEGER NOT NULL,
+        pos INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS idx_terms_term ON terms(term);
+    CREATE INDEX IF NOT EXISTS idx_terms_fid ON terms(fid);
+    CREATE TABLE IF NOT EXISTS import_offsets (
+        name TEXT PRIMARY KEY,
+        offset INTEGER NOT NULL
+    );
+    """
+
+    # 旧版本的索引没有这些列；旧的 imported 表按行数记录，对应的是带转录结果的旧共享格式，不再使用
+    MIGRATIONS = (
+        ("fingerprints", "length", "ALTER TABLE fingerprints ADD COLUMN length INTEGER NOT NULL DEFAULT 0"),
+        ("terms", "pos", "ALTER TABLE terms ADD COLUMN pos INTEGER"),
+    )
+
+    def __init__(self, path: Path, sample: int = 8, candidates: int = 5, duration_tolerance: float = 0.1,
+                 max_ber: float = 0.2, min_overlap: float = 0.9, min_votes: float = 0.1):
+        """
+        Args:
+            path (Path): 索引数据库路径。
+            sample (int, optional): 检索词的抽样比例（1/sample）. 默认为 8.
+            candidates (int, optional): 逐项比较的候选个数. 默认为 5.
+            duration_tolerance (float, optional): 候选视频与查询视频的时长相差不超过该比例. 默认为 0.1.
+            max_ber (float, optional): 对齐后的位错误率不超过该值时认为是重复. 默认为 0.2.
+            min_overlap (float, optional): 重叠部分至少覆盖两个指纹的该比例. 默认为 0.9.
+            min_votes (float, optional): 其他机器的条目对齐的检索词至少占它的检索词的该比例. 默认为 0.1.
+        """
+        self.path = Path(path)
+        self.sample = sample
+        self.candidates = candidates
+        self.duration_tolerance = duration_tolerance
+        self.max_ber = max_ber
+        self.min_overlap = min_overlap
+        self.min_votes = min_votes
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = self._db()
+        for table, column, sql in self.MIGRATIONS:
+            if db.execute(f"SELECT name FROM sqlite_master WHERE type = 'table' AND name = '{table}'").fetchone() and \
+                    column not in {row[1] for row in db.execute(f"PRAGMA table_info({table})")}:
+                db.execute(sql)
+        db.executescript(self.SCHEMA)
+        db.execute("DROP TABLE IF EXISTS imported")
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def add(self, bvid: str, duration: float, fp, transcript: bytes):
+        """
+        把已转录视频的指纹和紧凑格式的转录结果加入索引，同一个 bvid 重复加入时覆盖。
+
+        Args:
+            bvid (str): 视频 bvid。
+            duration (float): 视频时长（秒）。
+            fp (array.array): compute_fingerprint 的结果。
+            transcript (bytes): transcript_store.Transcript.dumps() 的结果。
+        """
+        if not fp:
+            return
+        self._insert(bvid, duration, len(fp), _terms(fp, self.sample), array.array('I', fp).tobytes(), transcript)
+
+    def add_postings(self, bvid: str, duration: float, length: int, terms: dict):
+        """
+        加入其他机器发布的条目（见 postings），只有检索词和位置。本机已经有完整指纹的 bvid 不覆盖。
+
+        Returns:
+            bool: 是否加入。
+        """
+        if not terms or not length:
+            return False
+        row = self._db().execute("SELECT length(fp) FROM fingerprints WHERE bvid = ?", (bvid,)).fetchone()
+        if row and row[0]:
+            return False
+        self._insert(bvid, duration, length, terms, b'', b'')
+        return True
+
+    def _insert(self, bvid: str, duration: float, length: int, terms: dict, fp: bytes, transcript: bytes):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            old = db.execute("SELECT id FROM fingerprints WHERE bvid = ?", (bvid,)).fetchone()
+            if old:
+                db.execute("DELETE FROM terms WHERE fid = ?", old)
+                db.execute("DELETE FROM fingerprints WHERE id = ?", old)
+            fid = db.execute("INSERT INTO fingerprints (bvid, duration, fp, transcript, created, length) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", (bvid, duration, fp, transcript, time.time(), length)).lastrowid
+            db.executemany("INSERT INTO terms (term, fid, pos) VALUES (?, ?, ?)",
+                           ((term, fid, pos) for term, pos in terms.items()))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _candidates(self, terms: dict, duration: float, exclude: str):
+        db = self._db()
+        db.execute("CREATE TEMP TABLE IF NOT EXISTS query_terms (term INTEGER PRIMARY KEY)")
+        db.execute("DELETE FROM query_terms")
+        db.executemany("INSERT INTO query_terms (term) VALUES (?)", ((term,) for term in terms))
+        sql = ("SELECT f.id, COUNT(*) AS hits FROM query_terms q JOIN terms t ON t.term = q.term "
+               "JOIN fingerprints f ON f.id = t.fid WHERE f.bvid != ?")
+        params = [exclude or ""]
+        if duration:
+            sql += " AND f.duration BETWEEN ? AND ?"
+            params += [duration * (1 - self.duration_tolerance), duration * (1 + self.duration_tolerance)]
+        sql += " GROUP BY f.id ORDER BY hits DESC LIMIT ?"
+        params.append(self.candidates)
+        return db.execute(sql, params).fetchall()
+
+    def lookup(self, fp, duration: float = 0, exclude: str = None):
+        """
+        查找近似重复的已转录视频。本机转录过的视频逐项比较指纹，其他机器的条目按对齐的检索词个数判断，
+        两者都有时优先返回本机的。
+
+        Args:
+            fp (array.array): 查询视频的指纹。
+            duration (float, optional): 查询视频的时长（秒），为 0 时不按时长过滤. 默认为 0.
+            exclude (str, optional): 不参与匹配的 bvid（查询视频自己）. 默认为 None.
+
+        Returns:
+            dict | None: {'bvid', 'ber', 'offset', 'transcript'}，没有重复时返回 None。
+                其他机器的条目 'ber' 为 None、'transcript' 为空（见 load_shared_transcript），另有 'votes'（对齐的检索词比例）。
+        """
+        terms = _terms(fp, self.sample)
+        if not terms:
+            return None
+        best = remote = None
+        db = self._db()
+        for fid, hits in self._candidates(terms, duration, exclude):
+            bvid, blob, transcript, length = db.execute(
+                "SELECT bvid, fp, transcript, length FROM fingerprints WHERE id = ?", (fid,)).fetchone()
+            if not blob:
+                other_terms = dict(db.execute("SELECT term, pos FROM terms WHERE fid = ?", (fid,)).fetchall())
+                offset = best_offset(terms, other_terms)
+                if offset is None:
+                    continue
+                votes = aligned_votes(terms, other_terms, offset) / len(other_terms)
+                if overlap_length(len(fp), length, offset) < self.min_overlap * max(len(fp), length) or votes < self.min_votes:
+                    continue
+                if remote is None or votes > remote['votes']:
+                    remote = {'bvid': bvid, 'ber': None, 'votes': votes, 'offset': offset, 'transcript': b''}
+                continue
+            other = array.array('I')
+            other.frombytes(blob)
+            offset = best_offset(terms, _terms(other, self.sample))
+            if offset is None:
+                continue
+            ber, overlap = compare(fp, other, offset)
+            if overlap < self.min_overlap * max(len(fp), len(other)) or ber > self.max_ber:
+                continue
+            if best is None or ber < best['ber']:
+                best = {'bvid': bvid, 'ber': ber, 'offset': offset, 'transcript': transcript}
+        return best or remote
+
+    def import_dir(self, directory: Path, skip=()) -> int:
+        """
+        导入其他机器发布的条目（见 encode_entry），每个文件从上次导入的字节位置读取新追加的完整行。
+        已经从仓库删除的文件不再记录位置。
+
+        Args:
+            directory (Path): 队列仓库中的 fingerprints 目录。
+            skip (Iterable[str], optional): 不导入的文件名（本机自己发布的文件）.
+
+        Returns:
+            int: 导入的条目数。
+        """
+        directory = Path(directory)
+        if not directory.is_dir():
+            return 0
+        db = self._db()
+        offsets = dict(db.execute("SELECT name, offset FROM import_offsets").fetchall())
+        added = 0
+        present = set()
+        for f in sorted(directory.glob("*.jsonl")):
+            present.add(f.name)
+            if f.name in skip:
+                continue
+            done = offsets.get(f.name, 0)
+            if f.stat().st_size < done:
+                # 文件被重写，从头导入
+                done = 0
+            with open(f, 'rb') as fh:
+                fh.seek(done)
+                data = fh.read()
+            end = data.rfind(b'\n') + 1
+            if not end:
+                continue
+            for line in data[:end].decode('utf-8', 'replace').splitlines():
+                try:
+                    entry = decode_entry(line)
+                except (ValueError, KeyError):
+                    # 包括旧版本带转录结果的共享格式
+                    continue
+                if self.add_postings(*entry):
+                    added += 1
+            db.execute("INSERT OR REPLACE INTO import_offsets (name, offset) VALUES (?, ?)", (f.name, done + end))
+        for name in set(offsets) - present:
+            db.execute("DELETE FROM import_offsets WHERE name = ?", (name,))
+        return added
+
+    def stats(self) -> dict:
+        db = self._db()
+        return {'entries': db.execute("SELECT COUNT(*) FROM fingerprints").fetchone()[0],
+                'terms': db.execute("SELECT COUNT(*) FROM terms").fetchone()[0]}
+
+def encode_entry(bvid: str, duration: float, length: int, terms: dict) -> str:
+    """发布条目的共享格式：一行 JSON，检索词和位置分别是 base64 编码的 32 位整数数组。"""
+    return json.dumps({'bvid': bvid, 'duration': duration, 'length': length,
+                       'terms': base64.b64encode(array.array('I', terms.keys()).tobytes()).decode(),
+                       'pos': base64.b64encode(array.array('I', terms.values()).tobytes()).decode()}, separators=(',', ':'))
+
+def decode_entry(line: str):
+    """
+    Returns:
+        tuple: FingerprintIndex.add_postings 的参数 (bvid, duration, length, terms)。
+    """
+    entry = json.loads(line)
+    terms, pos = array.array('I'), array.array('I')
+    terms.frombytes(base64.b64decode(entry['terms']))
+    pos.frombytes(base64.b64decode(entry['pos']))
+    if len(terms) != len(pos):
+        raise ValueError("检索词和位置的个数不一致")
+    return entry['bvid'], entry['duration'], entry['length'], dict(zip(terms, pos))
+
+_index = None
+_unavailable = False
+_synced_at = 0.0
+_lock = threading.Lock()
+
+PUSHED_FILE = "pushed.json"
+# 推送完的本地发布文件超过这个时间没有写入才删除，避免删掉其他进程正在追加的文件
+OUTBOX_IDLE_SECONDS = 3600
+
+def get_fingerprint_conf() -> dict:
+    from dp_config import get_config
+    return {"enabled": True, "index_path": "fingerprints.sqlite3", "sample": 8, "candidates": 5, "duration_tolerance": 0.1,
+            "max_ber": 0.2, "min_overlap": 0.9, "share": False, "sync_interval": 300, "postings": 256, "min_votes": 0.1,
+            "retention_days": 30, **get_config().get("fingerprint", {})}
+
+def get_outbox_directory() -> Path:
+    from dp_config import get_temp_directory
+    return get_temp_directory() / "fingerprints"
+
+def _outbox_path() -> Path:
+    return get_outbox_directory() / f"{dp_metrics.get_worker_id()}_{dp_metrics.session().session_id}.jsonl"
+
+def _is_own_shared(name: str) -> bool:
+    """仓库中的文件名是 <worker>_<日期>.jsonl，判断是不是本机发布的。"""
+    return name.rsplit('_', 1)[0] == dp_metrics.get_worker_id()
+
+def publish_entry(bvid: str, duration: float, fp):
+    """share 为 true 时把新加入索引的条目的紧凑检索词列表（见 postings）追加到本进程的发布文件，随结果一起上传。"""
+    conf = get_fingerprint_conf()
+    if not conf["share"] or not fp:
+        return
+    path = _outbox_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    line = encode_entry(bvid, duration, len(fp), postings(fp, int(conf["sample"]), int(conf["postings"]))) + "\n"
+    with _lock:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+def _read_pushed(outbox: Path) -> dict:
+    try:
+        return json.loads((outbox / PUSHED_FILE).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+def stage_shared(dst_dir: Path) -> dict:
+    """
+    把本机发布文件中还没推送的完整行追加到队列仓库的 dst_dir/<worker>_<日期>.jsonl，并删除仓库中超过
+    retention_days 天的文件。需要在 repo_lock 中、reset_repo 之后调用，推送成功后把返回值交给 mark_shared。
+
+    Returns:
+        dict: {发布文件名: 已暂存到的字节位置}，没有新条目时为空。
+    """
+    outbox = get_outbox_directory()
+    staged = {}
+    if outbox.exists():
+        pushed = _read_pushed(outbox)
+        chunks = []
+        for f in sorted(outbox.glob("*.jsonl")):
+            done = pushed.get(f.name, 0)
+            if f.stat().st_size < done:
+                done = 0
+            with open(f, 'rb') as fh:
+                fh.seek(done)
+                data = fh.read()
+            end = data.rfind(b'\n') + 1
+            if end:
+                chunks.append(data[:end])
+                staged[f.name] = done + end
+        if chunks:
+            dst_dir.mkdir(parents=True, exist_ok=True)
+            with open(dst_dir / f"{dp_metrics.get_worker_id()}_{time.strftime('%Y%m%d')}.jsonl", 'ab') as out:
+                for chunk in chunks:
+                    out.write(chunk)
+    _prune_shared(dst_dir, float(get_fingerprint_conf()["retention_days"]))
+    return staged
+
+def _prune_shared(dst_dir: Path, retention_days: float):
+    if not dst_dir.is_dir() or retention_days <= 0:
+        return
+    cutoff = time.strftime('%Y%m%d', time.localtime(time.time() - retention_days * 86400))
+    for f in dst_dir.glob("*.jsonl"):
+        # 文件名的日期部分；旧版本按会话命名（<worker>_<日期>-<时间>-<pid>），同样以日期开头
+        day = f.stem.rsplit('_', 1)[-1][:8]
+        if day.isdigit() and day < cutoff:
+            f.unlink()
+
+def mark_shared(staged: dict):
+    """
+    推送成功后记录 stage_shared 暂存到的位置，下次只暂存之后追加的内容；
+    全部推送且 OUTBOX_IDLE_SECONDS 内没有写入的本地发布文件删除。需要在 repo_lock 中调用。
+    """
+    if not staged:
+        return
+    outbox = get_outbox_directory()
+    pushed = {**_read_pushed(outbox), **staged}
+    now = time.time()
+    for name, offset in list(pushed.items()):
+        f = outbox / name
+        try:
+            st = f.stat()
+        except FileNotFoundError:
+            del pushed[name]
+            continue
+        if st.st_size == offset and now - st.st_mtime > OUTBOX_IDLE_SECONDS:
+            f.unlink()
+            del pushed[name]
+    tmp = outbox / (PUSHED_FILE + ".tmp")
+    tmp.write_text(json.dumps(pushed), encoding='utf-8')
+    os.replace(tmp, outbox / PUSHED_FILE)
+
+def sync_shared(index: "FingerprintIndex", logger=None, force: bool = False) -> int:
+    """最多每 sync_interval 秒把队列仓库 fingerprints 目录中其他机器的条目导入本地索引。返回导入的条目数。"""
+    global _synced_at
+    conf = get_fingerprint_conf()
+    if not conf["share"] or (not force and time.time() - _synced_at < conf["sync_interval"]):
+        return 0
+    _synced_at = time.time()
+    from dp_config import get_queue_directory
+    directory = get_queue_directory() / "fingerprints"
+    own = {f.name for f in directory.glob("*.jsonl") if _is_own_shared(f.name)} if directory.is_dir() else set()
+    with dp_metrics.stage('fingerprint_sync'):
+        added = index.import_dir(directory, skip=own)
+    if added and logger:
+        logger.info(f"从队列仓库导入 {added} 个指纹")
+    return added
+
+def load_shared_transcript(bvid: str):
+    """
+    其他机器的条目没有转录结果，从队列仓库的 from_stt 中按 bvid 读取（紧凑格式、.tar.xz 或 .srt/.txt/.text）。
+
+    Returns:
+        bytes | None: transcript_store.Transcript.dumps() 的结果，结果已经被取走时返回 None。
+    """
+    from dp_config import get_queue_directory
+    from transcript_store import COMPACT_SUFFIX, VIEW_SUFFIXES, Transcript, read_view
+    directory = get_queue_directory() / "from_stt"
+    if not directory.is_dir():
+        return None
+    tag = f"[{bvid}]"
+    views = {}
+    for entry in os.scandir(directory):
+        name = entry.name
+        if name.endswith(tag + COMPACT_SUFFIX):
+            return Path(entry.path).read_bytes()
+        if name.endswith(tag + ".tar.xz"):
+            import tarfile
+            with tarfile.open(entry.path, 'r:xz') as tar:
+                for member in tar.getmembers():
+                    suffix = Path(member.name).suffix
+                    if suffix in VIEW_SUFFIXES:
+                        views[suffix] = tar.extractfile(member).read().decode('utf-8')
+        elif any(name.endswith(tag + suffix) for suffix in VIEW_SUFFIXES):
+            views[Path(name).suffix] = read_view(Path(entry.path))
+    if '.srt' not in views:
+        return None
+    return Transcript.from_views(views, {'bvid': bvid}).dumps()
+
+def get_fingerprint_index():
+    """按 config.json 中的 "fingerprint" 设置创建索引，同一个进程共用一个实例，关闭或不可用时返回 None。"""
+    global _index
+    if _unavailable:
+        return None
+    with _lock:
+        if _index is None:
+            from dp_config import resolve_path
+            conf = get_fingerprint_conf()
+            if not conf["enabled"]:
+                return None
+            _index = FingerprintIndex(resolve_path(conf["index_path"]), int(conf["sample"]), int(conf["candidates"]),
+                                      float(conf["duration_tolerance"]), float(conf["max_ber"]), float(conf["min_overlap"]),
+                                      float(conf["min_votes"]))
+        return _index
+
+def fingerprint_file(audio_path: Path, logger=None):
+    """
+    计算指纹。ffmpeg 不存在或不支持 chromaprint 时本进程不再尝试，单个文件无法解码时只跳过这个文件。
+
+    Returns:
+        array.array | None: 指纹，失败时返回 None。
+    """
+    global _unavailable
+    if _unavailable:
+        return None
+    try:
+        with dp_metrics.stage('fingerprint'):
+            return compute_fingerprint(audio_path)
+    except FingerprintUnavailable as e:
+        _unavailable = True
+        if logger:
+            logger.warning(f"{e}，本进程关闭指纹去重")
+        return None
+    except RuntimeError as e:
+        if logger:
+            logger.warning(f"{audio_path.name} {e}，跳过指纹去重")
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="音频指纹索引")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("stats")
+    p_match = sub.add_parser("match", help="在索引中查找与音频文件重复的视频")
+    p_match.add_argument("audio", type=Path)
+    p_match.add_argument("--duration", type=float, default=0)
+    args = parser.parse_args(argv)
+    index = get_fingerprint_index()
+    if index is None:
+        print("指纹去重已关闭")
+        return
+    sync_shared(index, force=True)
+    if args.cmd == "stats":
+        print(json.dumps(index.stats(), ensure_ascii=False))
+    else:
+        fp = compute_fingerprint(args.audio)
+        match = index.lookup(fp, args.duration)
+        if match:
+            score = {'ber': round(match['ber'], 3)} if match['ber'] is not None else {'votes': round(match['votes'], 3)}
+            print(json.dumps({'bvid': match['bvid'], **score, 'offset_seconds': round(match['offset'] * ITEM_SECONDS, 1)}))
+        else:
+            print("没有重复")
+
+if __name__ == "__main__":
+    main()
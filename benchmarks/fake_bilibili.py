@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本地的 Bilibili API 和 CDN 替身服务器，用于离线基准测试。
+
+API 响应以 fixtures/ 中录制的响应为模板，按生成的视频目录填入数据：
+    /x/web-interface/nav, /x/space/wbi/arc/search, /x/web-interface/view, /x/player/wbi/playurl, /x/player/wbi/v2
+音频文件 /audio/<bvid>-<id>.m4s 是按 bvid 确定生成的字节，开头带有时长信息（fake_whisper.py 读取），
+可以配置每个连接的带宽、响应延迟、是否支持 Range（206），以及 API 失败和下载中断的概率。
+按 subtitle_rate 的比例（按 bvid 确定）给视频加上 CC 字幕 /subtitle/<bvid>.json。
+
+单独运行：
+    python benchmarks/fake_bilibili.py --videos 20 --bandwidth 2000000 --port 8765
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+FIXTURES_DIR = Path(__file__).resolve().parent / "fixtures"
+AUDIO_HEADER = b"FAKEAUDIO duration=%.3f\n"
+BV_CHARS = "fZodR9XQDSUm21yCkr6zBqiveYah8bt4xsWpHnJE7jL5VG3guMTKNPAwcF"
+
+class Catalog:
+    def __init__(self, videos: int = 20, ups: int = 3, min_duration: int = 60, max_duration: int = 1800, seed: int = 1):
+        """
+        Args:
+            videos (int, optional): 视频数. 默认为 20.
+            ups (int, optional): UP 主数. 默认为 3.
+            min_duration (int, optional): 最短时长（秒）. 默认为 60.
+            max_duration (int, optional): 最长时长（秒）. 默认为 1800.
+            seed (int, optional): 随机种子，同样的参数总是生成同样的目录. 默认为 1.
+        """
+        rng = random.Random(seed)
+        self.videos = {}
+        for i in range(videos):
+            bvid = "BV1" + "".join(rng.choice(BV_CHARS) for _ in range(9))
+            mid = 1000 + i % ups
+            self.videos[bvid] = {
+                'bvid': bvid,
+                'aid': 100000 + i,
+                'cid': 200000 + i,
+                'mid': mid,
+                'up_name': f"up_{mid}",
+                'title': f"测试视频 {i}",
+                'pubdate': 1700000000 + i * 3600,
+                'duration': rng.randint(min_duration, max_duration),
+            }
+
+    def by_up(self, mid):
+        return sorted((v for v in self.videos.values() if v['mid'] == mid), key=lambda v: -v['pubdate'])
+
+    def task_lines(self):
+        """队列 to_stt 中的任务行，格式与 server_out_queue 领取的任务相同。"""
+        return [json.dumps({'bvid': v['bvid'], 'cid': v['cid'], 'title': v['title'], 'pubdate': v['pubdate'],
+                            'duration': v['duration'], 'up_name': v['up_name'], 'status': 'normal'}, ensure_ascii=False)
+                for v in self.videos.values()]
+
+def audio_size(duration: float, bandwidth: int) -> int:
+    return len(AUDIO_HEADER % duration) + int(duration * bandwidth / 8)
+
+def audio_bytes(bvid: str, duration: float, bandwidth: int, start: int, end: int) -> bytes:
+    """生成 [start, end) 范围内的音频字节，同一个文件的任意范围都是确定的。"""
+    header = AUDIO_HEADER % duration
+    block = hashlib.sha256(bvid.encode()).digest() * 128
+    out = bytearray()
+    pos = start
+    while pos < end:
+        if pos < len(header):
+            piece = header[pos:min(end, len(header))]
+        else:
+            offset = (pos - len(header)) % len(block)
+            piece = block[offset:offset + min(end - pos, len(block) - offset)]
+        out += piece
+        pos += len(piece)
+    return bytes(out)
+
+class FakeBilibili:
+    def __init__(self, catalog: Catalog, host: str = "127.0.0.1", port: int = 0, bandwidth: int = 0, latency: float = 0.0,
+                 support_range: bool = True, api_fail_rate: float = 0.0, drop_rate: float = 0.0, fixtures_dir: Path = FIXTURES_DIR, seed: int = 1,
+                 subtitle_rate: float = 0.0):
+        """
+        Args:
+            catalog (Catalog): 视频目录。
+            host (str, optional): 监听地址. 默认为 127.0.0.1.
+            port (int, optional): 监听端口，0 表示随机. 默认为 0.
+            bandwidth (int, optional): 每个下载连接的带宽（字节/秒），0 表示不限. 默认为 0.
+            latency (float, optional): 每个请求的响应延迟（秒）. 默认为 0.
+            support_range (bool, optional): 是否支持 Range 请求，为 False 时总是返回 200 和完整文件. 默认为 True.
+            api_fail_rate (float, optional): API 请求返回 HTTP 500 的概率. 默认为 0.
+            drop_rate (float, optional): 下载中途断开连接的概率. 默认为 0.
+            fixtures_dir (Path, optional): 录制的响应模板目录.
+            seed (int, optional): 失败注入的随机种子. 默认为 1.
+            subtitle_rate (float, optional): 有 CC 字幕的视频比例. 默认为 0.
+        """
+        self.catalog = catalog
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.support_range = support_range
+        self.api_fail_rate = api_fail_rate
+        self.drop_rate = drop_rate
+        self.subtitle_rate = subtitle_rate
+        self.fixtures = {p.stem: json.loads(p.read_text(encoding='utf-8')) for p in Path(fixtures_dir).glob("*.json")}
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.stats = {'requests': {}, 'bytes_sent': 0, 'api_failures': 0, 'drops': 0, 'range_requests': 0}
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-bilibili", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def _chance(self, rate):
+        if rate <= 0:
+            return False
+        with self.rng_lock:
+            return self.rng.random() < rate
+
+    def _count(self, key, value=1):
+        with self.stats_lock:
+            if key in self.stats:
+                self.stats[key] += value
+            else:
+                self.stats['requests'][key] = self.stats['requests'].get(key, 0) + value
+
+    def fixture(self, name):
+        return copy.deepcopy(self.fixtures[name])
+
+    # --- API 响应 ---
+
+    def api_nav(self, query):
+        return self.fixture('nav')
+
+    def api_arc_search(self, query):
+        mid = int(query.get('mid', 0))
+        pn = int(query.get('pn', 1))
+        ps = int(query.get('ps', 30))
+        videos = self.catalog.by_up(mid)
+        data = self.fixture('arc_search')
+        data['data']['list']['vlist'] = [
+            {'bvid': v['bvid'], 'aid': v['aid'], 'title': v['title'], 'created': v['pubdate'], 'mid': v['mid'],
+             'author': v['up_name'], 'length': f"{v['duration'] // 60:02d}:{v['duration'] % 60:02d}"}
+            for v in videos[(pn - 1) * ps:pn * ps]
+        ]
+        data['data']['page'] = {'pn': pn, 'ps': ps, 'count': len(videos)}
+        return data
+
+    def api_view(self, query):
+        v = self.catalog.videos.get(query.get('bvid'))
+        if v is None:
+            return {'code': -404, 'message': '-404', 'ttl': 1}
+        data = self.fixture('view')
+        data['data'].update(bvid=v['bvid'], aid=v['aid'], cid=v['cid'], title=v['title'], pubdate=v['pubdate'],
+                            duration=v['duration'], owner={'mid': v['mid'], 'name': v['up_name']})
+        return data
+
+    def api_playurl(self, query):
+        v = self.catalog.videos.get(query.get('bvid'))
+        if v is None:
+            return {'code': -404, 'message': '-404', 'ttl': 1}
+        data = self.fixture('playurl')
+        data['data']['timelength'] = v['duration'] * 1000
+        data['data']['dash']['duration'] = v['duration']
+        for audio in data['data']['dash']['audio']:
+            audio['base_url'] = f"{self.base_url}/audio/{v['bvid']}-{audio['id']}.m4s"
+            audio['backup_url'] = []
+        return data
+
+    def has_subtitle(self, bvid: str) -> bool:
+        return int(hashlib.md5(bvid.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF < self.subtitle_rate
+
+    def api_player_v2(self, query):
+        v = self.catalog.videos.get(query.get('bvid'))
+        if v is None:
+            return {'code': -404, 'message': '-404', 'ttl': 1}
+        data = self.fixture('player_v2')
+        data['data'].update(bvid=v['bvid'], cid=v['cid'])
+        if self.has_subtitle(v['bvid']):
+            data['data']['subtitle']['subtitles'] = [
+                {'id': v['cid'], 'lan': 'zh-CN', 'lan_doc': '中文（中国）', 'is_lock': False,
+                 'subtitle_url': f"{self.base_url}/subtitle/{v['bvid']}.json", 'type': 0}
+            ]
+        return data
+
+    def subtitle_body(self, bvid: str):
+        v = self.catalog.videos.get(bvid)
+        if v is None or not self.has_subtitle(bvid):
+            return None
+        body = [{'from': float(s), 'to': float(min(s + 5, v['duration'])), 'location': 2, 'content': f"字幕 {i + 1}"}
+                for i, s in enumerate(range(0, v['duration'], 5))]
+        return {'font_size': 0.4, 'font_color': '#FFFFFF', 'body': body}
+
+    def _make_handler(self):
+        fake = self
+        routes = {
+            '/x/web-interface/nav': self.api_nav,
+            '/x/space/wbi/arc/search': self.api_arc_search,
+            '/x/web-interface/view': self.api_view,
+            '/x/player/wbi/playurl': self.api_playurl,
+            '/x/player/wbi/v2': self.api_player_v2,
+        }
+        audio_re = re.compile(r"^/audio/(BV\w+)-(\d+)\.m4s$")
+        subtitle_re = re.compile(r"^/subtitle/(BV\w+)\.json$")
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                url = urllib.parse.urlsplit(self.path)
+                query = dict(urllib.parse.parse_qsl(url.query))
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if url.path in routes:
+                    fake._count(url.path)
+                    if fake._chance(fake.api_fail_rate):
+                        fake._count('api_failures')
+                        return self._send(500, b"injected failure", "text/plain")
+                    body = json.dumps(routes[url.path](query), ensure_ascii=False).encode('utf-8')
+                    return self._send(200, body, "application/json; charset=utf-8")
+                m = audio_re.match(url.path)
+                if m:
+                    fake._count('/audio')
+                    return self._send_audio(m.group(1), int(m.group(2)))
+                m = subtitle_re.match(url.path)
+                if m and fake.subtitle_body(m.group(1)):
+                    fake._count('/subtitle')
+                    body = json.dumps(fake.subtitle_body(m.group(1)), ensure_ascii=False).encode('utf-8')
+                    return self._send(200, body, "application/json; charset=utf-8")
+                self._send(404, b"not found", "text/plain")
+
+            def _send(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_audio(self, bvid, audio_id):
+                v = fake.catalog.videos.get(bvid)
+                template = {a['id']: a for a in fake.fixtures['playurl']['data']['dash']['audio']}.get(audio_id)
+                if v is None or template is None:
+                    return self._send(404, b"not found", "text/plain")
+                bandwidth = template['bandwidth']
+                size = audio_size(v['duration'], bandwidth)
+                start, end = 0, size
+                range_header = self.headers.get('Range')
+                m = re.match(r"bytes=(\d+)-(\d*)", range_header or "")
+                if m and fake.support_range:
+                    fake._count('range_requests')
+                    start = int(m.group(1))
+                    end = min(size, int(m.group(2)) + 1) if m.group(2) else size
+                    if start >= size:
+                        self.send_response(416)
+                        self.send_header("Content-Range", f"bytes */{size}")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end - 1}/{size}")
+                else:
+                    self.send_response(200)
+                if fake.support_range:
+                    self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Type", "video/mp4")
+                self.send_header("Content-Length", str(end - start))
+                self.end_headers()
+
+                drop_at = None
+                if fake._chance(fake.drop_rate):
+                    with fake.rng_lock:
+                        drop_at = start + int((end - start) * fake.rng.random())
+                chunk = 64 * 1024
+                pos = start
+                began = time.perf_counter()
+                try:
+                    while pos < end:
+                        n = min(chunk, end - pos)
+                        if drop_at is not None and pos + n > drop_at:
+                            self.wfile.write(audio_bytes(bvid, v['duration'], bandwidth, pos, drop_at))
+                            fake._count('bytes_sent', drop_at - pos)
+                            fake._count('drops')
+                            self.close_connection = True
+                            return
+                        self.wfile.write(audio_bytes(bvid, v['duration'], bandwidth, pos, pos + n))
+                        fake._count('bytes_sent', n)
+                        pos += n
+                        if fake.bandwidth:
+                            # 按带宽限速：发送进度超前于时间时等待
+                            ahead = (pos - start) / fake.bandwidth - (time.perf_counter() - began)
+                            if ahead > 0:
+                                time.sleep(ahead)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+
+        return Handler
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地 Bilibili API/CDN 替身服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--videos", type=int, default=20)
+    parser.add_argument("--ups", type=int, default=3)
+    parser.add_argument("--min-duration", type=int, default=60)
+    parser.add_argument("--max-duration", type=int, default=1800)
+    parser.add_argument("--bandwidth", type=int, default=0, help="每个连接的带宽（字节/秒）")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--no-range", action="store_true")
+    parser.add_argument("--api-fail-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--subtitle-rate", type=float, default=0.0, help="有 CC 字幕的视频比例")
+    parser.add_argument("--tasks", type=Path, help="把视频目录写成任务行到这个文件")
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(args.videos, args.ups, args.min_duration, args.max_duration)
+    if args.tasks:
+        args.tasks.write_text("\n".join(catalog.task_lines()) + "\n", encoding='utf-8')
+    fake = FakeBilibili(catalog, args.host, args.port, args.bandwidth, args.latency, not args.no_range, args.api_fail_rate, args.drop_rate,
+                        subtitle_rate=args.subtitle_rate)
+    print(f"监听 {fake.base_url}，设置 DP_BILIBILI_API_BASE={fake.base_url} 使用")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
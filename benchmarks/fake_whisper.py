@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+faster-whisper-xxl 的替身，命令行参数与 process_input.build_whisper_command 相同。
+
+按音频时长 * 实时率（环境变量 FAKE_WHISPER_RTF，默认 0.05）休眠，模拟模型加载（FAKE_WHISPER_STARTUP 秒，默认 0），
+然后在音频旁边写出 .srt/.txt/.text。音频时长从 fake_bilibili 生成的文件头读取，其他文件按 FAKE_WHISPER_BITRATE（默认 132000）估算。
+FAKE_WHISPER_FAIL_RATE 大于 0 时按该概率以返回码 1 退出。
+"""
+
+import os
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from transcript_store import RENDERERS  # noqa: E402
+
+SEGMENT_MS = 5000
+
+def audio_duration(path: Path) -> float:
+    with open(path, 'rb') as f:
+        head = f.read(64)
+    m = re.match(rb"FAKEAUDIO duration=([\d.]+)\n", head)
+    if m:
+        return float(m.group(1))
+    bitrate = float(os.environ.get("FAKE_WHISPER_BITRATE", 132000))
+    return path.stat().st_size * 8 / bitrate
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("用法: fake_whisper.py <audio> [faster-whisper-xxl 参数...]", file=sys.stderr)
+        return 2
+    audio = Path(argv[0])
+    rtf = float(os.environ.get("FAKE_WHISPER_RTF", 0.05))
+    startup = float(os.environ.get("FAKE_WHISPER_STARTUP", 0))
+    fail_rate = float(os.environ.get("FAKE_WHISPER_FAIL_RATE", 0))
+
+    duration = audio_duration(audio)
+    time.sleep(startup + duration * rtf)
+    if fail_rate and random.random() < fail_rate:
+        print("模拟转录失败", file=sys.stderr)
+        return 1
+
+    total_ms = int(duration * 1000)
+    segments = [{'s': s, 'e': min(s + SEGMENT_MS, total_ms), 't': f"第 {i + 1} 段"}
+                for i, s in enumerate(range(0, total_ms, SEGMENT_MS))]
+    for suffix, render in RENDERERS.items():
+        with open(audio.with_suffix(suffix), 'w', encoding='utf-8', newline='') as f:
+            f.write(render(segments))
+    print(f"转录完成: {audio}，时长 {duration:.1f} 秒")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+入口模块的导入耗时和副作用测量。
+
+每个模块在全新的解释器中用 python -X importtime 导入若干次，取累计耗时的中位数，
+同时记录导入了哪些重量级依赖（requests、git、qrcode、tqdm）以及导入后是否留下了文件（config.json、*.log）。
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --rev HEAD~1      # 同时测量某个历史版本，方便对比
+    python benchmarks/import_time.py --json results.jsonl   # 结果追加到文件，跟踪长期变化
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+MODULES = ['process_input', 'server_out_queue', 'server_in_queue', 'server_run', 'supervisor', 'local_runner']
+HEAVY_MODULES = ['requests', 'git', 'qrcode', 'tqdm']
+
+def measure(src_dir: Path, module: str, repeat: int):
+    """
+    Returns:
+        dict: 累计导入耗时中位数（毫秒）、进程总耗时中位数、导入的重量级依赖、留下的文件和错误信息。
+    """
+    cumulative = []
+    wall = []
+    heavy = set()
+    created = set()
+    error = None
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cwd:
+            before = set(os.listdir(src_dir))
+            env = dict(os.environ, PYTHONPATH=str(src_dir))
+            start = time.perf_counter()
+            proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                  cwd=cwd, env=env, capture_output=True, text=True)
+            wall.append((time.perf_counter() - start) * 1000)
+            created |= set(os.listdir(cwd)) | (set(os.listdir(src_dir)) - before)
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            parts = [p.strip() for p in line[len('import time:'):].split('|')]
+            if len(parts) != 3 or not parts[1].isdigit():
+                continue
+            name = parts[2]
+            if name.strip() in HEAVY_MODULES:
+                heavy.add(name.strip())
+            if name == module:
+                cumulative.append(int(parts[1]) / 1000)
+        if proc.returncode != 0:
+            error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"返回码 {proc.returncode}"
+            break
+    for name in created - {'__pycache__'}:
+        # 测量不应该改变仓库，导入时生成的文件测量后删除
+        path = src_dir / name
+        if path.is_file() and name not in before:
+            path.unlink()
+    return {
+        'module': module,
+        'import_ms': round(statistics.median(cumulative), 1) if cumulative else None,
+        'wall_ms': round(statistics.median(wall), 1),
+        'heavy': sorted(heavy),
+        'created': sorted(created - {'__pycache__'}),
+        'error': error,
+    }
+
+def export_rev(rev: str, dst: Path):
+    """把某个 git 版本的文件导出到 dst。"""
+    archive = subprocess.run(['git', '-C', str(REPO_DIR), 'archive', '--format=tar', rev], capture_output=True, check=True)
+    with tarfile.open(fileobj=__import__('io').BytesIO(archive.stdout)) as tar:
+        tar.extractall(dst)
+
+def print_table(label, results):
+    print(f"== {label}")
+    print(f"{'module':<18}{'import ms':>10}{'wall ms':>10}  heavy deps / files created / error")
+    for r in results:
+        imp = '-' if r['import_ms'] is None else f"{r['import_ms']:.1f}"
+        extra = ", ".join(r['heavy'] + [f"+{f}" for f in r['created']])
+        if r['error']:
+            extra = f"{extra} {r['error']}".strip()
+        print(f"{r['module']:<18}{imp:>10}{r['wall_ms']:>10.1f}  {extra}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测量入口模块的导入耗时")
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="每个模块测量的次数")
+    parser.add_argument("-m", "--modules", nargs="+", default=MODULES)
+    parser.add_argument("--rev", help="同时测量这个 git 版本作为对比")
+    parser.add_argument("--json", type=Path, help="把结果追加到这个 JSON-lines 文件")
+    args = parser.parse_args(argv)
+
+    runs = [('working tree', REPO_DIR)]
+    tmp = None
+    if args.rev:
+        tmp = tempfile.TemporaryDirectory()
+        export_rev(args.rev, Path(tmp.name))
+        runs.insert(0, (args.rev, Path(tmp.name)))
+    try:
+        for label, src_dir in runs:
+            results = [measure(src_dir, m, args.repeat) for m in args.modules]
+            print_table(label, results)
+            if args.json:
+                with open(args.json, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'ts': round(time.time()), 'rev': label, 'python': sys.version.split()[0],
+                                        'results': results}, ensure_ascii=False) + "\n")
+    finally:
+        if tmp:
+            tmp.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+基准测试用的本地队列仓库：一个裸仓库作为远程，to_stt 中放入任务行，每个工作进程使用自己的克隆。
+"""
+
+import subprocess
+from pathlib import Path
+
+def git(*args, cwd=None):
+    return subprocess.run(['git', *args], cwd=cwd, check=True, capture_output=True, text=True).stdout
+
+def _configure(repo: Path, name: str):
+    git('config', 'user.name', name, cwd=repo)
+    git('config', 'user.email', f"{name}@localhost", cwd=repo)
+
+def make_remote(root: Path, task_lines, files: int = 1, name: str = "remote.git") -> Path:
+    """
+    创建裸仓库 root / name，任务行平均分到 to_stt 下的 files 个文件中。
+
+    Returns:
+        Path: 裸仓库路径。
+    """
+    root = Path(root)
+    remote = root / name
+    git('init', '--bare', '-q', str(remote))
+    git('symbolic-ref', 'HEAD', 'refs/heads/main', cwd=remote)
+    seed = root / "seed"
+    git('clone', '-q', str(remote), str(seed))
+    _configure(seed, "seed")
+    git('checkout', '-q', '-b', 'main', cwd=seed)
+    (seed / "to_stt").mkdir()
+    (seed / "from_stt").mkdir()
+    (seed / "from_stt" / ".gitkeep").touch()
+    task_lines = list(task_lines)
+    files = max(1, min(files, len(task_lines) or 1))
+    for i in range(files):
+        chunk = task_lines[i::files]
+        if chunk:
+            (seed / "to_stt" / f"tasks_{i:03d}.txt").write_text("\n".join(chunk) + "\n", encoding='utf-8')
+    git('add', '-A', cwd=seed)
+    git('commit', '-q', '-m', 'seed', cwd=seed)
+    git('push', '-q', 'origin', 'main', cwd=seed)
+    return remote
+
+def clone(remote: Path, dst: Path, name: str = "worker") -> Path:
+    git('clone', '-q', str(remote), str(dst))
+    _configure(dst, name)
+    return Path(dst)
+
+def remote_files(remote: Path, directory: str):
+    """远程仓库 main 分支上 directory 中的文件名列表。"""
+    try:
+        out = git('ls-tree', '--name-only', f'main:{directory}', cwd=remote)
+    except subprocess.CalledProcessError:
+        # 目录中的文件都被删除后，git 中就没有这个目录了
+        return []
+    return [name for name in out.splitlines() if name and not name.startswith('.')]
+
+def remaining_tasks(remote: Path) -> int:
+    total = 0
+    for name in remote_files(remote, "to_stt"):
+        total += sum(1 for line in git('show', f'main:to_stt/{name}', cwd=remote).splitlines() if line.strip())
+    return total
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+git 任务队列的争用模拟。
+
+在本地裸仓库上启动 N 个工作进程（每个进程有自己的克隆和配置），用真实的 reset_repo/push_changes
+领取任务（可选同时用 upload_batch 上传结果），记录：
+    领取延迟（p50/p95）、被拒绝的推送次数、重复领取、丢失的任务、远程仓库每秒提交数。
+对多个 N 和多种领取策略分别运行，输出对比表，结果同时追加到 benchmarks/results.jsonl。完全离线运行。
+
+领取策略：
+    first     现有的 server_out_queue.claim_task：取第一个文件的第一行，推送被拒绝后立即重试
+    jitter    同样取第一行，推送被拒绝后随机退避（指数增长）再重试
+    batch:K   一次提交领取 K 行，推送次数减少为 1/K
+
+    python benchmarks/queue_sim.py --workers 1 2 4 8 --strategies first jitter batch:4 --tasks 64
+"""
+
+import argparse
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(REPO_DIR))
+sys.path.insert(0, str(BENCH_DIR))
+
+import queue_remote  # noqa: E402
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+# --- 工作进程 ---
+
+def _take_lines(src_dir: Path, count: int):
+    """从排序后的任务文件中依次取出 count 行并写回文件，返回取出的行。"""
+    taken = []
+    for f in sorted(p for p in src_dir.glob("*") if p.is_file() and not p.name.startswith(".")):
+        lines = f.read_text(encoding='utf-8').splitlines(keepends=True)
+        while lines and len(taken) < count:
+            line = lines.pop(0)
+            if line.strip():
+                taken.append(line.strip())
+        if lines:
+            f.write_text("".join(lines), encoding='utf-8')
+        else:
+            f.unlink()
+        if len(taken) >= count:
+            break
+    return taken
+
+def claim_lines(count: int, jitter: float = 0.0):
+    """
+    用 git_utils 的 reset_repo/push_changes 领取 count 行，推送被拒绝时重试（jitter > 0 时随机指数退避）。
+
+    Returns:
+        list[str]: 领取到的任务行，队列为空时返回空列表。
+    """
+    from dp_config import get_queue_directory
+    from git_utils import repo_lock, reset_repo, push_changes
+    queue_dir = get_queue_directory()
+    attempt = 0
+    while True:
+        with repo_lock(queue_dir):
+            reset_repo(queue_dir)
+            taken = _take_lines(queue_dir / "to_stt", count)
+            if not taken:
+                return []
+            if push_changes(queue_dir, f"领取 {len(taken)} 个任务"):
+                return taken
+        attempt += 1
+        if jitter:
+            time.sleep(random.uniform(0, jitter * (2 ** min(attempt, 6))))
+
+def worker_main(strategy: str, work_time: float, upload: bool):
+    import dp_metrics
+    from dp_config import get_config, get_output_directory
+    get_config()
+    latencies = []
+    claimed = []
+    while True:
+        start = time.perf_counter()
+        if strategy == 'first':
+            from server_out_queue import claim_task
+            line = claim_task(10 ** 9)
+            lines = [line] if line else []
+        elif strategy == 'jitter':
+            lines = claim_lines(1, jitter=0.05)
+        elif strategy.startswith('batch:'):
+            lines = claim_lines(int(strategy.split(':')[1]))
+        else:
+            raise ValueError(f"未知的策略: {strategy}")
+        latencies.append(time.perf_counter() - start)
+        if not lines:
+            break
+        bvids = [json.loads(line)['bvid'] for line in lines]
+        claimed.extend(bvids)
+        if work_time:
+            time.sleep(work_time * len(lines))
+        if upload:
+            from server_in_queue import upload_batch
+            out_dir = get_output_directory()
+            out_dir.mkdir(parents=True, exist_ok=True)
+            files = []
+            for bvid in bvids:
+                f = out_dir / f"[{bvid}].srt"
+                f.write_text(f"1\n00:00:00,000 --> 00:00:01,000\n{bvid}\n\n", encoding='utf-8')
+                files.append(f)
+            upload_batch(files)
+    counters = dp_metrics.session().counters
+    print(json.dumps({'claimed': claimed, 'latencies': latencies, 'push_conflicts': counters.get('push_conflicts', 0)}))
+
+# --- 调度 ---
+
+def run_once(workers: int, strategy: str, tasks: int, queue_files: int, work_time: float, upload: bool, timeout: float):
+    from fake_bilibili import Catalog
+    from run import write_config, worker_env
+    catalog = Catalog(tasks)
+    with tempfile.TemporaryDirectory(prefix="queue_sim_") as tmp:
+        tmp = Path(tmp)
+        remote = queue_remote.make_remote(tmp, catalog.task_lines(), files=queue_files)
+        seed_commits = int(queue_remote.git('rev-list', '--count', 'main', cwd=remote).strip())
+        procs = []
+        for i in range(workers):
+            work = tmp / f"worker{i}"
+            work.mkdir()
+            queue_dir = queue_remote.clone(remote, work / "queue", name=f"worker{i}")
+            config_file = write_config(work / "config.json", work, queue_dir, "http://127.0.0.1:9")
+            procs.append(subprocess.Popen(
+                [sys.executable, str(Path(__file__).resolve()), "_worker", "--strategy", strategy, "--work-time", str(work_time)]
+                + (["--upload"] if upload else []),
+                cwd=work, env=worker_env(config_file, f"sim-{i}"), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True))
+        start = time.perf_counter()
+        reports = []
+        for p in procs:
+            out, _ = p.communicate(timeout=timeout)
+            try:
+                reports.append(json.loads(out.strip().splitlines()[-1]))
+            except (IndexError, json.JSONDecodeError):
+                reports.append({'claimed': [], 'latencies': [], 'push_conflicts': 0, 'crashed': True})
+        wall = time.perf_counter() - start
+        commits = int(queue_remote.git('rev-list', '--count', 'main', cwd=remote).strip()) - seed_commits
+        remaining = queue_remote.remaining_tasks(remote)
+    claims = [b for r in reports for b in r['claimed']]
+    latencies = [x for r in reports for x in r['latencies']]
+    return {
+        'workers': workers,
+        'strategy': strategy,
+        'tasks': tasks,
+        'claimed': len(claims),
+        'duplicates': len(claims) - len(set(claims)),
+        'lost': tasks - remaining - len(set(claims)),
+        'remaining': remaining,
+        'rejected_pushes': int(sum(r['push_conflicts'] for r in reports)),
+        'crashed_workers': sum(1 for r in reports if r.get('crashed')),
+        'wall': round(wall, 2),
+        'claims_per_s': round(len(claims) / wall, 3),
+        'commits_per_s': round(commits / wall, 3),
+        'claim_p50': round(_percentile(latencies, 0.5), 3),
+        'claim_p95': round(_percentile(latencies, 0.95), 3),
+    }
+
+def print_report(rows):
+    cols = ['strategy', 'workers', 'claimed', 'duplicates', 'lost', 'rejected_pushes', 'claims_per_s', 'commits_per_s', 'claim_p50', 'claim_p95', 'wall']
+    print("| " + " | ".join(cols) + " |")
+    print("|" + "|".join("---" for _ in cols) + "|")
+    for r in rows:
+        print("| " + " | ".join(str(r[c]) for c in cols) + " |")
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] == "_worker":
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--strategy", default="first")
+        parser.add_argument("--work-time", type=float, default=0.0)
+        parser.add_argument("--upload", action="store_true")
+        args = parser.parse_args(argv[1:])
+        worker_main(args.strategy, args.work_time, args.upload)
+        return
+
+    parser = argparse.ArgumentParser(description="git 任务队列争用模拟")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="要测试的工作进程数")
+    parser.add_argument("--strategies", nargs="+", default=["first", "jitter", "batch:4"])
+    parser.add_argument("--tasks", type=int, default=48)
+    parser.add_argument("--queue-files", type=int, default=4, help="to_stt 中的任务文件数")
+    parser.add_argument("--work-time", type=float, default=0.0, help="每个任务的模拟处理时间（秒）")
+    parser.add_argument("--upload", action="store_true", help="每次领取后同时用 upload_batch 上传一个假结果")
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument("--results", type=Path, default=BENCH_DIR / "results.jsonl")
+    args = parser.parse_args(argv)
+
+    from run import git_rev
+    rows = []
+    for strategy in args.strategies:
+        for n in args.workers:
+            row = run_once(n, strategy, args.tasks, args.queue_files, args.work_time, args.upload, args.timeout)
+            rows.append(row)
+            print(json.dumps(row, ensure_ascii=False), file=sys.stderr)
+            with open(args.results, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'ts': round(time.time()), 'rev': git_rev(), 'scenario': 'queue_sim',
+                                    'params': {'tasks': args.tasks, 'queue_files': args.queue_files, 'work_time': args.work_time,
+                                               'upload': args.upload},
+                                    'result': row}, ensure_ascii=False) + "\n")
+    print_report(rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+离线基准测试。不访问 bilibili.com，也不需要 GPU：
+API 和 CDN 由 fake_bilibili.py 代替，转录由 fake_whisper.py 代替，队列是本地的裸 git 仓库。
+
+场景：
+    download    并发下载音频，测量吞吐量（可注入限速、延迟、断线、不支持 Range）
+    e2e         用 supervisor.py 跑完整的领取 -> 下载 -> 转录 -> 上传流程，测量每小时完成的任务数
+    contention  N 个工作进程用各自的克隆同时从同一个远程仓库领取任务，测量领取速度和推送冲突（多策略对比见 queue_sim.py）
+    bootstrap   冷启动准备（bootstrap.py）：没有 wheel 缓存、有缓存、有缓存但依次执行三种情况的耗时分解，
+                依赖是本地生成的假 wheel，从本地目录安装到临时目录
+
+每次运行的结果追加到 benchmarks/results.jsonl（带 git 版本），用于跟踪长期变化：
+    python benchmarks/run.py download --videos 8 --concurrency 4 --bandwidth 2000000
+    python benchmarks/run.py e2e --videos 10 --downloaders 2 --transcribers 1 --rtf 0.02
+    python benchmarks/run.py contention --videos 40 --workers 4
+    python benchmarks/run.py bootstrap --wheels 20 --wheel-kb 2000
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(REPO_DIR))
+sys.path.insert(0, str(BENCH_DIR))
+
+from fake_bilibili import Catalog, FakeBilibili, audio_size  # noqa: E402
+import queue_remote  # noqa: E402
+
+FAKE_WHISPER = BENCH_DIR / "fake_whisper.py"
+RESULTS_FILE = BENCH_DIR / "results.jsonl"
+
+def git_rev():
+    try:
+        rev = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+        return rev + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def write_config(path: Path, work_dir: Path, queue_dir: Path, api_base: str, **extra) -> Path:
+    config = {
+        "queue_directory": str(queue_dir),
+        "temp_directory": str(work_dir / "temp"),
+        "output_directory": str(work_dir / "output"),
+        "bv_list_file": str(work_dir / "input.txt"),
+        "stream_segment_seconds": 0,
+        "whisper_path": str(FAKE_WHISPER),
+        "bilibili_api_base": api_base,
+        "task_interval": 0,
+        "upload": {"batch_size": 5, "max_age": 5, "poll_interval": 1, "incomplete_timeout": 60},
+        "logging": {"async_mode": True, "log_dir": str(work_dir / "logs")},
+        # 心跳推送会额外产生提交，影响领取和上传的测量
+        "fleet": {"enabled": False},
+    }
+    config.update(extra)
+    path.write_text(json.dumps(config, ensure_ascii=False, indent=4), encoding='utf-8')
+    return path
+
+def worker_env(config_file: Path, worker_id: str, **extra):
+    env = dict(os.environ, DP_CONFIG_FILE=str(config_file), DP_WORKER_ID=worker_id, PYTHONPATH=str(REPO_DIR))
+    env.update({k: str(v) for k, v in extra.items()})
+    return env
+
+def metrics_summary(*dirs):
+    import dp_metrics
+    paths = [d for d in dirs if Path(d).exists()]
+    return dp_metrics.summarize(list(dp_metrics.iter_records(paths))) if paths else {}
+
+def fake_server(args, catalog):
+    return FakeBilibili(catalog, bandwidth=args.bandwidth, latency=args.latency, support_range=not args.no_range,
+                        api_fail_rate=args.api_fail_rate, drop_rate=args.drop_rate, subtitle_rate=args.subtitle_rate)
+
+def scenario_download(args, tmp: Path):
+    from dp_bilibili_api import dp_bilibili, download_file_with_resume
+    catalog = Catalog(args.videos, min_duration=args.min_duration, max_duration=args.max_duration)
+    with fake_server(args, catalog) as fake:
+        client = dp_bilibili(api_base=fake.base_url, retry_interval=0)
+        lock = threading.Lock()
+        per_file = []
+
+        def download(v):
+            track = client.get_audio_track(v['bvid'], v['cid'])
+            url = track['url']
+            path = tmp / f"{v['bvid']}.m4s"
+            start = time.perf_counter()
+            attempts = 0
+            # 断线后续传，最多尝试 max_attempts 次
+            while attempts < args.max_attempts:
+                attempts += 1
+                if download_file_with_resume(client.session, url, path):
+                    break
+            elapsed = time.perf_counter() - start
+            expected = audio_size(v['duration'], track['bandwidth'])
+            ok = path.exists() and path.stat().st_size == expected
+            with lock:
+                per_file.append({'bytes': path.stat().st_size if path.exists() else 0, 'seconds': elapsed, 'attempts': attempts, 'ok': ok})
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(download, catalog.videos.values()))
+        wall = time.perf_counter() - start
+        total = sum(f['bytes'] for f in per_file)
+        return {
+            'files': len(per_file),
+            'failed': sum(1 for f in per_file if not f['ok']),
+            'bytes': total,
+            'wall': round(wall, 3),
+            'mb_per_s': round(total / wall / 1e6, 3),
+            'per_file_mb_per_s': round(sorted(f['bytes'] / f['seconds'] / 1e6 for f in per_file)[len(per_file) // 2], 3),
+            'resumes': sum(f['attempts'] - 1 for f in per_file),
+            'server': fake.stats,
+        }
+
+def scenario_e2e(args, tmp: Path):
+    catalog = Catalog(args.videos, min_duration=args.min_duration, max_duration=args.max_duration)
+    remote = queue_remote.make_remote(tmp, catalog.task_lines(), files=args.queue_files)
+    work = tmp / "worker"
+    work.mkdir()
+    queue_dir = queue_remote.clone(remote, work / "queue")
+    with fake_server(args, catalog) as fake:
+        config_file = write_config(work / "config.json", work, queue_dir, fake.base_url,
+                                   supervisor={"fetchers": 1, "downloaders": args.downloaders, "transcribers": args.transcribers,
+                                               "prefetch": args.downloaders + args.transcribers, "duration_limit": 10 ** 9,
+                                               "status_interval": 10})
+        env = worker_env(config_file, "bench-e2e", FAKE_WHISPER_RTF=args.rtf, FAKE_WHISPER_STARTUP=args.whisper_startup)
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, str(REPO_DIR / "supervisor.py")], cwd=work, env=env,
+                              capture_output=True, text=True, timeout=args.timeout)
+        wall = time.perf_counter() - start
+    results = {f.split('[')[-1].split(']')[0] for f in queue_remote.remote_files(remote, "from_stt")}
+    done = len(results & set(catalog.videos))
+    audio_hours = sum(catalog.videos[b]['duration'] for b in results & set(catalog.videos)) / 3600
+    return {
+        'returncode': proc.returncode,
+        'tasks': len(catalog.videos),
+        'done': done,
+        'remaining': queue_remote.remaining_tasks(remote),
+        'wall': round(wall, 3),
+        'tasks_per_hour': round(done * 3600 / wall, 1),
+        'audio_hours_per_hour': round(audio_hours * 3600 / wall, 2),
+        'metrics': metrics_summary(work / "temp" / "metrics"),
+        'server': fake.stats,
+    }
+
+def scenario_contention(args, tmp: Path):
+    # 详细的多策略对比见 queue_sim.py，这里只测量现有的领取方式
+    from queue_sim import run_once
+    return run_once(args.workers, 'first', args.videos, args.queue_files, 0.0, False, args.timeout)
+
+def make_wheel(dst_dir: Path, name: str, version: str, size: int) -> Path:
+    """生成一个可以安装的最小 wheel，包含 size 字节的随机数据（不可压缩，接近真实 wheel 的复制耗时）。"""
+    dist_info = f"{name}-{version}.dist-info"
+    files = {
+        f"{name}/__init__.py": b"",
+        f"{name}/data.bin": os.urandom(size),
+        f"{dist_info}/METADATA": f"Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n".encode(),
+        f"{dist_info}/WHEEL": b"Wheel-Version: 1.0\nGenerator: bench\nRoot-Is-Purelib: true\nTag: py3-none-any\n",
+    }
+    record = []
+    for path, data in files.items():
+        digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b"=").decode()
+        record.append(f"{path},sha256={digest},{len(data)}")
+    record.append(f"{dist_info}/RECORD,,")
+    files[f"{dist_info}/RECORD"] = ("\n".join(record) + "\n").encode()
+    wheel = dst_dir / f"{name}-{version}-py3-none-any.whl"
+    with zipfile.ZipFile(wheel, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for path, data in files.items():
+            zf.writestr(path, data)
+    return wheel
+
+def scenario_bootstrap(args, tmp: Path):
+    index = tmp / "index"
+    index.mkdir()
+    names = [f"benchpkg{i:03d}" for i in range(args.wheels)]
+    for name in names:
+        make_wheel(index, name, "1.0", args.wheel_kb * 1024)
+    requirements = tmp / "requirements.txt"
+    requirements.write_text("".join(f"{name}==1.0\n" for name in names), encoding='utf-8')
+    catalog = Catalog(args.videos, min_duration=args.min_duration, max_duration=args.max_duration)
+    remote = queue_remote.make_remote(tmp, catalog.task_lines(), files=args.queue_files)
+    work = tmp / "worker"
+    work.mkdir()
+    bootstrap_conf = {
+        "requirements": [str(requirements)],
+        "wheel_cache": str(tmp / "drive" / "wheels"),
+        "local_wheels": str(work / "wheels"),
+        # 假的 PyPI：只从本地目录获取，安装到临时目录，不改变运行基准测试的环境
+        "pip_args": ["--no-index", "--find-links", str(index)],
+        "install_args": ["--target", str(work / "site")],
+        "queue_url": str(remote),
+    }
+    config_file = write_config(work / "config.json", work, work / "queue", "", bootstrap=bootstrap_conf)
+    env = worker_env(config_file, "bench-bootstrap")
+    runs = {}
+    for label, extra in (('cold', []), ('warm', []), ('warm_sequential', ['--sequential'])):
+        # 每次都模拟新的运行时：本地的 wheel、安装目录和队列仓库都不存在，只有 Drive 上的缓存保留
+        for d in ('wheels', 'site', 'queue'):
+            shutil.rmtree(work / d, ignore_errors=True)
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, str(REPO_DIR / "bootstrap.py"), "--json", *extra], cwd=work, env=env,
+                              capture_output=True, text=True, timeout=args.timeout)
+        wall = time.perf_counter() - start
+        lines = proc.stdout.strip().splitlines()
+        result = json.loads(lines[-1]) if proc.returncode == 0 and lines else {'error': proc.stderr.strip()[-500:]}
+        runs[label] = {'returncode': proc.returncode, 'wall': round(wall, 3), **result}
+    return {
+        'wheels': args.wheels,
+        'wheel_mb': round(args.wheels * args.wheel_kb / 1024, 1),
+        'runs': runs,
+        'speedup': round(runs['cold']['wall'] / runs['warm']['wall'], 2) if runs['warm']['wall'] else None,
+    }
+
+SCENARIOS = {'download': scenario_download, 'e2e': scenario_e2e, 'contention': scenario_contention, 'bootstrap': scenario_bootstrap}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线基准测试")
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--videos", type=int, default=10)
+    parser.add_argument("--min-duration", type=int, default=60)
+    parser.add_argument("--max-duration", type=int, default=600)
+    parser.add_argument("--bandwidth", type=int, default=0, help="每个下载连接的带宽（字节/秒），0 表示不限")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个请求的延迟（秒）")
+    parser.add_argument("--no-range", action="store_true", help="服务器不支持 Range 请求")
+    parser.add_argument("--api-fail-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="下载中途断线的概率")
+    parser.add_argument("--subtitle-rate", type=float, default=0.0, help="有 CC 字幕（可以跳过下载和转录）的视频比例")
+    parser.add_argument("--concurrency", type=int, default=4, help="download: 并发下载数")
+    parser.add_argument("--max-attempts", type=int, default=10, help="download: 每个文件最多尝试次数")
+    parser.add_argument("--downloaders", type=int, default=1, help="e2e: 下载进程数")
+    parser.add_argument("--transcribers", type=int, default=1, help="e2e: 转录进程数")
+    parser.add_argument("--rtf", type=float, default=0.01, help="e2e: 假转录的实时率")
+    parser.add_argument("--whisper-startup", type=float, default=0.0, help="e2e: 假转录的启动耗时（秒）")
+    parser.add_argument("--workers", type=int, default=4, help="contention: 工作进程数")
+    parser.add_argument("--queue-files", type=int, default=1, help="to_stt 中的任务文件数")
+    parser.add_argument("--wheels", type=int, default=20, help="bootstrap: 依赖的 wheel 数")
+    parser.add_argument("--wheel-kb", type=int, default=1000, help="bootstrap: 每个 wheel 的大小（KB）")
+    parser.add_argument("--timeout", type=float, default=1800)
+    parser.add_argument("--results", type=Path, default=RESULTS_FILE, help="结果追加到这个文件")
+    parser.add_argument("--keep", action="store_true", help="保留临时目录")
+    args = parser.parse_args(argv)
+
+    tmp = Path(tempfile.mkdtemp(prefix=f"bench_{args.scenario}_"))
+    try:
+        result = SCENARIOS[args.scenario](args, tmp)
+    finally:
+        if args.keep:
+            print(f"临时目录: {tmp}")
+        else:
+            shutil.rmtree(tmp, ignore_errors=True)
+    params = {k: v for k, v in vars(args).items() if k not in ('scenario', 'results', 'keep')}
+    record = {'ts': round(time.time()), 'rev': git_rev(), 'scenario': args.scenario, 'params': params, 'result': result}
+    with open(args.results, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    print(json.dumps(result, ensure_ascii=False, indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Colab 工作机的启动准备，代替 notebook 中的 pip install 和 chmod。
+
+- 依赖：requirements 中各文件的内容（连同 Python 版本、平台和 pip_args）计算出锁哈希，
+  Drive 上的 wheel_cache/<锁哈希>/ 中保存了对应的全部 wheel 和 lock.json（锁哈希和每个 wheel 的 sha256）。
+  命中时把 wheel 复制到本地、逐个校验后用 pip install --no-index 离线安装；没有命中或校验失败时用 pip wheel
+  下载并构建全部依赖，安装后保存到 Drive（先写临时目录再改名，其他机器不会读到一半的缓存），只保留最近 keep 份。
+  同一个运行时中已经安装过同样的锁哈希时直接跳过。
+- 队列仓库：与依赖安装同时进行。已经克隆时 fetch 后重置到远程分支，否则从 queue_url 克隆。
+  这时 GitPython 可能还没有安装，所以直接调用 git 命令。
+- 转录程序：whisper_path 和 executables 中的文件没有执行权限时加上。
+
+每一步的耗时计入会话统计的 bootstrap_* 阶段（见 dp_metrics summary），并在结束时输出。
+在 config.json 中配置（以下是默认值）：
+
+    "bootstrap": {"requirements": ["blbldl/requirements.txt"], "wheel_cache": "/content/drive/MyDrive/colab_blbl2txt_cache/wheels",
+                  "local_wheels": "/content/wheels", "pip_args": [], "install_args": [], "executables": [],
+                  "queue_url": null, "queue_clone_depth": 0, "keep": 2}
+
+命令行：
+    python bootstrap.py [--sequential] [--skip-deps] [--skip-queue] [--json]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import stat
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import dp_metrics
+from dp_logging import setup_logger
+
+logger = setup_logger(Path(__file__).stem)
+
+DEFAULT_CONF = {
+    "requirements": ["blbldl/requirements.txt"],
+    "wheel_cache": "/content/drive/MyDrive/colab_blbl2txt_cache/wheels",
+    "local_wheels": "/content/wheels",
+    "pip_args": [],
+    "install_args": [],
+    "executables": [],
+    "queue_url": None,
+    "queue_clone_depth": 0,
+    "keep": 2,
+}
+
+LOCK_FILE = "lock.json"
+INSTALLED_FILE = ".installed"
+
+def get_bootstrap_conf() -> dict:
+    from dp_config import get_config
+    return {**DEFAULT_CONF, **get_config().get("bootstrap", {})}
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def lock_hash(requirement_files, pip_args=()) -> str:
+    """
+    依赖的锁哈希。requirements 文件中的注释、空行和行的顺序不影响结果。
+
+    Returns:
+        str: 16 位十六进制字符串。
+    """
+    h = hashlib.sha256()
+    h.update(f"{sys.version_info.major}.{sys.version_info.minor} {platform.machine()}\n".encode())
+    h.update(json.dumps(list(pip_args)).encode())
+    for f in requirement_files:
+        lines = {line.split('#', 1)[0].strip() for line in Path(f).read_text(encoding='utf-8').splitlines()}
+        h.update("\n".join(sorted(line for line in lines if line)).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+def verify_wheels(wheel_dir: Path, lock: dict, key: str) -> bool:
+    """检查 wheel_dir 中的 wheel 与 lock.json 一致：锁哈希相同，每个文件都存在且 sha256 相同。"""
+    if lock.get('hash') != key or not lock.get('wheels'):
+        return False
+    for name, digest in lock['wheels'].items():
+        path = wheel_dir / name
+        if not path.is_file() or _sha256(path) != digest:
+            logger.warning(f"wheel 缓存中的 {name} 校验失败")
+            return False
+    return True
+
+def restore_wheels(cache_dir: Path, local_dir: Path, key: str) -> bool:
+    """
+    把 Drive 上锁哈希为 key 的 wheel 缓存复制到 local_dir 并校验。
+
+    Returns:
+        bool: 缓存存在且校验通过返回 True。
+    """
+    src = cache_dir / key
+    try:
+        lock = json.loads((src / LOCK_FILE).read_text(encoding='utf-8'))
+    except (OSError, json.JSONDecodeError):
+        return False
+    if local_dir.exists():
+        shutil.rmtree(local_dir)
+    local_dir.mkdir(parents=True)
+    for name in lock.get('wheels', {}):
+        try:
+            shutil.copy2(src / name, local_dir / name)
+        except OSError as e:
+            logger.warning(f"复制 wheel 缓存 {name} 失败: {e}")
+            return False
+    # 校验复制到本地的文件，安装的就是校验过的内容
+    return verify_wheels(local_dir, lock, key)
+
+def save_wheels(local_dir: Path, cache_dir: Path, key: str, keep: int = 2):
+    """把 local_dir 中的 wheel 连同 lock.json 保存到 Drive，只保留最近 keep 份缓存。"""
+    wheels = {f.name: _sha256(f) for f in sorted(local_dir.glob("*.whl"))}
+    lock = {'hash': key, 'python': platform.python_version(), 'created': int(time.time()), 'wheels': wheels}
+    tmp = cache_dir / f".{key}.{os.getpid()}.tmp"
+    if tmp.exists():
+        shutil.rmtree(tmp)
+    tmp.mkdir(parents=True)
+    for name in wheels:
+        shutil.copy2(local_dir / name, tmp / name)
+    (tmp / LOCK_FILE).write_text(json.dumps(lock, indent=2), encoding='utf-8')
+    dst = cache_dir / key
+    if dst.exists():
+        shutil.rmtree(dst)
+    os.replace(tmp, dst)
+    snapshots = sorted((d for d in cache_dir.iterdir() if d.is_dir() and not d.name.startswith('.')),
+                       key=lambda d: d.stat().st_mtime, reverse=True)
+    for old in snapshots[max(keep, 1):]:
+        shutil.rmtree(old, ignore_errors=True)
+
+def _pip(*args):
+    subprocess.run([sys.executable, '-m', 'pip', *args], check=True)
+
+def install_wheels(local_dir: Path, requirement_files, install_args=()):
+    requirements = [arg for f in requirement_files for arg in ('-r', str(f))]
+    _pip('install', '--no-index', '--find-links', str(local_dir), *install_args, *requirements)
+
+def build_wheels(local_dir: Path, requirement_files, pip_args=()):
+    """下载并构建全部依赖（包括已经安装的）的 wheel。"""
+    if local_dir.exists():
+        shutil.rmtree(local_dir)
+    local_dir.mkdir(parents=True)
+    requirements = [arg for f in requirement_files for arg in ('-r', str(f))]
+    _pip('wheel', '-w', str(local_dir), *pip_args, *requirements)
+
+class Bootstrap:
+    def __init__(self, conf: dict):
+        self.conf = conf
+        self.timings = {}
+        self.result = {}
+
+    @contextmanager
+    def step(self, name: str):
+        """统计一步的耗时，计入会话统计的 bootstrap_<name> 阶段。"""
+        start = time.perf_counter()
+        with dp_metrics.stage(f"bootstrap_{name}"):
+            yield
+        self.timings[name] = round(time.perf_counter() - start, 3)
+
+    def setup_deps(self):
+        from dp_config import resolve_path
+        files = []
+        for f in self.conf["requirements"]:
+            path = resolve_path(f)
+            if path.exists():
+                files.append(path)
+            else:
+                logger.warning(f"依赖文件 {path} 不存在，跳过")
+        if not files:
+            self.result['deps'] = 'none'
+            return
+        key = lock_hash(files, self.conf["pip_args"])
+        local_dir = Path(self.conf["local_wheels"])
+        cache_dir = resolve_path(self.conf["wheel_cache"])
+        marker = local_dir / INSTALLED_FILE
+        if marker.exists() and marker.read_text(encoding='utf-8').strip() == key:
+            logger.info(f"依赖 {key} 已经安装，跳过")
+            self.result['deps'] = 'installed'
+            return
+        with self.step('restore'):
+            hit = restore_wheels(cache_dir, local_dir, key)
+        if hit:
+            dp_metrics.incr('bootstrap_cache_hits')
+            logger.info(f"使用 wheel 缓存 {key}")
+        else:
+            dp_metrics.incr('bootstrap_cache_misses')
+            logger.info(f"没有可用的 wheel 缓存 {key}，下载并构建依赖")
+            with self.step('build'):
+                build_wheels(local_dir, files, self.conf["pip_args"])
+        with self.step('install'):
+            install_wheels(local_dir, files, self.conf["install_args"])
+        if not hit:
+            with self.step('save'):
+                try:
+                    save_wheels(local_dir, cache_dir, key, self.conf["keep"])
+                except OSError as e:
+                    logger.warning(f"保存 wheel 缓存失败: {e}")
+        marker.write_text(key, encoding='utf-8')
+        self.result['deps'] = 'hit' if hit else 'miss'
+        self.result['lock'] = key
+
+    def setup_queue(self):
+        from dp_config import get_queue_directory
+        queue_dir = get_queue_directory()
+        if (queue_dir / ".git").exists():
+            branch = subprocess.run(['git', 'rev-parse', '--abbrev-ref', 'HEAD'], cwd=queue_dir,
+                                    check=True, capture_output=True, text=True).stdout.strip()
+            subprocess.run(['git', 'fetch', '--prune', 'origin'], cwd=queue_dir, check=True)
+            subprocess.run(['git', 'reset', '-q', '--hard', f'origin/{branch}'], cwd=queue_dir, check=True)
+            subprocess.run(['git', 'clean', '-fdq'], cwd=queue_dir, check=True)
+            self.result['queue'] = 'synced'
+        elif self.conf["queue_url"]:
+            depth = ['--depth', str(self.conf["queue_clone_depth"])] if self.conf["queue_clone_depth"] > 0 else []
+            subprocess.run(['git', 'clone', '-q', *depth, self.conf["queue_url"], str(queue_dir)], check=True)
+            self.result['queue'] = 'cloned'
+        else:
+            logger.warning(f"队列目录 {queue_dir} 不是 git 仓库，也没有配置 queue_url，跳过")
+            self.result['queue'] = 'none'
+
+    def setup_executables(self):
+        from dp_config import get_config, resolve_path
+        from process_input import WHISPER
+        paths = [get_config().get("whisper_path", WHISPER), *self.conf["executables"]]
+        for p in paths:
+            path = resolve_path(p)
+            if path.is_file() and not os.access(path, os.X_OK):
+                path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+                logger.info(f"已为 {path} 加上执行权限")
+
+    def run(self, deps: bool = True, queue: bool = True, parallel: bool = True) -> dict:
+        """
+        执行启动准备，依赖和队列仓库默认同时进行。
+
+        Returns:
+            dict: 各步骤的结果和耗时（秒），total 是总耗时。
+        """
+        start = time.perf_counter()
+        jobs = []
+        if deps:
+            jobs.append(('deps', self.setup_deps))
+        if queue:
+            jobs.append(('queue', self.setup_queue))
+        with ThreadPoolExecutor(len(jobs) if parallel and jobs else 1) as pool:
+            futures = [pool.submit(self._timed, name, func) for name, func in jobs]
+            with self.step('executables'):
+                self.setup_executables()
+            errors = [f.exception() for f in futures if f.exception()]
+        self.timings['total'] = round(time.perf_counter() - start, 3)
+        if errors:
+            raise errors[0]
+        return {**self.result, 'timings': self.timings}
+
+    def _timed(self, name, func):
+        with self.step(name):
+            func()
+
+def format_timings(result: dict) -> str:
+    timings = result['timings']
+    parts = [f"{name} {seconds:.1f}s" for name, seconds in timings.items() if name != 'total']
+    status = "，".join(f"{k}={v}" for k, v in result.items() if k in ('deps', 'queue'))
+    return f"启动准备用时 {timings['total']:.1f} 秒（{'，'.join(parts)}）{status}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Colab 工作机的启动准备")
+    parser.add_argument("--sequential", action="store_true", help="依次准备依赖和队列仓库（用于对比）")
+    parser.add_argument("--skip-deps", action="store_true", help="不安装依赖")
+    parser.add_argument("--skip-queue", action="store_true", help="不准备队列仓库")
+    parser.add_argument("--json", action="store_true", help="最后一行输出 JSON 格式的结果")
+    args = parser.parse_args(argv)
+
+    result = Bootstrap(get_bootstrap_conf()).run(not args.skip_deps, not args.skip_queue, not args.sequential)
+    logger.info(format_timings(result))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+CPU 转录工作模式。
+
+没有 GPU 的多核服务器用 int8 量化的 faster-whisper（CTranslate2）模型转录队列中较短的视频：
+- 每台机器同时运行 decoders 个转录进程（supervisor 的 transcribe 阶段），每个进程加载自己的模型，
+  使用 cpu_threads 个线程（intra-op），默认把所有核平均分给各个进程；num_workers 是每个模型的并行转录数（inter-op）。
+- 领取任务时只领取能在 deadline 秒内转录完成的任务：时长上限 = deadline / 实时率（见 server_out_queue.route_limits）。
+- 每个任务的实时率（转录耗时 / 音频时长）按线程数记录到 TEMP_DIR/cpu_rtf.json（指数滑动平均），
+  下一次领取时用于计算时长上限；没有记录时使用配置中的 rtf。任务统计中也记录 rtf 和 cpu_threads，
+  dp_metrics summary 按线程数汇总。
+
+需要安装 faster-whisper（pip install faster-whisper）。在 config.json 中配置（以下是默认值）：
+
+    "cpu_worker": {"model": "small", "compute_type": "int8", "model_dir": null, "decoders": 0, "cpu_threads": 0,
+                   "num_workers": 1, "beam_size": 5, "language": "zh", "deadline": 1800, "rtf": 0.5}
+
+decoders 和 cpu_threads 为 0 时自动计算。
+
+命令行：
+    python cpu_worker.py run [--decoders N] [--cpu-threads N] [--deadline 秒]
+    python cpu_worker.py bench <音频文件> [--threads 1 2 4 8]
+    python cpu_worker.py stats
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import dp_metrics
+from dp_logging import setup_logger
+
+logger = setup_logger(Path(__file__).stem)
+
+DEFAULT_CONF = {
+    "model": "small",
+    "compute_type": "int8",
+    "model_dir": None,
+    "decoders": 0,
+    "cpu_threads": 0,
+    "num_workers": 1,
+    "beam_size": 5,
+    "language": "zh",
+    "deadline": 1800,
+    "rtf": 0.5,
+}
+
+def get_cpu_conf(overrides: dict = None) -> dict:
+    """
+    config.json 中的 "cpu_worker"，decoders 和 cpu_threads 为 0 时按 CPU 核数计算。
+
+    Args:
+        overrides (dict, optional): 覆盖配置的值（例如命令行参数），值为 None 的忽略. 默认为 None.
+    """
+    from dp_config import get_config
+    conf = {**DEFAULT_CONF, **get_config().get("cpu_worker", {}),
+            **{k: v for k, v in (overrides or {}).items() if v is not None}}
+    cpus = os.cpu_count() or 1
+    if conf["decoders"] <= 0:
+        # 每个解码进程至少 4 个线程，线程太少时单个任务太慢，赶不上期限
+        conf["decoders"] = max(1, cpus // 4)
+    if conf["cpu_threads"] <= 0:
+        conf["cpu_threads"] = max(1, cpus // conf["decoders"])
+    return conf
+
+class RtfStats:
+    """按线程数记录的实时率（指数滑动平均），同一台机器上的多个进程共用一个文件。"""
+
+    def __init__(self, path: Path, alpha: float = 0.2):
+        self.path = Path(path)
+        self.alpha = alpha
+
+    def load(self) -> dict:
+        try:
+            return json.loads(self.path.read_text(encoding='utf-8'))
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def estimate(self, threads: int, default: float) -> float:
+        entry = self.load().get(str(threads))
+        return entry['rtf'] if entry else default
+
+    def record(self, threads: int, rtf: float):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # 多个转录进程同时记录时，读取-修改-写入必须串行，否则后写的会覆盖先写的；读取的一方只看到完整的文件（os.replace）
+        with open(self.path.with_name(f".{self.path.name}.lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                stats = self.load()
+                entry = stats.get(str(threads))
+                if entry:
+                    entry = {'rtf': entry['rtf'] + self.alpha * (rtf - entry['rtf']), 'samples': entry['samples'] + 1}
+                else:
+                    entry = {'rtf': rtf, 'samples': 1}
+                stats[str(threads)] = entry
+                tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+                tmp.write_text(json.dumps(stats, sort_keys=True), encoding='utf-8')
+                os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+def get_rtf_stats() -> RtfStats:
+    from dp_config import get_temp_directory
+    return RtfStats(get_temp_directory() / "cpu_rtf.json")
+
+def max_task_duration(conf: dict = None) -> int:
+    """CPU 模式在 deadline 秒内能转录完的最长音频时长（秒）。"""
+    conf = conf or get_cpu_conf()
+    rtf = get_rtf_stats().estimate(conf["cpu_threads"], conf["rtf"])
+    return int(conf["deadline"] / max(rtf, 1e-3))
+
+_model = None
+_model_lock = threading.Lock()
+
+def load_model(conf: dict, cpu_threads: int = None):
+    """加载 int8 模型，同一个进程共用一个实例（指定 cpu_threads 时重新加载）。"""
+    global _model
+    try:
+        from faster_whisper import WhisperModel
+    except ImportError as e:
+        raise RuntimeError("CPU 转录模式需要安装 faster-whisper: pip install faster-whisper") from e
+    cpu_threads = cpu_threads or conf["cpu_threads"]
+    with _model_lock:
+        if _model is None or _model[0] != cpu_threads:
+            logger.info(f"加载模型 {conf['model']}（{conf['compute_type']}，{cpu_threads} 线程）")
+            model = WhisperModel(conf["model"], device="cpu", compute_type=conf["compute_type"], cpu_threads=cpu_threads,
+                                 num_workers=conf["num_workers"], download_root=conf["model_dir"])
+            _model = (cpu_threads, model)
+        return _model[1]
+
+def transcribe_segments(audio_path: Path, conf: dict, cpu_threads: int = None):
+    """
+    转录音频。
+
+    Returns:
+        tuple[list[dict], float]: (分段列表 {'s', 'e', 't'}，音频时长秒数)。
+    """
+    model = load_model(conf, cpu_threads)
+    segments, info = model.transcribe(str(audio_path), language=conf["language"], beam_size=conf["beam_size"], vad_filter=True)
+    result = []
+    # segments 是生成器，边转录边产出，每个分段报告一次进度
+    for seg in segments:
+        result.append({'s': int(round(seg.start * 1000)), 'e': int(round(seg.end * 1000)), 't': seg.text.strip()})
+        dp_metrics.progress(seg.end / info.duration if info.duration else None)
+    return result, info.duration
+
+def transcribe_cpu(audio_path: Path, duration: float = None, conf: dict = None):
+    """
+    用 int8 模型转录 audio_path，在旁边生成 .srt/.txt/.text，并记录本次的实时率。
+
+    Args:
+        audio_path (Path): 音频文件。
+        duration (float, optional): 视频时长（秒），音频信息中没有时长时使用. 默认为 None.
+        conf (dict, optional): CPU 模式的配置. 默认为 get_cpu_conf().
+    """
+    from transcript_store import RENDERERS, write_view
+    conf = conf or get_cpu_conf()
+    start = time.time()
+    with dp_metrics.stage('transcribe'):
+        segments, audio_duration = transcribe_segments(audio_path, conf)
+    elapsed = time.time() - start
+    for suffix, render in RENDERERS.items():
+        write_view(audio_path.with_suffix(suffix), render(segments))
+    audio_duration = audio_duration or duration
+    if audio_duration:
+        rtf = elapsed / audio_duration
+        get_rtf_stats().record(conf["cpu_threads"], rtf)
+        metrics = dp_metrics.current()
+        if isinstance(metrics, dp_metrics.TaskMetrics):
+            metrics.set('transcriber', 'cpu')
+            metrics.set('cpu_threads', conf["cpu_threads"])
+            metrics.set('rtf', round(rtf, 4))
+        logger.info(f"CPU 转录 {audio_duration:.0f} 秒音频用时 {elapsed:.1f} 秒，实时率 {rtf:.3f}（{conf['cpu_threads']} 线程）")
+
+def bench(audio_path: Path, threads_list, conf: dict):
+    """用不同的线程数转录同一个音频，返回 [{'cpu_threads', 'seconds', 'rtf'}]。"""
+    results = []
+    for threads in threads_list:
+        # 第一次调用包含模型加载，先预热
+        load_model(conf, threads)
+        start = time.time()
+        _, duration = transcribe_segments(audio_path, conf, threads)
+        elapsed = time.time() - start
+        results.append({'cpu_threads': threads, 'seconds': round(elapsed, 1),
+                        'rtf': round(elapsed / duration, 4) if duration else None})
+        print(json.dumps(results[-1]))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="CPU int8 转录工作模式")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_run = sub.add_parser("run", help="用 supervisor 流水线领取并转录短视频")
+    p_run.add_argument("--decoders", type=int, help="同时转录的进程数")
+    p_run.add_argument("--cpu-threads", type=int, help="每个转录进程的线程数")
+    p_run.add_argument("--deadline", type=int, help="每个任务必须在该秒数内转录完成")
+    p_run.add_argument("--downloaders", type=int, default=2)
+    p_bench = sub.add_parser("bench", help="测量不同线程数的实时率")
+    p_bench.add_argument("audio", type=Path)
+    p_bench.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    sub.add_parser("stats", help="输出本机记录的各线程数的实时率")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "stats":
+        print(json.dumps(get_rtf_stats().load(), ensure_ascii=False, indent=2))
+        return
+    if args.cmd == "bench":
+        bench(args.audio, args.threads, get_cpu_conf())
+        return
+
+    conf = get_cpu_conf({'decoders': args.decoders, 'cpu_threads': args.cpu_threads, 'deadline': args.deadline})
+    from dp_config import get_bv_list_file
+    from server_in_queue import ResultUploader
+    from server_out_queue import route_limits
+    from supervisor import Supervisor
+    duration_limit, limit_type = route_limits(transcriber="cpu", cpu_conf=conf)
+    logger.info(f"CPU 模式: {conf['decoders']} 个转录进程 × {conf['cpu_threads']} 线程，只领取时长小于 {duration_limit} 秒的任务")
+    counts = {'fetch': 1, 'download': args.downloaders, 'transcribe': conf['decoders']}
+    # 转录方式和配置显式传给工作进程，不依赖 fork 继承修改过的内存中的配置
+    options = {'prefetch': conf['decoders'] + 1, 'duration_limit': duration_limit, 'limit_type': limit_type,
+               'transcriber': "cpu", 'cpu_conf': conf}
+    from fleet import start_heartbeat
+    uploader = ResultUploader()
+    uploader.start()
+    heartbeat = start_heartbeat(logger)
+    Supervisor(counts, options).run(get_bv_list_file())
+    uploader.stop(flush=True)
+    if heartbeat:
+        heartbeat.stop()
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,122 @@
 
 import requests
 import logging
-import qrcode
 import time
 import json
+import os
 from functools import reduce
 import urllib.parse
 import hashlib
 from pathlib import Path
-from tqdm import tqdm
+
+import dp_metrics
+from failure_policy import PERMISSION_CODES
+
+# API 地址可以指向本地的替身服务器（见 benchmarks/fake_bilibili.py），用于离线测试和基准测试
+API_BASE = os.environ.get("DP_BILIBILI_API_BASE", "https://api.bilibili.com")
+
+# 音轨 id 对应的标称码率，接口没有返回 bandwidth 时使用
+AUDIO_ID_BANDWIDTH = {30216: 64000, 30232: 132000, 30280: 192000, 30250: 448000, 30251: 1500000}
+
+# whisper 会把音频重采样为 16kHz 单声道，64kbps 的 AAC 已经足够，更高的码率只会增加下载量。
+# 选择码率不低于 min_bandwidth 的音轨中码率最低的，码率相同时按 codecs 的顺序；都低于 min_bandwidth 时选码率最高的。
+# 普通音轨都不可用时依次尝试杜比全景声和 Hi-Res 无损音轨。
+DEFAULT_AUDIO_POLICY = {
+    "min_bandwidth": 48000,
+    "codecs": ["mp4a", "ec-3", "flac"],
+    "fallback": ["dolby", "flac"],
+}
+
+def _track_info(audio: dict, duration: float, source: str) -> dict:
+    bandwidth = audio.get('bandwidth') or AUDIO_ID_BANDWIDTH.get(audio.get('id'), 0)
+    return {
+        'id': audio.get('id'),
+        'url': audio.get('base_url') or audio.get('baseUrl', ""),
+        'backup_urls': audio.get('backup_url') or audio.get('backupUrl') or [],
+        'bandwidth': bandwidth,
+        'codecs': audio.get('codecs', ""),
+        'source': source,
+        'duration': duration,
+        # dash 接口不返回文件大小，按码率估算
+        'size': int(bandwidth * duration / 8),
+    }
+
+def select_audio_track(dash: dict, policy: dict = None):
+    """
+    按策略从 playurl 接口的 dash 数据中选择音轨。
+
+    Args:
+        dash (dict): 接口返回的 data.dash。
+        policy (dict, optional): min_bandwidth、codecs、fallback，缺少的项使用 DEFAULT_AUDIO_POLICY. 默认为 None.
+
+    Returns:
+        dict | None: 选中的音轨，包含 id、url、backup_urls、bandwidth、codecs、source、duration、size（估算的字节数）。
+            没有可用的音轨时返回 None。
+    """
+    policy = {**DEFAULT_AUDIO_POLICY, **(policy or {})}
+    duration = dash.get('duration') or 0
+    chains = [('audio', dash.get('audio') or [])]
+    for name in policy['fallback']:
+        if name == 'dolby':
+            chains.append(('dolby', (dash.get('dolby') or {}).get('audio') or []))
+        elif name == 'flac':
+            flac_audio = (dash.get('flac') or {}).get('audio')
+            chains.append(('flac', [flac_audio] if flac_audio else []))
+
+    def codec_rank(track):
+        for i, prefix in enumerate(policy['codecs']):
+            if track['codecs'].startswith(prefix):
+                return i
+        return len(policy['codecs'])
+
+    for source, audio_list in chains:
+        tracks = [_track_info(a, duration, source) for a in audio_list]
+        tracks = [t for t in tracks if t['url']]
+        if not tracks:
+            continue
+        sufficient = [t for t in tracks if t['bandwidth'] >= policy['min_bandwidth']]
+        if sufficient:
+            return min(sufficient, key=lambda t: (t['bandwidth'], codec_rank(t)))
+        return max(tracks, key=lambda t: (t['bandwidth'], -codec_rank(t)))
+    return None
+
+def _iter_pages(fetch, limit=None, prefetch=True, logger=None, what="列表"):
+    """
+    分页迭代。fetch(pn) 返回 (该页的条目, 是否还有下一页)，失败时返回 None。
+    prefetch 为 True 时用一个后台线程提前获取下一页；迭代提前结束时不再获取后面的页。
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-prefetch") if prefetch else None
+    pending = None
+    count = 0
+    pn = 1
+    try:
+        while True:
+            page = pending.result() if pending is not None else fetch(pn)
+            pending = None
+            if page is None:
+                if logger:
+                    logger.error(f"获取{what}第 {pn} 页失败，停止获取")
+                return
+            items, has_more = page
+            if has_more and executor is not None and (limit is None or count + len(items) < limit):
+                pending = executor.submit(fetch, pn + 1)
+            for item in items:
+                yield item
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+            if not has_more or not items:
+                return
+            pn += 1
+    finally:
+        if pending is not None:
+            pending.cancel()
+        if executor is not None:
+            executor.shutdown(wait=False)
 
 class dp_bilibili:
-    def __init__(self, ua="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3", cookies=None, logger=None, retry_max=10, retry_interval=5):
+    def __init__(self, ua="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3", cookies=None, logger=None, retry_max=10, retry_interval=5, api_base=None, audio_policy=None):
         """
         初始化 dp_bilibili API 客户端。
 
@@ -23,8 +128,12 @@ class dp_bilibili:
             logger (logging.Logger, optional): 日志记录器实例. 如果为 None, 将创建一个默认的. 默认为 None.
             retry_max (int, optional): API 请求失败时的最大重试次数. 默认为 10.
             retry_interval (int, optional): 每次重试之间的间隔时间（秒）. 默认为 5.
+            api_base (str, optional): API 地址. 默认为环境变量 DP_BILIBILI_API_BASE 或 https://api.bilibili.com.
+            audio_policy (dict, optional): 音轨选择策略，见 DEFAULT_AUDIO_POLICY. 默认为 None.
         """
         self.ua = ua
+        self.audio_policy = audio_policy
+        self.api_base = (api_base or API_BASE).rstrip('/')
         self.session = requests.Session()
         self.session.headers.update({'User-Agent': self.ua})
         if cookies:
@@ -43,6 +152,8 @@ class dp_bilibili:
         self.groups = {}
         self.retry_max = retry_max
         self.retry_interval = retry_interval
+        # get_audio_track 最近一次失败时接口返回的错误码，用于判断失败类型（见 failure_policy）
+        self.last_error_code = None
         self.get_wbi_keys()
         self.mid = 0
         self.name = ""
@@ -71,6 +182,7 @@ class dp_bilibili:
             return False
 
         # 2. 在终端显示二维码
+        import qrcode
         qr = qrcode.QRCode()
         qr.add_data(qr_url)
         qr.make(fit=True)
@@ -132,7 +244,7 @@ class dp_bilibili:
         Returns:
             bool: 如果已登录则返回 True, 否则返回 False.
         """
-        nav_api = "https://api.bilibili.com/x/web-interface/nav"
+        nav_api = f"{self.api_base}/x/web-interface/nav"
         try:
             response = self.session.get(nav_api)
             response.raise_for_status()
@@ -159,7 +271,7 @@ class dp_bilibili:
             dict: 关注分组的字典，格式为 {tag_id: {'name': group_name, 'count': member_count}}。
                   失败时返回空字典。
         """
-        url = "https://api.bilibili.com/x/relation/tags"
+        url = f"{self.api_base}/x/relation/tags"
         
         for attempt in range(self.retry_max):
             try:
@@ -176,6 +288,7 @@ class dp_bilibili:
                 self.logger.info(f"获取关注分组时发生错误: {e}")
                 self.groups = {}
                 if attempt < self.retry_max - 1:
+                    dp_metrics.incr('api_retries')
                     self.logger.info(f"将在 {self.retry_interval} 秒后重试...")
                     time.sleep(self.retry_interval)
                 else:
@@ -193,7 +306,7 @@ class dp_bilibili:
         Returns:
             tuple[str, str] | tuple[None, None]: 成功时返回 (img_key, sub_key)，失败时返回 (None, None)。
         """
-        url = "https://api.bilibili.com/x/web-interface/nav"
+        url = f"{self.api_base}/x/web-interface/nav"
 
         for attempt in range(self.retry_max):
             try:
@@ -209,6 +322,7 @@ class dp_bilibili:
             except Exception as e:
                 self.logger.info(f"获取WBI密钥失败 (尝试 {attempt + 1}/{self.retry_max}): {e}")
                 if attempt < self.retry_max - 1:
+                    dp_metrics.incr('api_retries')
                     self.logger.info(f"将在 {self.retry_interval} 秒后重试...")
                     time.sleep(self.retry_interval)
                 else:
@@ -266,17 +380,12 @@ class dp_bilibili:
         params['w_rid'] = w_rid
         return params
 
-    def get_videos_in_up(self, mid, ps=30, pn=1):
+    def _fetch_videos_page(self, mid, pn, ps):
         """
-        获取指定UP主的视频列表。
-
-        Args:
-            mid (int or str): UP主的UID。
-            ps (int, optional): 每页视频数量. 默认为 30.
-            pn (int, optional): 页码. 默认为 1.
+        获取UP主视频列表的一页。
 
         Returns:
-            dict: 视频列表字典，格式为 {bvid: {'title': video_title}}。失败时返回空字典。
+            tuple[list, int] | None: (该页的视频列表 vlist, 视频总数)。失败时返回 None。
         """
         # 构造基本参数
         params = {
@@ -297,7 +406,7 @@ class dp_bilibili:
             try:
                 # 发送API请求
                 response = self.session.get(
-                    "https://api.bilibili.com/x/space/wbi/arc/search",
+                    f"{self.api_base}/x/space/wbi/arc/search",
                     params=self.sign_params(params),
                     headers=headers,
                     timeout=10
@@ -309,44 +418,73 @@ class dp_bilibili:
                 if data["code"] != 0:
                     self.logger.error(data)
                     self.logger.error(f"API请求失败: code: {data['code']}, msg: {data['message']}")
-                    return []
-
-                # 提取视频数据
-                videos = {}
-                for video in data["data"]["list"]["vlist"]:# 提取视频数据
-                    title = video["title"]
-                    bvid = video["bvid"]
-                    videos[bvid] = {'title':title}
-                
-                return videos
+                    return None
+
+                data_json = data["data"]
+                return data_json["list"]["vlist"] or [], data_json.get("page", {}).get("count", 0)
             
             except Exception as e:
                 self.logger.error(f"请求发生错误: {e}")
                 if attempt < self.retry_max - 1:
+                    dp_metrics.incr('api_retries')
                     self.logger.info(f"将在 {self.retry_interval} 秒后重试...")
                     time.sleep(self.retry_interval)
                 else:
-                    self.logger.info("已达到最大重试次数，获取关注分组失败。")
-        return {} # 所有重试都失败后
+                    self.logger.info("已达到最大重试次数，获取视频列表失败。")
+        return None # 所有重试都失败后
 
-    def get_ups_in_group(self, tag_id: int, pn: int = 1, ps: int = 300):
+    def get_videos_in_up(self, mid, ps=30, pn=1):
         """
-        根据分组ID获取关注的UP主列表。
+        获取指定UP主的视频列表的一页。需要全部视频时使用 iter_videos_in_up。
 
         Args:
-            tag_id (int): 关注分组的 ID。
+            mid (int or str): UP主的UID。
+            ps (int, optional): 每页视频数量. 默认为 30.
             pn (int, optional): 页码. 默认为 1.
-            ps (int, optional): 每页数量. 默认为 300.
 
         Returns:
-            dict: UP主列表字典，格式为 {mid: {'name': up_name}}。失败时返回空字典。
+            dict: 视频列表字典，格式为 {bvid: {'title': video_title}}。失败时返回空字典。
+        """
+        page = self._fetch_videos_page(mid, pn, ps)
+        if page is None:
+            return {}
+        return {video["bvid"]: {'title': video["title"]} for video in page[0]}
+
+    def iter_videos_in_up(self, mid, ps=50, limit=None, prefetch=True):
+        """
+        逐个返回UP主的视频（按发布时间从新到旧），按需分页获取，处理当前页时在后台获取下一页。
+        内存中最多保存两页，调用方可以随时停止迭代。
+
+        Args:
+            mid (int or str): UP主的UID。
+            ps (int, optional): 每页视频数量. 默认为 50.
+            limit (int, optional): 最多返回的视频数. 默认为 None（全部）.
+            prefetch (bool, optional): 是否预取下一页. 默认为 True.
+
+        Yields:
+            dict: 接口返回的视频信息，包含 bvid、title、created（发布时间）、length、mid、author 等。
         """
-        api_url = "https://api.bilibili.com/x/relation/tag"
+        def fetch(pn):
+            page = self._fetch_videos_page(mid, pn, ps)
+            if page is None:
+                return None
+            videos, count = page
+            return videos, pn * ps < count
+        yield from _iter_pages(fetch, limit, prefetch, self.logger, f"UP主 {mid} 的视频列表")
+
+    def _fetch_ups_page(self, tag_id, pn, ps):
+        """
+        获取关注分组中UP主列表的一页。
+
+        Returns:
+            list | None: 该页的UP主列表。失败时返回 None。
+        """
+        api_url = f"{self.api_base}/x/relation/tag"
         params = {
             "mid": self.mid,
             "tagid": tag_id,
-            "pn": 1,
-            "ps": 300,  # 每页数量，对于此API，通常一次返回分组内所有UP主
+            "pn": pn,
+            "ps": ps,
         }
         headers = {
             "Referer": f"https://space.bilibili.com/{self.mid}/fans/follow",
@@ -360,8 +498,7 @@ class dp_bilibili:
                 data = response.json()
                 if data.get('code') == 0:
                     # 成功获取，返回数据
-                    ups = {data["mid"]: {'name':data["uname"]} for data in data.get("data", {})}
-                    return ups
+                    return data.get("data") or []
                 else:
                     # API返回错误码，打印信息并重试
                     self.logger.info(f"获取分组关注列表失败 (尝试 {attempt + 1}/{self.retry_max}): {data.get('message')}")
@@ -370,13 +507,53 @@ class dp_bilibili:
                 self.logger.info(f"请求关注列表时发生错误 (尝试 {attempt + 1}/{self.retry_max}): {e}")
                 
             if attempt < self.retry_max - 1:
+                dp_metrics.incr('api_retries')
                 self.logger.info(f"将在 {self.retry_interval} 秒后重试...")
                 time.sleep(self.retry_interval)
             else:
                 self.logger.info("已达到最大重试次数，获取关注列表失败。")
                 
-        return {} # 所有重试都失败后
-    
+        return None # 所有重试都失败后
+
+    def get_ups_in_group(self, tag_id: int, pn: int = 1, ps: int = 300):
+        """
+        根据分组ID获取关注的UP主列表的一页。需要全部UP主时使用 iter_ups_in_group。
+
+        Args:
+            tag_id (int): 关注分组的 ID。
+            pn (int, optional): 页码. 默认为 1.
+            ps (int, optional): 每页数量. 默认为 300.
+
+        Returns:
+            dict: UP主列表字典，格式为 {mid: {'name': up_name}}。失败时返回空字典。
+        """
+        ups = self._fetch_ups_page(tag_id, pn, ps)
+        if ups is None:
+            return {}
+        return {up["mid"]: {'name': up["uname"]} for up in ups}
+
+    def iter_ups_in_group(self, tag_id: int, ps: int = 50, limit=None, prefetch=True):
+        """
+        逐个返回关注分组中的UP主，按需分页获取，处理当前页时在后台获取下一页。
+        内存中最多保存两页，调用方可以随时停止迭代。
+
+        Args:
+            tag_id (int): 关注分组的 ID。
+            ps (int, optional): 每页数量. 默认为 50.
+            limit (int, optional): 最多返回的UP主数. 默认为 None（全部）.
+            prefetch (bool, optional): 是否预取下一页. 默认为 True.
+
+        Yields:
+            dict: 接口返回的UP主信息，包含 mid、uname 等。
+        """
+        def fetch(pn):
+            ups = self._fetch_ups_page(tag_id, pn, ps)
+            if ups is None:
+                return None
+            # 这个接口不返回总数，取到不满一页时结束
+            return ups, len(ups) >= ps
+        yield from _iter_pages(fetch, limit, prefetch, self.logger, f"分组 {tag_id} 的UP主列表")
+
     def get_video_info(self, bvid):
         """
         获取指定BVID视频的详细信息。
@@ -387,7 +564,7 @@ class dp_bilibili:
         Returns:
             dict: 视频信息字典，包含 pubdate, title, duration, cid 等。失败时返回空字典。
         """
-        api_url = "https://api.bilibili.com/x/web-interface/view"
+        api_url = f"{self.api_base}/x/web-interface/view"
         params = {
             "bvid": bvid
         }
@@ -432,6 +609,7 @@ class dp_bilibili:
                 self.logger.info(f"请求视频信息时发生错误 (尝试 {attempt + 1}/{self.retry_max}): {e}")
                 
             if attempt < self.retry_max - 1:
+                dp_metrics.incr('api_retries')
                 self.logger.info(f"将在 {self.retry_interval} 秒后重试...")
                 time.sleep(self.retry_interval)
             else:
@@ -439,25 +617,24 @@ class dp_bilibili:
                 
         return {} # 所有重试都失败后
     
-    def get_audio_download_url(self, bvid, cid):
+    def get_audio_track(self, bvid, cid):
         """
-        获取视频的音频下载链接。
-
-        会优先选择码率为 132kbps (ID 30280), 192kbps (ID 30232), 64kbps (ID 30216) 的音轨。
+        获取视频的音频音轨，按 audio_policy 选择（见 select_audio_track）。
 
         Args:
             bvid (str): 视频的BVID。
             cid (int): 视频的CID。
 
         Returns:
-            str: 音频的下载 URL。失败时返回空字符串。
+            dict | None: 选中的音轨，包含 url、bandwidth、size 等，下载和调度可以据此估算下载时间。失败时返回 None。
         """
-        api_url = "https://api.bilibili.com/x/player/wbi/playurl"
+        api_url = f"{self.api_base}/x/player/wbi/playurl"
         params = {
-            'fnval': 16,  # 16表示dash格式的视频
+            'fnval': 16 | 256,  # 16表示dash格式，256表示同时返回杜比音轨
             "bvid": bvid,
             "cid": cid
         }
+        self.last_error_code = None
         
         for attempt in range(self.retry_max):
             try:
@@ -467,33 +644,115 @@ class dp_bilibili:
                 data = response.json()
                 if data.get('code') == 0:
                     # 成功获取，返回数据
-                    data_json = data.get("data", {})
-                    audio_json_list = data_json.get("dash", {}).get("audio", [])
-                    # 优先选择id为30280, 30232, 30216的音频
-                    target_ids = [30280, 30232, 30216]
-                    selected_audio = ""
-                    for target_id in target_ids:
-                        for audio in audio_json_list:# 优先选择id为30280, 30232, 30216的音频
-                            if audio.get("id") == target_id:
-                                selected_audio = audio.get('base_url', "")
-                                break
-                    return selected_audio
+                    track = select_audio_track(data.get("data", {}).get("dash") or {}, self.audio_policy)
+                    if track:
+                        self.logger.info(f"选择音轨 {track['id']} ({track['source']}, {track['codecs']}, {track['bandwidth'] // 1000}kbps)，"
+                                         f"预计 {track['size'] / 1e6:.1f}MB")
+                    else:
+                        self.logger.info(f"视频 {bvid} 没有可用的音轨")
+                    return track
                 else:
                     # API返回错误码，打印信息并重试
+                    self.last_error_code = data.get('code')
                     self.logger.info(f"获取视频下载链接失败 (尝试 {attempt + 1}/{self.retry_max}): {data.get('message')}")
+                    if self.last_error_code in PERMISSION_CODES:
+                        # 没有权限或视频不存在，重试也不会成功
+                        break
             except Exception as e:
                 # 请求或解析过程发生异常，打印信息并重试
                 self.logger.info(f"请求视频下载链接时发生错误 (尝试 {attempt + 1}/{self.retry_max}): {e}")
                 
             if attempt < self.retry_max - 1:
+                dp_metrics.incr('api_retries')
                 self.logger.info(f"将在 {self.retry_interval} 秒后重试...")
                 time.sleep(self.retry_interval)
             else:
                 self.logger.info("已达到最大重试次数，获取视频下载链接失败。")
                 
-        return "" # 所有重试都失败后
+        return None # 所有重试都失败后
+
+    def get_audio_download_url(self, bvid, cid):
+        """
+        获取视频的音频下载链接，音轨按 audio_policy 选择（见 get_audio_track）。
+
+        Args:
+            bvid (str): 视频的BVID。
+            cid (int): 视频的CID。
+
+        Returns:
+            str: 音频的下载 URL。失败时返回空字符串。
+        """
+        track = self.get_audio_track(bvid, cid)
+        return track['url'] if track else ""
+
+    def get_subtitle_list(self, bvid, cid):
+        """
+        获取视频已有的字幕列表（UP 主上传的 CC 字幕和 B 站生成的 AI 字幕）。AI 字幕通常需要登录后才能获取。
+
+        Args:
+            bvid (str): 视频的BVID。
+            cid (int): 视频的CID。
+
+        Returns:
+            list[dict]: 字幕列表，每项包含 id、lan、lan_doc、url、source（"cc" 或 "ai"）。失败时返回空列表。
+        """
+        api_url = f"{self.api_base}/x/player/wbi/v2"
+        params = {
+            "bvid": bvid,
+            "cid": cid
+        }
+        # 字幕只是省掉转录的捷径，失败时按原流程下载转录，不需要像其他接口一样反复重试
+        attempts = min(self.retry_max, 2)
+        for attempt in range(attempts):
+            try:
+                response = self.session.get(api_url, params=self.sign_params(params), timeout=10)
+                response.raise_for_status()
+                data = response.json()
+                if data.get('code') == 0:
+                    subtitles = []
+                    for sub in (data.get("data", {}).get("subtitle") or {}).get("subtitles") or []:
+                        url = sub.get("subtitle_url", "")
+                        if url.startswith("//"):
+                            url = "https:" + url
+                        lan = sub.get("lan", "")
+                        subtitles.append({
+                            'id': sub.get("id"),
+                            'lan': lan,
+                            'lan_doc': sub.get("lan_doc", ""),
+                            'url': url,
+                            'source': 'ai' if sub.get("type") == 1 or lan.startswith("ai-") else 'cc',
+                        })
+                    return subtitles
+                else:
+                    self.logger.info(f"获取字幕列表失败 (尝试 {attempt + 1}/{attempts}): {data.get('message')}")
+            except Exception as e:
+                self.logger.info(f"请求字幕列表时发生错误 (尝试 {attempt + 1}/{attempts}): {e}")
+            if attempt < attempts - 1:
+                dp_metrics.incr('api_retries')
+                time.sleep(self.retry_interval)
+        return []
+
+    def get_subtitle_segments(self, url):
+        """
+        下载字幕 JSON，转换为 transcript_store 的分段格式。
+
+        Args:
+            url (str): get_subtitle_list 返回的字幕地址。
+
+        Returns:
+            list[dict]: 分段列表 [{"s": 开始毫秒, "e": 结束毫秒, "t": 文本}]。失败时返回空列表。
+        """
+        try:
+            response = self.session.get(url, headers={"referer": 'https://www.bilibili.com'}, timeout=10)
+            response.raise_for_status()
+            body = response.json().get("body") or []
+        except Exception as e:
+            self.logger.info(f"下载字幕 {url} 时发生错误: {e}")
+            return []
+        return [{'s': int(round(item['from'] * 1000)), 'e': int(round(item['to'] * 1000)), 't': item.get('content', '').strip()}
+                for item in body if item.get('content', '').strip()]
 
-def download_file_with_resume(session, url, file_path:Path):
+def download_file_with_resume(session, url, file_path:Path, chunk_callback=None):
     """
     使用 requests.Session 下载文件，并支持断点续传。
 
@@ -501,10 +760,13 @@ def download_file_with_resume(session, url, file_path:Path):
         session (requests.Session): 用于下载的会话对象。
         url (str): 文件的下载 URL。
         file_path (Path): 文件保存的本地路径。
+        chunk_callback (callable, optional): 每写入一块数据后调用 chunk_callback(chunk)，
+            用于边下载边处理（例如流式转录）。默认为 None.
 
     Returns:
         bool: 下载成功返回 True，否则返回 False。
     """
+    from tqdm import tqdm
     headers = {"referer": 'https://www.bilibili.com'}
     file_size = 0
     # 检查是否已存在部分下载的文件
@@ -539,6 +801,8 @@ def download_file_with_resume(session, url, file_path:Path):
                 if chunk:
                     file.write(chunk)
                     bar.update(len(chunk))
+                    if chunk_callback:
+                        chunk_callback(chunk)
         print("下载完成!")
         return True
         
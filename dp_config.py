@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+共享的配置对象。
+
+config.json 在第一次调用 get_config() 时读取一次，同一个进程中的所有模块共用这一份配置；
+导入本模块（以及依赖它的 process_input、server_out_queue、server_in_queue）没有任何副作用，
+不会读文件、复制示例配置或创建目录。
+"""
+
+import json
+import os
+import shutil
+import sys
+import threading
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).parent.resolve()
+# 环境变量 DP_CONFIG_FILE 可以指定其他配置文件，例如基准测试中每个工作进程使用自己的配置
+CONFIG_FILE = Path(os.environ.get("DP_CONFIG_FILE", SCRIPT_DIR / "config.json"))
+ID_FILE = SCRIPT_DIR / "id"
+
+_config = None
+_lock = threading.Lock()
+
+def get_config() -> dict:
+    """
+    读取 config.json 并应用其中的日志设置，只在第一次调用时执行。配置文件不存在时从 config_sample.json 复制。
+
+    Returns:
+        dict: 配置内容。
+    """
+    global _config
+    with _lock:
+        if _config is None:
+            if not CONFIG_FILE.exists():
+                print(f"配置文件 {CONFIG_FILE} 不存在。", file=sys.stderr)
+                shutil.copy(SCRIPT_DIR / "config_sample.json", CONFIG_FILE)
+                print(f"已将 config_sample.json 复制到 {CONFIG_FILE}", file=sys.stderr)
+            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+            _apply(config)
+            _config = config
+        return _config
+
+def _apply(config):
+    import dp_metrics
+    from dp_logging import configure_logging
+    if config.get("logging"):
+        configure_logging(**config["logging"])
+    dp_metrics.METRICS_DIR = get_temp_directory(config) / "metrics"
+    dp_metrics.STATUS_DIR = get_temp_directory(config) / "fleet"
+
+def resolve_path(value) -> Path:
+    """绝对路径直接使用，相对路径解析为相对于脚本目录的绝对路径。"""
+    path = Path(value)
+    if path.is_absolute():
+        return path
+    return (SCRIPT_DIR / path).resolve()
+
+def get_queue_directory(config=None) -> Path:
+    config = get_config() if config is None else config
+    return resolve_path(config.get("queue_directory", "queue"))
+
+def get_temp_directory(config=None) -> Path:
+    config = get_config() if config is None else config
+    return resolve_path(config.get("temp_directory", "temp"))
+
+def get_output_directory(config=None) -> Path:
+    config = get_config() if config is None else config
+    return resolve_path(config.get("output_directory", "output"))
+
+def get_bv_list_file(config=None) -> Path:
+    config = get_config() if config is None else config
+    return Path(config.get("bv_list_file", "/content/drive/MyDrive/audio2txt/input.txt"))
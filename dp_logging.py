@@ -1,63 +1,310 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import atexit
+import contextvars
+import copy
+import json
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
 import sys
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
-def setup_logger(name: str = 'my_app', file_level: int = logging.DEBUG, console_level: int = logging.INFO) -> logging.Logger:
-    """
-    配置并返回一个 logger 实例，该实例同时输出到控制台和文件。
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s'
+DATEFMT = '%Y-%m-%d %H:%M:%S'
 
-    Args:
-        name (str): logger 的名称。
-        level (int): logger 的日志级别 (例如 logging.INFO, logging.DEBUG)。
+# configure_logging 设置的全局选项，默认与原来的行为一致：同步写入当前目录下的 <name>.log
+_settings = {
+    'async_mode': False,
+    'log_dir': None,
+    'json_format': False,
+    'max_bytes': 10 * 1024 * 1024,
+    'backup_count': 5,
+    'sync_dir': None,
+    'sync_interval': 300,
+}
+_loggers = {}
+_log_context = contextvars.ContextVar("dp_log_context", default={})
+_queue = None
+_listener = None
+_router = None
+_syncer = None
+# fork 出的子进程在文件名中加上 pid，每个文件只有一个进程写入和滚动
+_file_tag = ""
 
-    Returns:
-        logging.Logger: 配置好的 logger 实例。
+class ContextFilter(logging.Filter):
+    """把 log_context 设置的上下文（例如 task、bvid）附加到日志记录的 ctx 属性上。"""
+    def filter(self, record):
+        record.ctx = _log_context.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'pid': record.process,
+            'msg': record.getMessage(),
+        }
+        data.update(getattr(record, 'ctx', {}) or {})
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # 异步模式下异常在放进队列前已经格式化（见 _TaggingQueueHandler.prepare）
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+@contextmanager
+def log_context(**fields):
     """
-    # 确保日志文件所在的目录存在
-    log_path = Path(f"{name}.log")
-    log_path.parent.mkdir(parents=True, exist_ok=True)
+    在 with 块内给所有日志记录附加上下文字段，JSON 格式的日志中会包含这些字段。
 
-    # 创建一个 logger
-    logger = logging.getLogger(name)
+    示例:
+        with log_context(task="BV1xx", bvid="BV1xx"):
+            logger.info("开始下载")
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+class _RoutingFileHandler(logging.Handler):
+    """在后台线程中按 logger 名称把记录写入各自的滚动日志文件。"""
+    def __init__(self):
+        super().__init__()
+        self.handlers = {}
+
+    def _handler_for(self, name):
+        handler = self.handlers.get(name)
+        if handler is None:
+            log_dir = Path(_settings['log_dir'])
+            log_dir.mkdir(parents=True, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                log_dir / f"{name}{_file_tag}.log", encoding='utf-8',
+                maxBytes=_settings['max_bytes'], backupCount=_settings['backup_count'])
+            handler.setFormatter(_make_formatter())
+            self.handlers[name] = handler
+        return handler
+
+    def emit(self, record):
+        try:
+            handler = self._handler_for(getattr(record, 'dp_logger', record.name))
+            if record.levelno >= getattr(record, 'dp_file_level', logging.DEBUG):
+                handler.handle(record)
+        except Exception:
+            # 异常会结束后台线程，之后的日志全部丢失；打不开日志文件等情况改为输出到 stderr
+            try:
+                sys.stderr.write(logging.Formatter(FORMAT, datefmt=DATEFMT).format(record) + "\n")
+            except Exception:
+                pass
+
+    def close(self):
+        for handler in self.handlers.values():
+            handler.close()
+        self.handlers = {}
+        super().close()
+
+class _TaggingQueueHandler(logging.handlers.QueueHandler):
+    """记录所属的 logger 名和文件日志级别，后台线程据此选择日志文件。"""
+    def __init__(self, q, logger_name, file_level):
+        super().__init__(q)
+        self.logger_name = logger_name
+        self.file_level = file_level
+
+    def prepare(self, record):
+        # 默认的 prepare 把异常拼进 msg 并清空 exc_info，JSON 日志就没有 exc 字段；
+        # 这里只把异常格式化成 exc_text，由写文件的 formatter 输出
+        record = copy.copy(record)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        record.dp_logger = self.logger_name
+        record.dp_file_level = self.file_level
+        return record
+
+class _LogSyncer(threading.Thread):
+    """定期把本地日志目录复制到 sync_dir（例如 Google Drive），只复制有变化的文件。"""
+    def __init__(self, src_dir: Path, dst_dir: Path, interval: float):
+        super().__init__(name="log-syncer", daemon=True)
+        self.src_dir = Path(src_dir)
+        self.dst_dir = Path(dst_dir)
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.synced = {}
+
+    def sync(self):
+        if not self.src_dir.exists():
+            return
+        self.dst_dir.mkdir(parents=True, exist_ok=True)
+        for f in self.src_dir.glob("*.log*"):
+            stat = f.stat()
+            key = (stat.st_size, stat.st_mtime)
+            if self.synced.get(f.name) == key:
+                continue
+            tmp = self.dst_dir / f".{f.name}.tmp"
+            shutil.copyfile(f, tmp)
+            os.replace(tmp, self.dst_dir / f.name)
+            self.synced[f.name] = key
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sync()
+            except OSError as e:
+                print(f"同步日志到 {self.dst_dir} 失败: {e}", file=sys.stderr)
+
+    def stop(self):
+        self.stop_event.set()
+        try:
+            self.sync()
+        except OSError as e:
+            print(f"同步日志到 {self.dst_dir} 失败: {e}", file=sys.stderr)
+
+def _make_formatter():
+    if _settings['json_format']:
+        return JsonFormatter()
+    return logging.Formatter(FORMAT, datefmt=DATEFMT)
+
+def _start_listener():
+    global _queue, _listener, _router
+    _queue = queue.SimpleQueue()
+    _router = _RoutingFileHandler()
+    _listener = logging.handlers.QueueListener(_queue, _router, respect_handler_level=False)
+    _listener.start()
+
+def _stop_listener():
+    global _listener, _router
+    if _listener:
+        _listener.stop()
+        _listener = None
+    if _router:
+        _router.close()
+        _router = None
+    if _syncer:
+        _syncer.stop()
+
+def _after_fork_in_child():
+    # fork 出的子进程中没有后台线程，重新创建队列和写日志的线程，写入自己的日志文件
+    global _listener, _syncer, _file_tag
+    if _listener is None:
+        return
+    _listener = None
+    _syncer = None
+    _file_tag = f".{os.getpid()}"
+    _start_listener()
+    for name, (file_level, console_level) in _loggers.items():
+        _configure(logging.getLogger(name), name, file_level, console_level)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+atexit.register(_stop_listener)
+
+def _configure(logger, name, file_level, console_level):
     logger.setLevel(logging.DEBUG)
 
     # 如果 logger 已有 handlers，先清除，防止重复输出
     if logger.hasHandlers():
+        for handler in logger.handlers:
+            handler.close()
         logger.handlers.clear()
+    for f in list(logger.filters):
+        logger.removeFilter(f)
+    logger.addFilter(ContextFilter())
 
-    # 创建一个 formatter，定义日志的格式
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-
-    # 创建一个 handler，用于写入日志文件
-    file_handler = logging.FileHandler(log_path, encoding='utf-8', mode='a')
+    if _settings['async_mode']:
+        # 文件写入交给后台线程，调用方只把记录放进队列
+        file_handler = _TaggingQueueHandler(_queue, name, file_level)
+    else:
+        # 确保日志文件所在的目录存在
+        log_dir = Path(_settings['log_dir']) if _settings['log_dir'] else Path(".")
+        log_path = log_dir / f"{name}.log"
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        # delay=True：第一次写日志时才创建文件，只导入模块不会留下空的日志文件
+        file_handler = logging.FileHandler(log_path, encoding='utf-8', mode='a', delay=True)
+        file_handler.setFormatter(_make_formatter())
     file_handler.setLevel(file_level)
-    file_handler.setFormatter(formatter)
 
     # 创建一个 handler，用于输出到控制台 (标准输出)
     stream_handler = logging.StreamHandler(sys.stdout)
     stream_handler.setLevel(console_level)
-    stream_handler.setFormatter(formatter)
+    stream_handler.setFormatter(logging.Formatter(FORMAT, datefmt=DATEFMT))
 
     # 给 logger 添加 handler
     logger.addHandler(file_handler)
     logger.addHandler(stream_handler)
 
+def configure_logging(async_mode: bool = True, log_dir=None, json_format: bool = False, max_bytes: int = 10 * 1024 * 1024,
+                      backup_count: int = 5, sync_dir=None, sync_interval: float = 300):
+    """
+    设置日志模式，并重新配置所有已经由 setup_logger 创建的 logger。
+
+    Args:
+        async_mode (bool, optional): 为 True 时文件日志通过队列交给后台线程写入. 默认为 True.
+        log_dir (str | Path, optional): 日志目录，应放在本地磁盘上。默认为系统临时目录下的 colab_blbl2txt/logs.
+        json_format (bool, optional): 文件日志是否使用 JSON 格式（包含 log_context 设置的字段）. 默认为 False.
+        max_bytes (int, optional): 单个日志文件的最大字节数，超过后滚动（仅异步模式；fork 出的子进程写入 <name>.<pid>.log）. 默认为 10MB.
+        backup_count (int, optional): 保留的滚动文件数（仅异步模式）. 默认为 5.
+        sync_dir (str | Path, optional): 定期把日志目录复制到这里（例如 Google Drive 上的目录），None 表示不同步.
+        sync_interval (float, optional): 同步间隔秒数. 默认为 300.
+    """
+    global _syncer
+    if log_dir is None:
+        import tempfile
+        log_dir = Path(tempfile.gettempdir()) / "colab_blbl2txt" / "logs"
+    _settings.update(async_mode=async_mode, log_dir=str(log_dir), json_format=json_format,
+                     max_bytes=max_bytes, backup_count=backup_count, sync_dir=sync_dir, sync_interval=sync_interval)
+    if async_mode and _listener is None:
+        _start_listener()
+    elif async_mode and _router:
+        # 目录或格式可能变化，关闭已打开的文件，由后台线程按新设置重新打开
+        _router.close()
+    if sync_dir and _syncer is None:
+        _syncer = _LogSyncer(Path(log_dir), Path(sync_dir), sync_interval)
+        _syncer.start()
+    for name, (file_level, console_level) in _loggers.items():
+        _configure(logging.getLogger(name), name, file_level, console_level)
+
+def setup_logger(name: str = 'my_app', file_level: int = logging.DEBUG, console_level: int = logging.INFO) -> logging.Logger:
+    """
+    配置并返回一个 logger 实例，该实例同时输出到控制台和文件。
+
+    文件日志的位置和写入方式由 configure_logging 决定，默认同步写入当前目录下的 <name>.log。
+
+    Args:
+        name (str): logger 的名称。
+        file_level (int): 文件日志级别 (例如 logging.INFO, logging.DEBUG)。
+        console_level (int): 控制台日志级别。
+
+    Returns:
+        logging.Logger: 配置好的 logger 实例。
+    """
+    # 创建一个 logger
+    logger = logging.getLogger(name)
+    _loggers[name] = (file_level, console_level)
+    _configure(logger, name, file_level, console_level)
     return logger
 
 # 示例用法
 if __name__ == '__main__':
+    configure_logging(async_mode=True, log_dir="logs", json_format=True)
     main_logger = setup_logger('main_module', file_level=logging.DEBUG, console_level=logging.INFO)
 
     main_logger.debug("这是一条 debug 消息。")
     main_logger.info("这是一条 info 消息。")
-    main_logger.warning("这是一条 warning 消息。")
+    with log_context(task="BV1GJ411x7h7", bvid="BV1GJ411x7h7"):
+        main_logger.warning("这是一条 warning 消息。")
     main_logger.error("发生了一个错误。")
     main_logger.critical("发生了一个严重错误。")
 
-    print(f"\n日志已写入到: main_module.log")
\ No newline at end of file
+    print(f"\n日志已写入到: logs/main_module.log")
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+流水线各阶段的耗时和计数统计。
+
+每个任务一条 JSON 记录（type=task），每个进程退出时一条会话记录（type=session，只包含任务之外的
+领取、上传、git 同步等开销），记录中带有会话 id，同一台机器的所有进程追加写入同一个按天的文件
+METRICS_DIR/<worker>_<日期>.jsonl。上传结果时只把还没推送的部分追加到队列仓库 metrics 目录中的同名文件，
+推送成功后记录位置，推送完的前几天的本地文件删除（见 server_in_queue.stage_metrics），所以可以汇总所有机器的数据：
+
+    python dp_metrics.py summary queue/metrics [--by-worker]
+"""
+
+import argparse
+import atexit
+import contextvars
+import json
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).parent.resolve()
+ID_FILE = SCRIPT_DIR / "id"
+METRICS_DIR = Path(os.environ.get("DP_METRICS_DIR", SCRIPT_DIR / "temp" / "metrics"))
+# 每个进程的当前任务和累计完成量，由 fleet.Heartbeat 汇总后发布
+STATUS_DIR = Path(os.environ.get("DP_STATUS_DIR", SCRIPT_DIR / "temp" / "fleet"))
+STATUS_INTERVAL = 5
+
+_current_task = contextvars.ContextVar("dp_metrics_task", default=None)
+_lock = threading.Lock()
+_session = None
+
+def get_worker_id():
+    # 同一台机器上模拟多台机器时（例如基准测试）用环境变量区分
+    if os.environ.get("DP_WORKER_ID"):
+        return os.environ["DP_WORKER_ID"]
+    if ID_FILE.exists():
+        worker_id = ID_FILE.read_text(encoding='utf-8').strip()
+        if worker_id:
+            return worker_id
+    return socket.gethostname()
+
+class _Counters:
+    def __init__(self):
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(float)
+
+    def add_stage(self, name, seconds):
+        self.stages[name] += seconds
+
+    def incr(self, name, value=1):
+        self.counters[name] += value
+
+class TaskMetrics(_Counters):
+    def __init__(self, task_id: str, **fields):
+        super().__init__()
+        self.task_id = task_id
+        self.fields = dict(fields)
+        self.started_at = time.time()
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current_task.set(self)
+        _update_status(task=self.task_id, part=self.fields.get('part'), duration=self.fields.get('duration'),
+                       stage=None, since=time.time(), progress=None)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_task.reset(self._token)
+        if 'status' not in self.fields:
+            self.fields['status'] = 'error' if exc_type else 'ok'
+        self.finish()
+        return False
+
+    def set(self, name, value):
+        self.fields[name] = value
+
+    def record(self):
+        audio_seconds = self.counters.get('audio_seconds', 0)
+        record = {
+            'type': 'task',
+            'worker': get_worker_id(),
+            'session': session().session_id,
+            'task': self.task_id,
+            'start': round(self.started_at, 3),
+            'wall': round(time.time() - self.started_at, 3),
+            'stages': {k: round(v, 3) for k, v in self.stages.items()},
+            'counters': dict(self.counters),
+        }
+        record.update(self.fields)
+        if audio_seconds and self.stages.get('transcribe'):
+            record['rtf'] = round(self.stages['transcribe'] / audio_seconds, 4)
+        return record
+
+    def finish(self):
+        s = session()
+        with _lock:
+            s.tasks += 1
+        write_record(self.record())
+        with _lock:
+            if self.fields.get('part') != 'download':
+                _status['tasks_done'] += 1
+            _status['audio_seconds'] += self.counters.get('audio_seconds', 0)
+            _status['transcribe_seconds'] += self.stages.get('transcribe', 0)
+        _update_status(task=None, part=None, duration=None, stage=None, since=None, progress=None)
+
+class SessionMetrics(_Counters):
+    def __init__(self):
+        super().__init__()
+        self.session_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+        self.started_at = time.time()
+        self.tasks = 0
+
+    @property
+    def path(self) -> Path:
+        # 每台机器每天一个文件，跨天的会话写到两个文件中
+        return METRICS_DIR / f"{get_worker_id()}_{time.strftime('%Y%m%d')}.jsonl"
+
+    def record(self):
+        return {
+            'type': 'session',
+            'worker': get_worker_id(),
+            'session': self.session_id,
+            'start': round(self.started_at, 3),
+            'wall': round(time.time() - self.started_at, 3),
+            'tasks': self.tasks,
+            'stages': {k: round(v, 3) for k, v in self.stages.items()},
+            'counters': dict(self.counters),
+        }
+
+def session() -> SessionMetrics:
+    global _session
+    with _lock:
+        if _session is None:
+            _session = SessionMetrics()
+            atexit.register(flush_session)
+        return _session
+
+def current():
+    """当前线程正在统计的任务，没有时返回会话统计。"""
+    return _current_task.get() or session()
+
+@contextmanager
+def stage(name: str):
+    """统计一段代码的耗时，计入当前任务（没有任务时计入会话）。"""
+    target = current()
+    if target is not _session:
+        _update_status(stage=name, since=time.time(), progress=None)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if target is _session:
+            with _lock:
+                target.add_stage(name, elapsed)
+        else:
+            target.add_stage(name, elapsed)
+
+def incr(name: str, value=1):
+    target = current()
+    if target is _session:
+        with _lock:
+            target.incr(name, value)
+    else:
+        target.incr(name, value)
+
+_status = {'pid': os.getpid(), 'task': None, 'tasks_done': 0, 'audio_seconds': 0.0, 'transcribe_seconds': 0.0}
+_status_written = 0.0
+_progress_hook = None
+
+def set_progress_hook(hook):
+    """每次更新状态（进入阶段、报告进度）时调用 hook()，例如 supervisor 的工作进程用它发送心跳。"""
+    global _progress_hook
+    _progress_hook = hook
+
+def _update_status(throttle=False, **fields):
+    """更新本进程的状态文件 STATUS_DIR/<pid>.json。throttle 为 True 时最多每 STATUS_INTERVAL 秒写一次。"""
+    global _status_written
+    if _progress_hook is not None:
+        _progress_hook()
+    now = time.time()
+    with _lock:
+        if _status['pid'] != os.getpid():
+            # fork 出来的子进程不继承父进程的累计量
+            _status.update(pid=os.getpid(), tasks_done=0, audio_seconds=0.0, transcribe_seconds=0.0)
+        _status.update(fields, updated=now)
+        if throttle and now - _status_written < STATUS_INTERVAL:
+            return
+        _status_written = now
+        data = json.dumps(_status, ensure_ascii=False)
+    path = STATUS_DIR / f"{os.getpid()}.json"
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp.write_text(data, encoding='utf-8')
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+def progress(fraction: float = None):
+    """报告当前阶段的进度（0~1），例如下载的字节比例。不知道进度时不传参数，只表示仍在工作。"""
+    if fraction is None:
+        _update_status(throttle=True)
+    else:
+        _update_status(throttle=True, progress=round(min(max(fraction, 0.0), 1.0), 3))
+
+def write_record(record: dict):
+    path = session().path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n"
+    with _lock:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+_flushed = False
+
+def flush_session():
+    """
+    写入会话汇总记录，每个进程只写一次。atexit 时也会调用，但那时结果已经上传完了，
+    所以最后一次上传之前应该先调用它（见 server_in_queue.ResultUploader.stop 和 in_queue）。
+    """
+    global _flushed
+    if _session is None or _flushed:
+        return
+    _flushed = True
+    write_record(_session.record())
+
+def _after_fork_in_child():
+    # fork 出的子进程有自己的会话（自己的记录文件），不继承父进程的会话统计和写入状态；
+    # 锁可能在 fork 时被父进程的其他线程持有，重新创建
+    global _session, _flushed, _lock
+    _lock = threading.Lock()
+    _session = None
+    _flushed = False
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+def iter_records(paths):
+    for p in paths:
+        p = Path(p)
+        files = sorted(p.glob("*.jsonl")) if p.is_dir() else [p]
+        for f in files:
+            with open(f, 'r', encoding='utf-8') as fp:
+                for line in fp:
+                    line = line.strip()
+                    if line:
+                        try:
+                            yield json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def summarize(records):
+    """
+    汇总任务记录和会话记录。
+
+    Returns:
+        dict: 任务数、各阶段总耗时/中位数/p95、下载字节、音频时长、整体实时率、重试和推送冲突次数、
+            从发布到转录完成的时间（中位数/p95）。
+    """
+    tasks = [r for r in records if r.get('type') == 'task']
+    sessions = [r for r in records if r.get('type') == 'session']
+    stage_values = defaultdict(list)
+    stage_totals = defaultdict(float)
+    counters = defaultdict(float)
+    for r in tasks + sessions:
+        for k, v in r.get('stages', {}).items():
+            stage_totals[k] += v
+            if r['type'] == 'task':
+                stage_values[k].append(v)
+        for k, v in r.get('counters', {}).items():
+            counters[k] += v
+    transcribe_total = sum(stage_values.get('transcribe', []))
+    # 从视频发布到转录完成的时间（小时），只统计成功的任务
+    ttt = [(r['start'] + r['wall'] - r['pubdate']) / 3600 for r in tasks
+           if r.get('pubdate') and r.get('status') == 'ok' and r.get('part') != 'download']
+    audio_seconds = counters.get('audio_seconds', 0)
+    return {
+        'tasks': len({r.get('task') for r in tasks}),
+        # 多进程流水线中下载和转录分别写记录，状态以转录阶段为准
+        'status': dict(sorted(_count(r.get('status', 'unknown') for r in tasks if r.get('part') != 'download').items())),
+        # 结果来源：whisper、stream（流式转录）、cc/ai（已有字幕）
+        'transcript_sources': dict(sorted(_count(r['transcript_source'] for r in tasks if r.get('transcript_source')).items())),
+        'sessions': len(sessions),
+        'session_wall': round(sum(r.get('wall', 0) for r in sessions), 1),
+        'stages': {
+            k: {'total': round(total, 1), 'p50': round(_percentile(stage_values[k], 0.5), 2), 'p95': round(_percentile(stage_values[k], 0.95), 2)}
+            for k, total in sorted(stage_totals.items())
+        },
+        'bytes_downloaded': int(counters.get('bytes_downloaded', 0)),
+        'audio_seconds': round(audio_seconds, 1),
+        'rtf': round(transcribe_total / audio_seconds, 4) if audio_seconds else None,
+        'api_retries': int(counters.get('api_retries', 0)),
+        'push_conflicts': int(counters.get('push_conflicts', 0)),
+        # 失败的任务按类型计数（见 failure_policy），以及放回队列重试和移入死信区的次数
+        'failures': dict(sorted(_count(r['failure'] for r in tasks if r.get('failure')).items())),
+        'task_retries': int(counters.get('task_retries', 0)),
+        'dead_letters': int(counters.get('dead_letters', 0)),
+        'audio_cache': {'hits': int(counters.get('audio_cache_hits', 0)), 'misses': int(counters.get('audio_cache_misses', 0))},
+        # CPU 转录模式（见 cpu_worker）按每个进程的线程数分别统计实时率
+        'cpu_rtf': _rtf_by_threads(tasks) or None,
+        'time_to_transcript_hours': {'p50': round(_percentile(ttt, 0.5), 2), 'p95': round(_percentile(ttt, 0.95), 2)} if ttt else None,
+    }
+
+def _rtf_by_threads(tasks):
+    values = defaultdict(list)
+    for r in tasks:
+        if r.get('rtf') is not None and r.get('cpu_threads'):
+            values[r['cpu_threads']].append(r['rtf'])
+    return {str(threads): {'tasks': len(v), 'p50': round(_percentile(v, 0.5), 4), 'p95': round(_percentile(v, 0.95), 4)}
+            for threads, v in sorted(values.items())}
+
+def _count(items):
+    result = defaultdict(int)
+    for item in items:
+        result[item] += 1
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="汇总流水线统计数据")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_summary = sub.add_parser("summary", help="汇总一个或多个 .jsonl 文件或目录")
+    p_summary.add_argument("paths", nargs="+", type=Path)
+    p_summary.add_argument("--by-worker", action="store_true", help="按机器分别汇总")
+    args = parser.parse_args(argv)
+
+    records = list(iter_records(args.paths))
+    if args.by_worker:
+        by_worker = defaultdict(list)
+        for r in records:
+            by_worker[r.get('worker', '?')].append(r)
+        result = {w: summarize(rs) for w, rs in sorted(by_worker.items())}
+    else:
+        result = summarize(records)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本地磁盘暂存 + 批量同步到 Google Drive。
+
+Drive 的 FUSE 挂载上每次小文件读写都要几百毫秒，偶尔还会卡住。热路径上的文件（任务列表、输出结果、日志）
+都放在本地目录中，由 DriveSyncer 在后台定期把有变化的文件批量复制到 Drive：先写临时文件再重命名，
+并在 Drive 目录中维护 .sync_manifest.json 记录每个文件同步时的大小和修改时间。
+
+用户在 Drive 上编辑的任务列表（input.txt）通过 pull() 拉回本地；同步时如果发现 Drive 上的任务列表
+在上次同步之后被修改过，就不会覆盖它，而是交给调用方合并。
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+
+MANIFEST_NAME = ".sync_manifest.json"
+
+def _stat_key(path: Path):
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def _atomic_copy(src: Path, dst: Path):
+    tmp = dst.with_name(f".{dst.name}.tmp")
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+class DriveSyncer(threading.Thread):
+    def __init__(self, local_dir: Path, drive_dir: Path, interval: float = 60, watch_files=("input.txt",), logger=None):
+        """
+        Args:
+            local_dir (Path): 本地暂存目录。
+            drive_dir (Path): Drive 上的目标目录。
+            interval (float, optional): 同步间隔秒数. 默认为 60.
+            watch_files (tuple, optional): 用户可能在 Drive 上直接编辑的文件，同步时不会覆盖 Drive 上更新过的版本.
+            logger (logging.Logger, optional): 日志记录器.
+        """
+        super().__init__(name="drive-syncer", daemon=True)
+        self.local_dir = Path(local_dir)
+        self.drive_dir = Path(drive_dir)
+        self.interval = interval
+        self.watch_files = set(watch_files)
+        self.logger = logger
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.local_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = self._load_manifest()
+
+    def _log(self, msg):
+        if self.logger:
+            self.logger.info(msg)
+        else:
+            print(msg)
+
+    def _load_manifest(self):
+        path = self.drive_dir / MANIFEST_NAME
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self):
+        self.drive_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.drive_dir / f".{MANIFEST_NAME}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.drive_dir / MANIFEST_NAME)
+
+    def drive_changed(self, name: str) -> bool:
+        """Drive 上的文件在上次同步之后是否被其他人（例如用户）修改过。"""
+        entry = self.manifest.get(name)
+        drive_stat = _stat_key(self.drive_dir / name)
+        if entry is None:
+            return drive_stat is not None
+        return drive_stat != entry.get('drive')
+
+    def pull(self, name: str) -> bool:
+        """把 Drive 上的文件复制到本地暂存目录。Drive 上不存在时返回 False。"""
+        src = self.drive_dir / name
+        if not src.exists():
+            return False
+        with self.lock:
+            dst = self.local_dir / name
+            _atomic_copy(src, dst)
+            self.manifest[name] = {'local': _stat_key(dst), 'drive': _stat_key(src), 'synced_at': time.time()}
+            self._save_manifest()
+        return True
+
+    def sync_once(self) -> int:
+        """
+        把本地有变化的文件复制到 Drive。
+
+        Returns:
+            int: 复制的文件数。
+        """
+        copied = 0
+        with self.lock:
+            self.drive_dir.mkdir(parents=True, exist_ok=True)
+            for src in sorted(self.local_dir.iterdir()):
+                if not src.is_file() or src.name.startswith('.'):
+                    continue
+                local_stat = _stat_key(src)
+                entry = self.manifest.get(src.name)
+                if entry and entry.get('local') == local_stat:
+                    continue
+                if src.name in self.watch_files and self.drive_changed(src.name):
+                    self._log(f"{self.drive_dir / src.name} 在 Drive 上被修改过，等待合并后再同步")
+                    continue
+                dst = self.drive_dir / src.name
+                _atomic_copy(src, dst)
+                self.manifest[src.name] = {'local': local_stat, 'drive': _stat_key(dst), 'synced_at': time.time()}
+                copied += 1
+            if copied:
+                self._save_manifest()
+        if copied:
+            self._log(f"已同步 {copied} 个文件到 {self.drive_dir}")
+        return copied
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.sync_once()
+            except OSError as e:
+                self._log(f"同步到 {self.drive_dir} 失败: {e}")
+
+    def stop(self):
+        """停止后台线程并做最后一次同步。"""
+        self.stop_event.set()
+        if self.is_alive():
+            self.join()
+        self.sync_once()
+
+class TaskList:
+    """
+    本地任务列表文件。只有文件的修改时间或大小变化时才重新读取。
+
+    行的格式与 input.txt 相同：空行和以 '#' 开头的行被忽略。
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._stat = None
+        self._lines = []
+
+    def lines(self):
+        stat = _stat_key(self.path)
+        if stat != self._stat:
+            if stat is None:
+                self._lines = []
+            else:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._lines = f.readlines()
+            self._stat = stat
+        return list(self._lines)
+
+    def next_line(self):
+        """返回第一个有效行（包含换行符），没有时返回 None。"""
+        for line in self.lines():
+            if line.strip() and not line.strip().startswith('#'):
+                return line
+        return None
+
+    def remove(self, line_with_newline: str) -> bool:
+        """删除第一个与 line_with_newline 相同的行。行已不存在时返回 False。"""
+        lines = self.lines()
+        try:
+            lines.remove(line_with_newline)
+        except ValueError:
+            return False
+        self.write(lines)
+        return True
+
+    def write(self, lines):
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(tmp, self.path)
+        self._lines = list(lines)
+        self._stat = _stat_key(self.path)
+
+def merge_drive_edits(syncer: DriveSyncer, task_list: TaskList, consumed: list) -> bool:
+    """
+    如果 Drive 上的任务列表在上次同步后被用户修改过，就以 Drive 上的版本为准拉回本地，
+    并去掉本地已经处理完、但 Drive 上还没有同步删除的行（consumed）。
+
+    Returns:
+        bool: 发生了合并返回 True。
+    """
+    name = task_list.path.name
+    entry = syncer.manifest.get(name)
+    if entry and entry.get('local') == _stat_key(task_list.path):
+        # 本地的删除已经同步到 Drive，之后用户重新添加的同样的行不应再被去掉
+        consumed.clear()
+    if not syncer.drive_changed(name):
+        return False
+    syncer.pull(name)
+    lines = task_list.lines()
+    for line in consumed:
+        for i, current in enumerate(lines):
+            if current.strip() == line.strip():
+                del lines[i]
+                break
+    task_list.write(lines)
+    consumed.clear()
+    return True
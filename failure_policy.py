@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+任务失败分类和重试策略。
+
+失败分为以下几类，每类有自己的最大尝试次数和指数退避：
+
+    network            网络或接口暂时不可用（超时、连接断开、5xx、接口返回其他错误码）
+    permission         没有权限：充电专属、视频不存在或不可见、需要登录（重试没有意义）
+    expired_url        下载链接过期（签名的 deadline 已过），重新获取链接后可以马上重试
+    transcriber_crash  转录程序异常退出
+    oom                内存不足（MemoryError、进程被 SIGKILL、CUDA out of memory）
+    unknown            其他异常
+
+第 n 次失败后等待 min(backoff × 2^(n-1), backoff_max) 秒再重试；同一类失败达到 max_attempts 次，
+或所有失败的总次数达到 max_total 时，任务移入死信区（见 QueueBackend.fail_task），不再占用工作进程。
+重试信息记录在任务行中：failures 是各类失败的次数，retry_after 之前不会被领取，last_error 是最近一次的错误。
+
+在 config.json 中可以覆盖各类的策略，例如：
+
+    "failures": {"max_total": 8, "network": {"max_attempts": 5, "backoff": 60, "backoff_max": 1800}}
+"""
+
+import json
+import subprocess
+import threading
+import time
+
+KINDS = ('network', 'permission', 'expired_url', 'transcriber_crash', 'oom', 'unknown')
+
+DEFAULT_POLICIES = {
+    "network": {"max_attempts": 5, "backoff": 60, "backoff_max": 1800},
+    "permission": {"max_attempts": 1, "backoff": 0, "backoff_max": 0},
+    "expired_url": {"max_attempts": 3, "backoff": 0, "backoff_max": 0},
+    "transcriber_crash": {"max_attempts": 2, "backoff": 300, "backoff_max": 3600},
+    "oom": {"max_attempts": 2, "backoff": 600, "backoff_max": 3600},
+    "unknown": {"max_attempts": 3, "backoff": 300, "backoff_max": 3600},
+}
+
+# B 站接口中表示没有权限的错误码：-403 权限不足，-404 视频不存在，62002/62004/62012 视频不可见或审核中，87007/87008 充电专属
+PERMISSION_CODES = {-403, -404, 62002, 62004, 62012, 87007, 87008}
+
+class TaskFailure(Exception):
+    """已经分类的任务失败。"""
+
+    def __init__(self, kind: str, message: str = ""):
+        super().__init__(message or kind)
+        self.kind = kind if kind in KINDS else 'unknown'
+        self.message = message or kind
+
+def _is_oom_text(text: str) -> bool:
+    text = text.lower()
+    return 'out of memory' in text or 'cannot allocate memory' in text or 'memoryerror' in text
+
+def classify(exc: BaseException) -> str:
+    """
+    根据异常判断失败类型。
+
+    Returns:
+        str: KINDS 中的一个。
+    """
+    if isinstance(exc, TaskFailure):
+        return exc.kind
+    if isinstance(exc, MemoryError):
+        return 'oom'
+    if isinstance(exc, subprocess.CalledProcessError):
+        # 被内核 OOM killer 杀掉的进程返回 -9（或 shell 中的 137）
+        stderr = exc.stderr or ''
+        if isinstance(stderr, bytes):
+            stderr = stderr.decode('utf-8', 'replace')
+        if exc.returncode in (-9, 137) or _is_oom_text(stderr):
+            return 'oom'
+        return 'transcriber_crash'
+    if _is_oom_text(str(exc)):
+        return 'oom'
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return 'network'
+    # requests 的异常都继承自 requests.RequestException（IOError），这里不导入 requests
+    if any(cls.__module__.startswith(('requests', 'urllib3')) for cls in type(exc).__mro__):
+        return 'network'
+    return 'unknown'
+
+def classify_api_error(code) -> str:
+    """根据 B 站接口的错误码判断失败类型。"""
+    return 'permission' if code in PERMISSION_CODES else 'network'
+
+class FailurePolicy:
+    def __init__(self, conf: dict = None):
+        conf = conf or {}
+        self.max_total = int(conf.get("max_total", 8))
+        self.policies = {kind: {**DEFAULT_POLICIES[kind], **conf.get(kind, {})} for kind in KINDS}
+
+    def decide(self, kind: str, failures: dict):
+        """
+        决定失败的任务是否重试。
+
+        Args:
+            kind (str): 本次失败的类型。
+            failures (dict): 包括本次在内各类失败的次数。
+
+        Returns:
+            tuple[bool, float]: (是否重试, 重试前等待的秒数)。
+        """
+        policy = self.policies.get(kind, self.policies['unknown'])
+        count = failures.get(kind, 0)
+        if count >= policy["max_attempts"] or sum(failures.values()) >= self.max_total:
+            return False, 0
+        return True, min(policy["backoff"] * 2 ** (count - 1), policy["backoff_max"])
+
+    def record(self, line: str, kind: str, error: str, now: float = None):
+        """
+        在任务行中记录本次失败。
+
+        Returns:
+            tuple[str, bool, float]: (新的任务行, 是否重试, 等待秒数)。
+        """
+        now = time.time() if now is None else now
+        bv_info = json.loads(line)
+        failures = dict(bv_info.get('failures') or {})
+        failures[kind] = failures.get(kind, 0) + 1
+        retry, delay = self.decide(kind, failures)
+        bv_info['failures'] = failures
+        bv_info['last_error'] = {'kind': kind, 'error': str(error)[:500], 'ts': int(now)}
+        if retry and delay > 0:
+            bv_info['retry_after'] = int(now + delay)
+        else:
+            bv_info.pop('retry_after', None)
+        return json.dumps(bv_info, ensure_ascii=False), retry, delay
+
+def dead_letter_record(line: str, kind: str, error: str, worker: str = None) -> dict:
+    """死信区中的一条记录：原任务行和错误信息。"""
+    return {'line': line, 'kind': kind, 'error': str(error)[:2000], 'worker': worker, 'ts': int(time.time())}
+
+_policy = None
+_lock = threading.Lock()
+
+def get_failure_policy() -> FailurePolicy:
+    """按 config.json 中的 "failures" 创建策略，同一个进程共用一个实例。"""
+    global _policy
+    with _lock:
+        if _policy is None:
+            from dp_config import get_config
+            _policy = FailurePolicy(get_config().get("failures"))
+        return _policy
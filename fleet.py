@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+机器心跳和集群状态汇总。
+
+每个进程在任务开始、进入阶段、结束时把自己的状态写到 TEMP_DIR/fleet/<pid>.json（见 dp_metrics）。
+Heartbeat 线程每 interval 秒合并本机所有进程的状态，通过队列后端发布一条心跳
+（git 后端是队列仓库远程的 refs/fleet/<机器 id>，每次强制推送一个只含心跳的提交，
+不进入队列分支的历史，也不占用 repo_lock；sqlite 后端是 heartbeats 表），内容包括：
+机器 id、正在处理的 bvid、阶段、进度、实时率、本次会话完成的任务数和音频秒数。
+
+汇总只读取每台机器最新的一条心跳，不扫描历史。上一次汇总时的各机器快照保存在 TEMP_DIR/fleet_state.json，
+吞吐量用两次快照之间的增量计算（没有上一次快照时用会话平均值），由此得到集群吞吐量和队列预计完成时间：
+- 超过 stale_after 秒没有心跳的机器视为离线；
+- 同一个任务停留在同一个阶段超过 stuck_after 秒的机器视为卡住。
+
+默认关闭，在 config.json 中开启（以下是默认值）：
+
+    "fleet": {"enabled": false, "interval": 300, "stale_after": 900, "stuck_after": 3600}
+
+命令行：
+    python fleet.py status [--json] [--watch 秒]
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import dp_metrics
+from dp_logging import setup_logger
+
+logger = setup_logger(Path(__file__).stem)
+
+DEFAULT_CONF = {"enabled": False, "interval": 300, "stale_after": 900, "stuck_after": 3600}
+
+def get_fleet_conf() -> dict:
+    from dp_config import get_config
+    return {**DEFAULT_CONF, **get_config().get("fleet", {})}
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+def collect_local(started_at: float, now: float = None) -> dict:
+    """
+    合并本机各进程的状态文件，生成一条心跳。只统计 started_at 之后更新过的文件（本次会话的进程）。
+
+    Returns:
+        dict: 心跳记录。
+    """
+    now = time.time() if now is None else now
+    active = []
+    tasks_done = 0
+    audio_seconds = 0.0
+    transcribe_seconds = 0.0
+    for f in dp_metrics.STATUS_DIR.glob("*.json"):
+        try:
+            status = json.loads(f.read_text(encoding='utf-8'))
+        except (OSError, json.JSONDecodeError):
+            continue
+        if status.get('updated', 0) < started_at:
+            continue
+        tasks_done += status.get('tasks_done', 0)
+        audio_seconds += status.get('audio_seconds', 0)
+        transcribe_seconds += status.get('transcribe_seconds', 0)
+        if status.get('task') and _alive(status['pid']):
+            active.append({k: status.get(k) for k in ('task', 'part', 'stage', 'since', 'progress', 'duration')})
+    rtf = transcribe_seconds / audio_seconds if audio_seconds else None
+    for task in active:
+        # 转录阶段没有进度回调，按本机的实时率估计
+        if task['progress'] is None and task['stage'] == 'transcribe' and rtf and task['duration'] and task['since']:
+            task['progress'] = round(min((now - task['since']) / (task['duration'] * rtf), 0.99), 3)
+    active.sort(key=lambda t: t['since'] or 0)
+    first = active[0] if active else {}
+    return {
+        'worker': dp_metrics.get_worker_id(),
+        'ts': round(now, 1),
+        'started_at': round(started_at, 1),
+        'bvid': first.get('task'),
+        'stage': first.get('stage') or first.get('part'),
+        'progress': first.get('progress'),
+        'tasks': active,
+        'tasks_done': tasks_done,
+        'audio_seconds': round(audio_seconds, 1),
+        'rtf': round(rtf, 4) if rtf else None,
+    }
+
+class Heartbeat(threading.Thread):
+    """后台定期发布本机的心跳，发布失败只记录日志，下一次再试。"""
+
+    def __init__(self, interval: float = 300, logger=None):
+        super().__init__(name="fleet-heartbeat", daemon=True)
+        self.interval = interval
+        self.logger = logger
+        self.started_at = time.time()
+        self._stop_event = threading.Event()
+
+    def beat(self):
+        from queue_backend import get_backend
+        record = collect_local(self.started_at)
+        try:
+            get_backend().publish_heartbeat(record)
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"发布心跳失败: {e}")
+        return record
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.beat()
+
+    def stop(self, final: bool = True):
+        """停止线程，final 为 True 时发布最后一条心跳。"""
+        self._stop_event.set()
+        if final:
+            self.beat()
+
+def start_heartbeat(logger=None):
+    """按 config.json 中的 "fleet" 启动心跳线程，关闭时返回 None。"""
+    conf = get_fleet_conf()
+    if not conf["enabled"]:
+        return None
+    heartbeat = Heartbeat(conf["interval"], logger)
+    heartbeat.start()
+    return heartbeat
+
+class FleetAggregator:
+    def __init__(self, state_path: Path, stale_after: float = 900, stuck_after: float = 3600):
+        """
+        Args:
+            state_path (Path): 上一次汇总的快照文件。
+            stale_after (float, optional): 超过该秒数没有心跳的机器视为离线. 默认为 900.
+            stuck_after (float, optional): 同一任务停留在同一阶段超过该秒数视为卡住. 默认为 3600.
+        """
+        self.state_path = Path(state_path)
+        self.stale_after = stale_after
+        self.stuck_after = stuck_after
+
+    def _load_state(self) -> dict:
+        try:
+            return json.loads(self.state_path.read_text(encoding='utf-8'))
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _save_state(self, state: dict):
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.state_path.with_name(f".{self.state_path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(state, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp, self.state_path)
+
+    @staticmethod
+    def _rates(record: dict, prev: dict):
+        """两次心跳之间每小时完成的任务数和音频秒数。会话重启或没有上一次快照时用会话平均值。"""
+        if prev and prev.get('started_at') == record['started_at'] and record['ts'] > prev['ts']:
+            base, since = prev, prev['ts']
+        else:
+            base, since = {'tasks_done': 0, 'audio_seconds': 0}, record['started_at']
+        hours = max(record['ts'] - since, 1) / 3600
+        return (record['tasks_done'] - base['tasks_done']) / hours, (record['audio_seconds'] - base['audio_seconds']) / hours
+
+    def update(self, records, pending: int = None, now: float = None) -> dict:
+        """
+        用每台机器最新的心跳更新汇总。
+
+        Args:
+            records (list[dict]): 心跳记录。
+            pending (int, optional): 队列中待处理的任务数，用于计算预计完成时间. 默认为 None.
+
+        Returns:
+            dict: 集群汇总和每台机器的状态。
+        """
+        now = time.time() if now is None else now
+        state = self._load_state()
+        workers = {}
+        tasks_per_hour = 0.0
+        audio_per_hour = 0.0
+        for record in records:
+            prev = state.get(record['worker'])
+            if prev and prev['ts'] == record['ts']:
+                # 心跳没有更新，沿用上一次计算的速度
+                rates = prev['rates']
+            else:
+                rates = self._rates(record, prev)
+            age = now - record['ts']
+            stuck = [t['task'] for t in record.get('tasks', []) if t.get('since') and record['ts'] - t['since'] > self.stuck_after]
+            if age > self.stale_after:
+                health = 'offline'
+            elif stuck:
+                health = 'stuck'
+            else:
+                health = 'ok'
+                tasks_per_hour += rates[0]
+                audio_per_hour += rates[1]
+            workers[record['worker']] = {
+                'health': health, 'age': round(age), 'bvid': record.get('bvid'), 'stage': record.get('stage'),
+                'progress': record.get('progress'), 'busy': len(record.get('tasks', [])), 'stuck': stuck,
+                'tasks_done': record['tasks_done'], 'rtf': record.get('rtf'),
+                'tasks_per_hour': round(rates[0], 2), 'audio_hours_per_hour': round(rates[1] / 3600, 2),
+            }
+            state[record['worker']] = {'ts': record['ts'], 'started_at': record['started_at'], 'tasks_done': record['tasks_done'],
+                                       'audio_seconds': record['audio_seconds'], 'rates': rates}
+        self._save_state(state)
+        eta = pending / tasks_per_hour if pending is not None and tasks_per_hour > 0 else None
+        return {
+            'workers_ok': sum(1 for w in workers.values() if w['health'] == 'ok'),
+            'workers_stuck': sorted(k for k, w in workers.items() if w['health'] == 'stuck'),
+            'workers_offline': sorted(k for k, w in workers.items() if w['health'] == 'offline'),
+            'tasks_per_hour': round(tasks_per_hour, 2),
+            'audio_hours_per_hour': round(audio_per_hour / 3600, 2),
+            'pending': pending,
+            'eta_hours': round(eta, 1) if eta is not None else None,
+            'workers': dict(sorted(workers.items())),
+        }
+
+def format_summary(summary: dict) -> str:
+    eta = f"{summary['eta_hours']} 小时" if summary['eta_hours'] is not None else "未知"
+    lines = [f"在线 {summary['workers_ok']}，卡住 {len(summary['workers_stuck'])}，离线 {len(summary['workers_offline'])}；"
+             f"吞吐 {summary['tasks_per_hour']} 任务/小时（{summary['audio_hours_per_hour']} 音频小时/小时）；"
+             f"待处理 {summary['pending']}，预计 {eta}"]
+    for name, w in summary['workers'].items():
+        progress = f"{w['progress'] * 100:.0f}%" if w['progress'] is not None else "-"
+        lines.append(f"  {name:<20} {w['health']:<7} {w['age']:>6}s  {w['bvid'] or '-':<14} {w['stage'] or '-':<10} {progress:>5}  "
+                     f"完成 {w['tasks_done']}  {w['tasks_per_hour']}/小时  rtf {w['rtf']}")
+    return "\n".join(lines)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="集群状态")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_status = sub.add_parser("status", help="汇总所有机器最新的心跳")
+    p_status.add_argument("--json", action="store_true", help="输出 JSON")
+    p_status.add_argument("--watch", type=float, default=0, help="每隔该秒数刷新一次")
+    args = parser.parse_args(argv)
+
+    from dp_config import get_temp_directory
+    from queue_backend import get_backend
+    conf = get_fleet_conf()
+    backend = get_backend()
+    aggregator = FleetAggregator(get_temp_directory() / "fleet_state.json", conf["stale_after"], conf["stuck_after"])
+    while True:
+        records = backend.heartbeats()
+        pending = backend.stats().get('pending', 0)
+        summary = aggregator.update(records, pending)
+        print(json.dumps(summary, ensure_ascii=False, indent=2) if args.json else format_summary(summary), flush=True)
+        if args.watch <= 0:
+            break
+        time.sleep(args.watch)
+
+if __name__ == "__main__":
+    main()
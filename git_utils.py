@@ -1,7 +1,9 @@
 from pathlib import Path
-import git
-from git.exc import GitCommandError
+from contextlib import contextmanager
+import fcntl
+import os
 import time
+import dp_metrics
 from dp_logging import setup_logger
 
 logger = setup_logger(Path(__file__).stem)
@@ -10,7 +12,31 @@ def set_logger(logger_instance):
     global logger
     logger = logger_instance
 
+@contextmanager
+def repo_lock(repo_path: Path):
+    """
+    本机进程间的仓库锁。同一台机器上的多个进程（领取任务、后台上传）共用一个工作区时，
+    必须在 reset_repo ... push_changes 整个过程中持有该锁。
+    """
+    lock_path = Path(repo_path) / ".git" / "dp_queue.lock"
+    with open(lock_path, 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
 def reset_repo(repo_path: Path):
+    with dp_metrics.stage('git_sync'):
+        _reset_repo(repo_path)
+
+def _import_git():
+    # GitPython 导入时会启动 git 进程检查版本，只在真正操作仓库时才导入
+    import git
+    return git
+
+def _reset_repo(repo_path: Path):
+    git = _import_git()
     try:
         repo = git.Repo(repo_path)
         origin = repo.remotes.origin
@@ -23,7 +49,7 @@ def reset_repo(repo_path: Path):
         repo.git.clean('-fd')
         origin.pull()
         logger.info("仓库已成功重置并与远程同步。")
-    except GitCommandError as e:
+    except git.exc.GitCommandError as e:
         logger.error(f"发生Git操作错误: {e}")
         raise
     except Exception as e:
@@ -31,16 +57,23 @@ def reset_repo(repo_path: Path):
         raise
 
 def push_changes(repo_path: Path, commit_message: str):
+    git = _import_git()
     try:
         repo = git.Repo(repo_path)
         origin = repo.remotes.origin
         logger.info("正在添加、提交和推送更改...")
-        obj_to_add = [item.a_path for item in repo.index.diff(None)] + repo.untracked_files
-        if not obj_to_add:
+        changes = repo.index.diff(None)
+        # 删除的文件（例如清理过期的共享文件）不能用 index.add
+        obj_to_remove = [item.a_path for item in changes if item.deleted_file]
+        obj_to_add = [item.a_path for item in changes if not item.deleted_file] + repo.untracked_files
+        if not obj_to_add and not obj_to_remove:
             logger.info("没有文件需要添加，跳过提交步骤。")
             return False
 
-        repo.index.add(obj_to_add)
+        if obj_to_remove:
+            repo.index.remove(obj_to_remove)
+        if obj_to_add:
+            repo.index.add(obj_to_add)
         repo.index.commit(commit_message)
         logger.info("正在推送更改...")
         push_infos = origin.push()
@@ -51,18 +84,91 @@ def push_changes(repo_path: Path, commit_message: str):
             logger.info("更改已成功推送。")
             return True
         else:
+            dp_metrics.incr('push_conflicts')
             for info in push_infos:
                 if info.flags & (git.PushInfo.ERROR | git.PushInfo.REJECTED):
                     logger.error(f"推送失败详情: {info.summary}")
             return False
-    except GitCommandError as e:
+    except git.exc.GitCommandError as e:
         logger.error(f"发生Git操作错误: {e}")
         raise
     except Exception as e:
         logger.error(f"发生未知错误: {e}")
         raise
     
+def file_added_times(repo_path: Path, paths) -> dict:
+    """
+    查询文件被加入仓库的提交时间，一次 git log 查完所有文件。
+
+    Args:
+        repo_path (Path): 仓库路径。
+        paths (list[str]): 相对仓库根目录的文件路径。
+
+    Returns:
+        dict[str, float]: 文件路径 -> 最近一次加入该文件的提交时间（Unix 时间戳），历史中找不到的文件不在结果中。
+    """
+    if not paths:
+        return {}
+    git = _import_git()
+    repo = git.Repo(repo_path)
+    output = repo.git.log('--diff-filter=A', '--format=%ct', '--name-only', '--', *paths)
+    times = {}
+    commit_time = None
+    # 每个提交是一行时间戳、一个空行，然后是加入的文件，从新到旧
+    for line in output.splitlines():
+        line = line.strip()
+        if line.isdigit():
+            commit_time = float(line)
+        elif line and commit_time is not None:
+            times.setdefault(line, commit_time)
+    return times
+
+def push_ref_file(repo_path: Path, ref: str, filename: str, data: bytes, message: str):
+    """
+    把一个文件作为没有父提交的提交强制推送到远程的 ref，不改动工作区、索引和当前分支，不需要 repo_lock。
+    ref 只保留最新的一个提交，旧的提交不会留在任何分支的历史中。
+
+    Args:
+        repo_path (Path): 仓库路径。
+        ref (str): 远程 ref，例如 "refs/fleet/worker1"。
+        filename (str): 提交中的文件名。
+        data (bytes): 文件内容。
+        message (str): 提交信息。
+
+    Raises:
+        git.exc.GitCommandError: 推送失败。
+    """
+    from io import BytesIO
+    git = _import_git()
+    from gitdb import IStream
+    repo = git.Repo(repo_path)
+    blob = repo.odb.store(IStream('blob', len(data), BytesIO(data)))
+    # 索引只在内存中使用，不会写入文件
+    index = git.IndexFile(repo, file_path=str(Path(repo.git_dir) / f"ref_index_{os.getpid()}"))
+    index.add([git.BaseIndexEntry((0o100644, blob.binsha, 0, filename))], write=False)
+    commit = git.Commit.create_from_tree(repo, index.write_tree(), message, parent_commits=[], head=False)
+    repo.git.push('--force', 'origin', f"{commit.hexsha}:{ref}")
+
+def fetch_ref_files(repo_path: Path, prefix: str, filename: str) -> dict:
+    """
+    从远程拉取 prefix 下的所有 ref（远程已删除的 ref 在本地也删除），读取每个 ref 中的文件。
+
+    Returns:
+        dict[str, bytes]: ref 名 -> 文件内容，没有该文件的 ref 不在结果中。
+    """
+    git = _import_git()
+    repo = git.Repo(repo_path)
+    repo.git.fetch('--prune', 'origin', f"+{prefix}/*:{prefix}/*")
+    files = {}
+    for ref in repo.git.for_each_ref('--format=%(refname)', prefix).split():
+        try:
+            files[ref] = repo.git.show(f"{ref}:{filename}", stdout_as_string=False)
+        except git.exc.GitCommandError:
+            continue
+    return files
+
 def reset_action_and_sync(repo_path: Path, action):
+    git = _import_git()
     while True:
         try:
             # Initialize GitPython repository object
@@ -101,13 +207,14 @@ def reset_action_and_sync(repo_path: Path, action):
                 logger.info("文件复制并推送成功。")
                 break  # Success, exit the while loop
             else:
+                dp_metrics.incr('push_conflicts')
                 for info in push_infos:
                     if info.flags & (git.PushInfo.ERROR | git.PushInfo.REJECTED):
                         logger.error(f"推送失败详情: {info.summary}")
                 logger.error("推送失败，将在5秒后重试...")
                 time.sleep(5)
 
-        except GitCommandError as e:
+        except git.exc.GitCommandError as e:
             logger.error(f"发生Git操作错误: {e}。将在5秒后重试...")
             time.sleep(5)
         except Exception as e:
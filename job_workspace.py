@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+每个任务独立的工作目录。
+
+同一台机器上同时运行多个任务时，各任务的音频、转录结果和日志都放在各自的临时目录里，互不覆盖。
+结果通过 promote() 原子地放进输出目录，退出 with 块时临时目录一定会被删除。
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+OUTPUT_SUFFIXES = ('.srt', '.txt', '.text')
+
+class JobWorkspace:
+    def __init__(self, temp_root: Path, output_dir: Path, job_id: str = "", audio_name: str = "audio.mp3", keep_failed_log: bool = True):
+        """
+        Args:
+            temp_root (Path): 所有任务工作目录的父目录。
+            output_dir (Path): 结果文件的最终目录。
+            job_id (str, optional): 任务标识（例如 bvid），用于目录名和日志名.
+            audio_name (str, optional): 工作目录中音频文件的名字. 默认为 "audio.mp3".
+            keep_failed_log (bool, optional): 任务异常退出时是否把任务日志保留到 temp_root/logs. 默认为 True.
+        """
+        self.temp_root = Path(temp_root)
+        self.output_dir = Path(output_dir)
+        self.job_id = job_id or "job"
+        self.audio_name = audio_name
+        self.keep_failed_log = keep_failed_log
+        self.dir = None
+        self._log_handler = None
+
+    @classmethod
+    def from_dir(cls, path: Path, temp_root: Path, output_dir: Path):
+        """接管一个已经存在的工作目录（例如由另一个进程中的下载阶段创建）。"""
+        ws = cls(temp_root, output_dir, job_id=Path(path).name.split('_')[0])
+        ws.dir = Path(path)
+        return ws
+
+    def __enter__(self):
+        if self.dir is None:
+            self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cleanup(failed=exc_type is not None)
+        return False
+
+    def open(self):
+        self.temp_root.mkdir(parents=True, exist_ok=True)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.dir = Path(tempfile.mkdtemp(prefix=f"{self.job_id}_", dir=self.temp_root))
+        return self.dir
+
+    def cleanup(self, failed: bool = False):
+        if self.dir is None:
+            return
+        self.detach_logger()
+        if failed and self.keep_failed_log and self.log_file.exists():
+            log_dir = self.temp_root / "logs"
+            log_dir.mkdir(parents=True, exist_ok=True)
+            shutil.copy(self.log_file, log_dir / f"{self.dir.name}.log")
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.dir = None
+
+    @property
+    def audio(self) -> Path:
+        return self.dir / self.audio_name
+
+    @property
+    def srt(self) -> Path:
+        return self.audio.with_suffix('.srt')
+
+    @property
+    def txt(self) -> Path:
+        return self.audio.with_suffix('.txt')
+
+    @property
+    def text(self) -> Path:
+        return self.audio.with_suffix('.text')
+
+    @property
+    def segments_dir(self) -> Path:
+        return self.dir / "segments"
+
+    @property
+    def log_file(self) -> Path:
+        return self.dir / "job.log"
+
+    def attach_logger(self, logger: logging.Logger):
+        """把任务日志同时写入工作目录中的 job.log，cleanup 时自动移除。"""
+        self.detach_logger()
+        handler = logging.FileHandler(self.log_file, encoding='utf-8')
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        ))
+        logger.addHandler(handler)
+        self._log_handler = (logger, handler)
+
+    def detach_logger(self):
+        if self._log_handler:
+            logger, handler = self._log_handler
+            logger.removeHandler(handler)
+            handler.close()
+            self._log_handler = None
+
+    def promote(self, base_name: str, suffixes=OUTPUT_SUFFIXES):
+        """
+        把工作目录中的 audio.<suffix> 结果原子地放到 output_dir / f"{base_name}<suffix>"。
+
+        先把所有文件放到输出目录中以 "." 开头的临时名字（in_queue 会忽略这些文件），全部就绪后再逐个 os.replace。
+        同一文件系统上直接 rename，否则先复制。
+
+        Returns:
+            list[Path]: 输出文件列表。
+        """
+        same_fs = os.stat(self.dir).st_dev == os.stat(self.output_dir).st_dev
+        staged = []
+        try:
+            for suffix in suffixes:
+                src = self.audio.with_suffix(suffix)
+                tmp = self.output_dir / f".{base_name}{suffix}.{self.dir.name}.tmp"
+                if same_fs:
+                    os.replace(src, tmp)
+                else:
+                    shutil.copy(src, tmp)
+                staged.append((tmp, self.output_dir / f"{base_name}{suffix}"))
+        except Exception:
+            for tmp, _ in staged:
+                tmp.unlink(missing_ok=True)
+            raise
+        for tmp, dst in staged:
+            os.replace(tmp, dst)
+        return [dst for _, dst in staged]
+
+def cleanup_stale_workspaces(temp_root: Path, max_age: float = 24 * 3600):
+    """删除 temp_root 下超过 max_age 秒没有修改的工作目录（例如进程被强制结束后残留的目录）。"""
+    temp_root = Path(temp_root)
+    if not temp_root.exists():
+        return 0
+    now = time.time()
+    removed = 0
+    for d in temp_root.iterdir():
+        if d.is_dir() and d.name != "logs" and now - d.stat().st_mtime > max_age:
+            shutil.rmtree(d, ignore_errors=True)
+            removed += 1
+    return removed
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+在一台机器上同时运行多个转录任务。
+
+每个工作进程从任务日志中领取一个任务（带文件锁，bv_list_file 中的新行先导入日志），在自己的 JobWorkspace 中处理。
+默认的并发数根据 CPU 核数和可用内存计算，也可以用 -n 指定。
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+from pathlib import Path
+
+from dp_logging import setup_logger
+
+logger = setup_logger(Path(__file__).stem)
+
+def get_available_memory():
+    """返回可用内存字节数，读取失败时返回 None。"""
+    try:
+        with open('/proc/meminfo', 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def default_job_count(cpus_per_job: float = 2, memory_per_job_gb: float = 4, max_jobs: int = 0):
+    """
+    根据 CPU 和内存计算可以同时运行的任务数。
+
+    Args:
+        cpus_per_job (float, optional): 每个任务需要的 CPU 核数. 默认为 2.
+        memory_per_job_gb (float, optional): 每个任务需要的内存（GB）. 默认为 4.
+        max_jobs (int, optional): 上限，0 表示不限制. 默认为 0.
+
+    Returns:
+        int: 至少为 1 的任务数。
+    """
+    cpus = os.cpu_count() or 1
+    count = max(1, int(cpus // cpus_per_job))
+    memory = get_available_memory()
+    if memory:
+        count = min(count, max(1, int(memory // (memory_per_job_gb * 1024 ** 3))))
+    if max_jobs > 0:
+        count = min(count, max_jobs)
+    return count
+
+def _worker(index: int, src_file: str):
+    # 在子进程中导入，避免父进程加载转录相关的配置和日志
+    from process_input import get_journal_file, run_next_task
+    from task_journal import TaskJournal
+    src = Path(src_file)
+    journal = TaskJournal(get_journal_file())
+    done = 0
+    while run_next_task(journal, src):
+        done += 1
+    print(f"工作进程 {index} 完成 {done} 个任务，退出。")
+
+def run_jobs(job_count: int, src_file: Path):
+    logger.info(f"使用 {job_count} 个并发任务处理 {src_file}")
+    start = time.time()
+    workers = []
+    for i in range(job_count):
+        p = multiprocessing.Process(target=_worker, args=(i, str(src_file)), name=f"job-worker-{i}")
+        p.start()
+        workers.append(p)
+    for p in workers:
+        p.join()
+        if p.exitcode != 0:
+            logger.error(f"{p.name} 异常退出，返回码 {p.exitcode}")
+    logger.info(f"所有任务处理完毕，用时 {time.time() - start:.1f} 秒")
+
+def main():
+    from dp_config import get_config, get_bv_list_file
+    config = get_config()
+
+    parser = argparse.ArgumentParser(description="在本机并发运行多个转录任务")
+    parser.add_argument("-n", "--jobs", type=int, default=0, help="并发任务数，0 表示根据 CPU 和内存自动计算")
+    parser.add_argument("--cpus-per-job", type=float, default=config.get("cpus_per_job", 2), help="每个任务需要的 CPU 核数")
+    parser.add_argument("--memory-per-job", type=float, default=config.get("memory_per_job_gb", 4), help="每个任务需要的内存（GB）")
+    args = parser.parse_args()
+
+    src_file = get_bv_list_file()
+    if not src_file.exists():
+        logger.error(f"未找到输入文件 '{src_file}'。")
+        return False
+    from process_input import get_journal_file
+    from task_journal import TaskJournal
+    # 上次运行时崩溃的工作进程领取的任务重新放回待处理队列
+    TaskJournal(get_journal_file()).recover()
+    job_count = args.jobs or default_job_count(args.cpus_per_job, args.memory_per_job, config.get("max_jobs", 0))
+    from fleet import start_heartbeat
+    heartbeat = start_heartbeat(logger)
+    run_jobs(job_count, src_file)
+    if heartbeat:
+        heartbeat.stop()
+    return True
+
+if __name__ == "__main__":
+    main()
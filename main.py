@@ -2,160 +2,170 @@ import sys
 import os
 import subprocess
 from blbldl.blbldl import fetch_audio_link_from_line, download_audio_and_create_json
+from job_workspace import JobWorkspace
+from drive_sync import DriveSyncer, TaskList, merge_drive_edits
+from task_journal import TaskJournal
+from failure_policy import FailurePolicy, classify, dead_letter_record
 import json
+import time
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-import shutil
 import argparse
 
+def fail_task(journal, policy, task_id, line, kind, error, dead_letter_path):
+    """按失败类型（见 failure_policy）把任务放回队列等待重试，重试次数用完时写入 dead_letter_path。"""
+    failures = journal.failures(task_id)
+    failures[kind] = failures.get(kind, 0) + 1
+    retry, delay = policy.decide(kind, failures)
+    if journal.fail(task_id, kind, retry=retry, delay=delay):
+        print(f"任务 '{line}' 失败（{kind}），{delay:.0f} 秒后重试")
+        return
+    print(f"任务 '{line}' 多次失败（{kind}），已放弃")
+    with open(dead_letter_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(dead_letter_record(line, kind, error), ensure_ascii=False) + '\n')
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="下载B站视频的音频")
     parser.add_argument("-m", "--max-duration", type=int, default=0, help="最大下载时长（秒）")
+    parser.add_argument("--staging-dir", default="/content/staging", help="本地暂存目录，任务列表和结果先写在这里再批量同步到 Drive")
+    parser.add_argument("--sync-interval", type=float, default=60, help="同步到 Drive 的间隔（秒）")
+    parser.add_argument("--no-staging", action="store_true", help="直接读写 Drive 上的文件")
     args = parser.parse_args()
 
     audio2txt_dir = '/content/drive/MyDrive/audio2txt'
-    input_filename = Path(audio2txt_dir) / 'input.txt'
+    drive_input_filename = Path(audio2txt_dir) / 'input.txt'
+    # input_dead.txt 中是多次失败后放弃的任务和最后一次的错误信息，每行一个 JSON
+    post_input_names = ['input_finish.txt', 'input_long.txt', 'input_epower.txt', 'input_error.txt', 'input_dead.txt']
     whisper = '/content/drive/MyDrive/Faster-Whisper-XXL/faster-whisper-xxl'
     pwd = '/content'
-    f_mp3 = Path(pwd) / "audio.mp3"
-    f_json = f_mp3.with_suffix(".json")
-    f_srt = f_mp3.with_suffix(".srt")
-    f_text = f_mp3.with_suffix(".text")
-    f_txt = f_mp3.with_suffix(".txt")
+    # 每个任务使用 jobs_dir 下独立的工作目录，退出时自动清理
+    jobs_dir = Path(pwd) / "jobs"
 
     # 启动时检查文件是否存在。如果不存在，则创建示例文件并退出。
-    if not input_filename.exists():
-        print(f"错误：未找到输入文件 '{input_filename}'。")
-        print(f"已为您创建一个示例 '{input_filename}' 文件。")
-        with open(input_filename, 'w', encoding='utf-8') as f:
+    if not drive_input_filename.exists():
+        print(f"错误：未找到输入文件 '{drive_input_filename}'。")
+        print(f"已为您创建一个示例 '{drive_input_filename}' 文件。")
+        with open(drive_input_filename, 'w', encoding='utf-8') as f:
             f.write("# 请在此文件中每行输入一个 Bilibili 视频链接或完整的 blbldl 命令。\n")
             f.write("# 以 '#' 开头的行将被忽略。\n")
             f.write("# 示例链接：\n")
             f.write("# https://www.bilibili.com/video/BV1GJ411x7h7\n")
             f.write("# 示例带参数命令：\n")
             f.write("# -c SESSDATA=... https://www.bilibili.com/video/BV1GJ411x7h7\n")
-        sys.exit(f"请向 '{input_filename}' 添加内容后重新运行。")
+        sys.exit(f"请向 '{drive_input_filename}' 添加内容后重新运行。")
+
+    # 默认把任务列表、结果文件放在本地磁盘上，由后台线程批量同步到 Drive，避免每个小文件都经过 Drive 的 FUSE 挂载
+    syncer = None
+    if args.no_staging:
+        output_dir = Path(audio2txt_dir)
+    else:
+        output_dir = Path(args.staging_dir)
+        syncer = DriveSyncer(output_dir, audio2txt_dir, interval=args.sync_interval)
+        for name in ['input.txt'] + post_input_names:
+            syncer.pull(name)
+        # 任务日志在本地不存在时（例如换了一台机器）从 Drive 恢复
+        if not (output_dir / 'task_journal.jsonl').exists():
+            syncer.pull('task_journal.jsonl')
+        syncer.start()
+    input_filename = output_dir / 'input.txt'
+    task_list = TaskList(input_filename)
+    # 任务状态记录在追加式日志中，input.txt 只作为导入来源，导入的行会从文件中删除
+    policy = FailurePolicy()
+    journal = TaskJournal(output_dir / 'task_journal.jsonl', max_attempts=policy.max_total)
+    recovered = journal.recover(all_claims=True)
+    if recovered:
+        print(f"恢复 {recovered} 个上次运行时没有完成的任务")
+    # 已经导入日志、但删除操作还没有同步到 Drive 的行，合并用户在 Drive 上的修改时需要排除
+    consumed = []
 
     while True:
-        # 在每次循环开始时，都重新读取文件以获取最新内容
-        with open(input_filename, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-
-        # 寻找第一个有效行进行处理
-        line_with_newline = None
-        for current_line_obj in lines:
-            if current_line_obj.strip() and not current_line_obj.strip().startswith('#'):
-                line_with_newline = current_line_obj
+        # 用户在 Drive 上修改了任务列表时，拉回本地并合并
+        if syncer and merge_drive_edits(syncer, task_list, consumed):
+            print(f"已合并 Drive 上对 {input_filename.name} 的修改")
+        # 只在文件变化时才重新读取并导入
+        imported = journal.import_file(input_filename)
+        if imported:
+            print(f"从 {input_filename.name} 导入 {len(imported)} 个任务")
+            if syncer:
+                consumed.extend(imported)
+
+        # 如果没有待处理的任务，说明所有任务都已处理完毕，退出循环
+        claimed = journal.claim()
+        if claimed is None:
+            # 还有等待重试的任务时等到最早的一个可以领取
+            retry_at = journal.next_retry()
+            if retry_at is None:
                 break
+            time.sleep(max(min(retry_at - time.time(), args.sync_interval), 1))
+            continue
 
-        # 如果没有找到有效行，说明所有任务都已处理完毕，退出循环
-        if line_with_newline is None:
-            break
-
-        line = line_with_newline.strip()
+        task_id, line = claimed
 
         print("-" * 40)
         print(f"开始处理: {line}")
 
         try:
-            print("--- 开始删除音频文件 ---")
-            files_to_delete = [f_mp3, f_json]
-            for f_path in files_to_delete:
-                try:
-                    os.remove(f_path)
-                    print(f"已删除音频文件: {f_path}")
-                except FileNotFoundError:
-                    pass  # 文件不存在，是正常情况
-                except Exception as e:
-                    print(f"删除音频文件 {f_path} 时出错: {e}")
-            print("--- 删除音频文件完成 ---")
-
-            # 步骤 1: 下载音频
-            print(f"正在下载: {line}")
-            max_attempts = 10
-            delay = 5
-            status, audio_link, audio_json = fetch_audio_link_from_line(line, max_attempts, delay)
-            if status == 'excluded':
-                print(f"充电专属,已跳过视频: {line}")
-            elif status == 'failed':
-                print(f"下载视频失败: {line}")
-            elif status == 'error':
-                print(f"下载视频错误: {line}")
-            else:
-                if args.max_duration and audio_json.get('duration') > args.max_duration:
-                    print(f"{line} 视频长度超过 {args.max_duration}秒, 跳过视频")
-                    status = 'toolong'
+            with JobWorkspace(jobs_dir, output_dir) as ws:
+                f_mp3 = ws.audio
+                f_json = f_mp3.with_suffix(".json")
+
+                # 步骤 1: 下载音频
+                print(f"正在下载: {line}")
+                max_attempts = 10
+                delay = 5
+                status, audio_link, audio_json = fetch_audio_link_from_line(line, max_attempts, delay)
+                if status == 'excluded':
+                    print(f"充电专属,已跳过视频: {line}")
+                elif status == 'failed':
+                    print(f"下载视频失败: {line}")
+                elif status == 'error':
+                    print(f"下载视频错误: {line}")
                 else:
-                    status = download_audio_and_create_json(audio_link, audio_json, f_mp3)
-                    if status == 'ok':
-                        print("--- 开始删除文本文件 ---")
-                        files_to_delete = [f_srt, f_text, f_txt]
-                        for f_path in files_to_delete:
-                            try:
-                                os.remove(f_path)
-                                print(f"已删除文本文件: {f_path}")
-                            except FileNotFoundError:
-                                pass  # 文件不存在，是正常情况
-                            except Exception as e:
-                                print(f"删除文本文件 {f_path} 时出错: {e}")
-                        print("--- 删除文本文件完成 ---")
-
-                        # 步骤 2: 调用 faster-whisper-xxl 处理音频
-                        if os.path.exists(f_mp3):
-                            print(f"--- 开始使用 faster-whisper-xxl 转录音频 ---")
-                            whisper_command = [
-                                whisper,
-                                f_mp3,
-                                '-m', 'large-v2',
-                                '-l', 'Chinese',
-                                '--vad_method', 'pyannote_v3',
-                                '--ff_vocal_extract', 'mdx_kim2',
-                                '--sentence',
-                                '-v', 'true',
-                                '-o', 'source',
-                                '-f', 'txt', 'srt', 'text'
-                            ]
-                            subprocess.run(whisper_command, check=True)
-                            print("--- 音频转录完成 ---")
-                        else:
-                            print(f"警告: 未找到音频文件 '{f_mp3}'，跳过转录步骤。")
-
-                        with open(f_json, "r", encoding='utf-8') as f:
-                            j = json.load(f)
-                            title = j.get('title', 'Untitled')
-                            # 替换在Windows和Linux文件名中不合法的字符
-                            invalid_chars = '<>:"/\\|?*'
-                            sanitized_title = title.translate(str.maketrans(invalid_chars, '_' * len(invalid_chars)))[0:50]
-                            # 将B站API返回的UTC时间戳转换为东八区（UTC+8）时间
-                            dt_utc8 = datetime.fromtimestamp(j.get('datetime'), tz=timezone(timedelta(hours=8)))
-                            fn = f"[{dt_utc8.strftime('%Y-%m-%d_%H-%M-%S')}][{j.get('owner')}][{sanitized_title}][{j.get('bvid')}]"
-                            shutil.copy(f_srt, Path(audio2txt_dir) / f"{fn}.srt")
-                            shutil.copy(f_txt, Path(audio2txt_dir) / f"{fn}.txt")
-                            shutil.copy(f_text, Path(audio2txt_dir) / f"{fn}.text")
-                            print(f"--- 复制文件{fn}完成 ---")
+                    if args.max_duration and audio_json.get('duration') > args.max_duration:
+                        print(f"{line} 视频长度超过 {args.max_duration}秒, 跳过视频")
+                        status = 'toolong'
+                    else:
+                        status = download_audio_and_create_json(audio_link, audio_json, f_mp3)
+                        if status == 'ok':
+                            # 步骤 2: 调用 faster-whisper-xxl 处理音频
+                            if os.path.exists(f_mp3):
+                                print(f"--- 开始使用 faster-whisper-xxl 转录音频 ---")
+                                whisper_command = [
+                                    whisper,
+                                    f_mp3,
+                                    '-m', 'large-v2',
+                                    '-l', 'Chinese',
+                                    '--vad_method', 'pyannote_v3',
+                                    '--ff_vocal_extract', 'mdx_kim2',
+                                    '--sentence',
+                                    '-v', 'true',
+                                    '-o', 'source',
+                                    '-f', 'txt', 'srt', 'text'
+                                ]
+                                subprocess.run(whisper_command, check=True)
+                                print("--- 音频转录完成 ---")
+                            else:
+                                print(f"警告: 未找到音频文件 '{f_mp3}'，跳过转录步骤。")
+
+                            with open(f_json, "r", encoding='utf-8') as f:
+                                j = json.load(f)
+                                title = j.get('title', 'Untitled')
+                                # 替换在Windows和Linux文件名中不合法的字符
+                                invalid_chars = '<>:"/\\|?*'
+                                sanitized_title = title.translate(str.maketrans(invalid_chars, '_' * len(invalid_chars)))[0:50]
+                                # 将B站API返回的UTC时间戳转换为东八区（UTC+8）时间
+                                dt_utc8 = datetime.fromtimestamp(j.get('datetime'), tz=timezone(timedelta(hours=8)))
+                                fn = f"[{dt_utc8.strftime('%Y-%m-%d_%H-%M-%S')}][{j.get('owner')}][{sanitized_title}][{j.get('bvid')}]"
+                                ws.promote(fn)
+                                print(f"--- 复制文件{fn}完成 ---")
 
             # status in 'ok', 'failed', 'toolong', 'excluded', 'error'
-            if status != 'failed':
-                # 为了防止覆盖在处理期间用户对文件的修改（例如添加了新行），
-                # 我们在这里重新读取文件，然后只移除我们刚刚处理完的这一行。
-                try:
-                    with open(input_filename, 'r', encoding='utf-8') as f:
-                        current_lines = f.readlines()
-
-                    # 尝试从最新的文件内容中移除我们刚刚处理的行。
-                    # list.remove() 只会移除第一个匹配项，这正是我们想要的。
-                    try:
-                        current_lines.remove(line_with_newline)
-                    except ValueError:
-                        # 如果在处理期间，用户已经手动删除了这一行，.remove() 会抛出 ValueError。
-                        # 这是正常情况，我们忽略它，但仍然继续执行写入，以保留用户可能添加的其他新行。
-                        print(f"提示: 任务 '{line}' 在处理完成前已被从文件中移除。")
-
-                    with open(input_filename, 'w', encoding='utf-8') as f:
-                        f.writelines(current_lines)
-                    print(f"已成功处理并从 {input_filename.name} 中删除行: {line}")
-                except Exception as e:
-                    print(f"错误: 更新 {input_filename.name} 时发生错误: {e}")
+            if status == 'failed':
+                # 下载失败的任务等待一段时间后重试，超过重试次数后不再处理
+                fail_task(journal, policy, task_id, line, 'network', "下载视频失败", input_filename.parent / 'input_dead.txt')
+            else:
+                journal.complete(task_id, status)
+                print(f"已成功处理任务: {line}")
 
             post_input_path = None
             if status == 'ok':
@@ -173,16 +183,12 @@ if __name__ == "__main__":
                 
         except Exception as e:
             print(f"处理 '{line}' 期间发生严重错误: {e}")
-        finally:
-            # 步骤 3: 清理本次循环产生的临时文件，为下一次做准备
-            print("--- 执行循环后清理 ---")
-            for f_path in files_to_delete:
-                if os.path.exists(f_path):
-                    try:
-                        os.remove(f_path)
-                        print(f"已删除临时文件: {f_path}")
-                    except Exception as e:
-                        print(f"删除文件 {f_path} 时出错: {e}")
+            fail_task(journal, policy, task_id, line, classify(e), str(e), input_filename.parent / 'input_dead.txt')
 
+    if syncer:
+        syncer.stop()
+        if syncer.drive_changed(input_filename.name):
+            merge_drive_edits(syncer, task_list, consumed)
+            syncer.sync_once()
     print("-" * 40)
     print("所有待处理行已完成，程序退出。")
\ No newline at end of file
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+playurl 结果缓存和预取。
+
+B 站返回的音频链接带签名，URL 中的 deadline 参数是过期时间（unix 时间戳，通常是两小时后）。
+选中的音轨（见 dp_bilibili_api.select_audio_track）按 (bvid, cid, 音轨策略) 缓存在 TEMP_DIR/playurl_cache，
+一个条目一个 JSON 文件，同一台机器上的多个进程共用。
+
+- 领取任务后由 PlayurlPrefetcher 在后台提前获取下载链接，下载阶段直接使用缓存，不再等待接口和重试；
+- 剩余有效期少于 refresh_margin 的条目由预取线程提前刷新，少于 margin 的条目视为过期；
+- 下载结束后删除条目（下载失败时链接可能已经失效，下次重新获取）。
+
+在 config.json 中配置（以下是默认值）：
+
+    "playurl_cache": {"enabled": true, "margin": 300, "refresh_margin": 900, "default_ttl": 3600}
+"""
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+from pathlib import Path
+
+def url_deadline(url: str):
+    """返回 URL 中 deadline 参数的值，没有时返回 None。"""
+    try:
+        values = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query).get('deadline')
+        return int(values[0]) if values else None
+    except ValueError:
+        return None
+
+class PlayurlCache:
+    def __init__(self, cache_dir: Path, audio_policy: dict = None, margin: float = 300, default_ttl: float = 3600):
+        """
+        Args:
+            cache_dir (Path): 缓存目录。
+            audio_policy (dict, optional): 音轨选择策略，策略不同的条目分开缓存. 默认为 None.
+            margin (float, optional): 剩余有效期少于该秒数的条目视为过期. 默认为 300.
+            default_ttl (float, optional): URL 中没有 deadline 时的有效期（秒）. 默认为 3600.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.margin = margin
+        self.default_ttl = default_ttl
+        self.quality = hashlib.sha1(json.dumps(audio_policy or {}, sort_keys=True).encode()).hexdigest()[:8]
+
+    def _path(self, bvid, cid) -> Path:
+        return self.cache_dir / f"{bvid}_{cid}_{self.quality}.json"
+
+    def deadline(self, track: dict) -> float:
+        deadline = url_deadline(track['url'])
+        return deadline if deadline else track.get('fetched_at', 0) + self.default_ttl
+
+    def expires_in(self, track: dict) -> float:
+        return self.deadline(track) - time.time()
+
+    def get(self, bvid, cid, margin: float = None):
+        """
+        Returns:
+            dict | None: 缓存的音轨，没有或剩余有效期少于 margin 时返回 None。
+        """
+        try:
+            track = json.loads(self._path(bvid, cid).read_text(encoding='utf-8'))
+        except (OSError, json.JSONDecodeError):
+            return None
+        if self.expires_in(track) < (self.margin if margin is None else margin):
+            return None
+        return track
+
+    def put(self, bvid, cid, track: dict):
+        track = dict(track, fetched_at=time.time())
+        path = self._path(bvid, cid)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(track, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp, path)
+
+    def discard(self, bvid, cid):
+        """下载完成（或链接失效）后删除条目，预取线程不再刷新它。"""
+        self._path(bvid, cid).unlink(missing_ok=True)
+
+    def exists(self, bvid, cid) -> bool:
+        return self._path(bvid, cid).exists()
+
+    def get_or_fetch(self, client, bvid, cid):
+        """
+        先查缓存，没有可用条目时用 client.get_audio_track 获取并写入缓存。
+
+        Returns:
+            dict | None: 音轨，获取失败时返回 None。
+        """
+        track = self.get(bvid, cid)
+        if track is not None:
+            import dp_metrics
+            dp_metrics.incr('playurl_cache_hits')
+            return track
+        track = client.get_audio_track(bvid, cid)
+        if track:
+            self.put(bvid, cid, track)
+        return track
+
+    def purge(self):
+        """删除已经过期的条目。"""
+        for f in self.cache_dir.glob("*.json"):
+            try:
+                if self.expires_in(json.loads(f.read_text(encoding='utf-8'))) < 0:
+                    f.unlink(missing_ok=True)
+            except (OSError, json.JSONDecodeError):
+                f.unlink(missing_ok=True)
+
+class PlayurlPrefetcher(threading.Thread):
+    """
+    后台预取下载链接：submit 的任务依次获取，最近 submit 的 max_tracked 个任务在剩余有效期少于 refresh_margin 时重新获取。
+    """
+    def __init__(self, cache: PlayurlCache, client_factory, refresh_margin: float = 900, max_tracked: int = 32, logger=None):
+        super().__init__(name="playurl-prefetch", daemon=True)
+        self.cache = cache
+        self.client_factory = client_factory
+        self.refresh_margin = refresh_margin
+        self.max_tracked = max_tracked
+        self.logger = logger
+        self.tracked = {}
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+
+    def submit(self, bvid, cid):
+        self._queue.put((bvid, cid))
+
+    def _fetch(self, bvid, cid):
+        try:
+            track = self.client_factory().get_audio_track(bvid, cid)
+            if track:
+                self.cache.put(bvid, cid, track)
+        except Exception as e:
+            if self.logger:
+                self.logger.warning(f"预取 {bvid} 的下载链接失败: {e}")
+
+    def _refresh(self):
+        for (bvid, cid) in list(self.tracked):
+            if not self.cache.exists(bvid, cid):
+                # 已经下载完成
+                self.tracked.pop((bvid, cid), None)
+                continue
+            if self.cache.get(bvid, cid, margin=self.refresh_margin) is None:
+                if self.logger:
+                    self.logger.info(f"{bvid} 的下载链接即将过期，重新获取")
+                self._fetch(bvid, cid)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                bvid, cid = self._queue.get(timeout=30)
+            except queue.Empty:
+                self._refresh()
+                continue
+            self.tracked.pop((bvid, cid), None)
+            self.tracked[(bvid, cid)] = time.time()
+            while len(self.tracked) > self.max_tracked:
+                self.tracked.pop(next(iter(self.tracked)))
+            if self.cache.get(bvid, cid, margin=self.refresh_margin) is None:
+                self._fetch(bvid, cid)
+
+    def stop(self):
+        self._stop_event.set()
+
+def get_playurl_cache():
+    """按 config.json 中的 "playurl_cache" 创建缓存，关闭时返回 None。"""
+    from dp_config import get_config, get_temp_directory
+    config = get_config()
+    conf = config.get("playurl_cache", {})
+    if not conf.get("enabled", True):
+        return None
+    return PlayurlCache(get_temp_directory(config) / "playurl_cache", config.get("audio_track"),
+                        conf.get("margin", 300), conf.get("default_ttl", 3600))
+
+def start_prefetcher(client_factory, logger=None):
+    """启动后台预取线程，缓存关闭时返回 None。"""
+    from dp_config import get_config
+    cache = get_playurl_cache()
+    if cache is None:
+        return None
+    conf = get_config().get("playurl_cache", {})
+    cache.purge()
+    prefetcher = PlayurlPrefetcher(cache, client_factory, conf.get("refresh_margin", 900), logger=logger)
+    prefetcher.start()
+    return prefetcher
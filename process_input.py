@@ -1,10 +1,16 @@
 
-from dp_logging import setup_logger
+from dp_logging import setup_logger, log_context
+from dp_config import get_config, resolve_path, get_temp_directory, get_output_directory, get_bv_list_file
+from job_workspace import JobWorkspace, cleanup_stale_workspaces
+from task_journal import TaskJournal
+from failure_policy import TaskFailure, classify, classify_api_error
 from pathlib import Path
-import shutil
 import json
-from dp_bilibili_api import dp_bilibili, download_file_with_resume
+import os
+import sys
+import dp_metrics
 import time
+import threading
 import subprocess
 from datetime import datetime, timezone, timedelta
 
@@ -13,168 +19,571 @@ logger = setup_logger(Path(__file__).stem)
 # Get the directory where the script is located
 SCRIPT_DIR = Path(__file__).parent.resolve()
 
-def get_config():
-    """Get the queue directory from the config file."""
-    config_file = SCRIPT_DIR / "config.json"
-    if not config_file.exists():
-        logger.error(f"配置文件 {config_file} 不存在。")
-        shutil.copy(SCRIPT_DIR / "config_sample.json", config_file)
-        logger.info(f"已将 config_sample.json 复制到 {config_file}")
+# 下面这些依赖配置文件的值在第一次访问时才计算，导入本模块不会读取配置或创建目录
+def get_jobs_directory():
+    # 每个任务在 jobs 目录下有自己的工作目录，多个任务可以同时运行
+    return get_temp_directory() / "jobs"
 
-    import json
-    with open(config_file, 'r', encoding='utf-8') as f:
-        config = json.load(f)
+def get_journal_file():
+    # 任务状态记录在本地的追加式日志中，bv_list_file 只作为导入来源
+    return get_temp_directory() / "task_journal.jsonl"
 
-    return config
-config = get_config()
+_LAZY_ATTRS = {
+    'config': get_config,
+    'TEMP_DIR': get_temp_directory,
+    'OUTPUT_DIR': get_output_directory,
+    'JOBS_DIR': get_jobs_directory,
+    'JOURNAL_FILE': get_journal_file,
+    'STREAM_SEGMENT_SECONDS': lambda: get_stream_segment_seconds(),
+}
 
-def get_temp_directory(config):
-    temp_path = Path(config.get("temp_directory", "temp"))
+def __getattr__(name):
+    if name in _LAZY_ATTRS:
+        return _LAZY_ATTRS[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-    if temp_path.is_absolute():
-        # 如果是绝对路径，直接使用
-        return temp_path
+WHISPER = '/content/drive/MyDrive/Faster-Whisper-XXL/faster-whisper-xxl'
+
+def get_whisper_path():
+    # 配置中可以替换为其他可执行文件，例如基准测试中的 benchmarks/fake_whisper.py
+    return get_config().get("whisper_path", WHISPER)
+
+def get_stream_segment_seconds():
+    # 大于0时启用边下载边转录，按该时长（秒）切分音频
+    return int(get_config().get("stream_segment_seconds", 0))
+
+def get_transcriber(transcriber: str = None) -> str:
+    """转录方式：显式传入的优先（例如 cpu_worker 传给工作进程的），否则取 config.json 中的 "transcriber"，默认 "whisper"。"""
+    return transcriber or get_config().get("transcriber", "whisper")
+
+def build_whisper_command(audio_path):
+    return [
+        get_whisper_path(),
+        audio_path,
+        '-m', 'large-v2',
+        '-l', 'Chinese',
+        '--vad_method', 'pyannote_v3',
+        '--ff_vocal_extract', 'mdx_kim2',
+        '--sentence',
+        '-v', 'true',
+        '-o', 'source',
+        '-f', 'txt', 'srt', 'text'
+    ]
+
+# 用途 -> (dp_bilibili 实例, 创建时间)
+_clients = {}
+_client_lock = threading.Lock()
+_prefetcher = None
+CLIENT_MAX_AGE = 6 * 3600
+
+def get_bilibili_client(purpose: str = "task"):
+    """
+    本进程共用的 dp_bilibili 实例，每种用途一个。创建时需要请求 wbi 密钥，复用可以省掉每个任务的这次请求；
+    密钥每天会变，超过 CLIENT_MAX_AGE 后重新创建。
+
+    后台预取（purpose="prefetch"）使用单独的实例：实例的 last_error_code 记录最近一次请求的错误码，
+    工作线程据此对失败分类（见 no_track_failure），共用实例时并发的预取会覆盖它。
+
+    Args:
+        purpose (str, optional): 用途. 默认为 "task".
+    """
+    # requests、tqdm 等依赖只在真正下载时才导入
+    from dp_bilibili_api import dp_bilibili
+    with _client_lock:
+        client, created = _clients.get(purpose, (None, 0))
+        if client is None or time.time() - created > CLIENT_MAX_AGE:
+            config = get_config()
+            # AI 字幕需要登录，配置了 cookies_file 时带上登录信息
+            cookies = None
+            if config.get("cookies_file") and resolve_path(config["cookies_file"]).exists():
+                cookies = json.loads(resolve_path(config["cookies_file"]).read_text(encoding='utf-8'))
+            client = dp_bilibili(cookies=cookies, logger=logger, api_base=config.get("bilibili_api_base"),
+                                 audio_policy=config.get("audio_track"))
+            _clients[purpose] = (client, time.time())
+        return client
+
+def prefetch_audio_track(bv_info):
+    """在后台提前获取任务的下载链接（见 playurl_cache），缓存关闭时什么都不做。"""
+    global _prefetcher
+    from playurl_cache import start_prefetcher
+    if _prefetcher is None:
+        _prefetcher = start_prefetcher(lambda: get_bilibili_client("prefetch"), logger) or False
+    if _prefetcher:
+        _prefetcher.submit(bv_info['bvid'], bv_info['cid'])
+
+def get_audio_track(bv_info):
+    """
+    按 config.json 中的 "audio_track" 策略选择音轨（见 dp_bilibili_api.select_audio_track），优先使用预取的缓存。
+    选中音轨的码率和预计大小计入任务统计。
+
+    Returns:
+        tuple: (dp_bilibili 实例, 音轨)，没有可用音轨时音轨为 None。
+    """
+    from playurl_cache import get_playurl_cache
+    cache = get_playurl_cache()
+    with dp_metrics.stage('metadata'):
+        dp_blbl = get_bilibili_client()
+        if cache:
+            track = cache.get_or_fetch(dp_blbl, bv_info['bvid'], bv_info['cid'])
+        else:
+            track = dp_blbl.get_audio_track(bv_info['bvid'], bv_info['cid'])
+    if not track:
+        return dp_blbl, None
+    metrics = dp_metrics.current()
+    if isinstance(metrics, dp_metrics.TaskMetrics):
+        metrics.set('audio_bandwidth', track['bandwidth'])
+        metrics.set('audio_size_estimate', track['size'])
+    return dp_blbl, track
+
+def discard_audio_track(bv_info):
+    from playurl_cache import get_playurl_cache
+    cache = get_playurl_cache()
+    if cache:
+        cache.discard(bv_info['bvid'], bv_info['cid'])
+
+def cache_audio(bv_info, track, audio_path: Path):
+    """把下载完成的音频放入本地音频缓存（见 audio_cache）。"""
+    from audio_cache import get_audio_cache
+    audio_cache = get_audio_cache()
+    if audio_cache and track and audio_path.exists():
+        try:
+            audio_cache.put(bv_info['bvid'], bv_info['cid'], track['id'], audio_path)
+        except OSError as e:
+            logger.warning(f"缓存音频失败: {e}")
+
+def download_progress(track):
+    """返回把下载进度报告给 dp_metrics（见 fleet）的 chunk_callback，不知道文件大小时只报告仍在下载。"""
+    total = track.get('size') if track else None
+    done = 0
+    def callback(chunk):
+        nonlocal done
+        done += len(chunk)
+        dp_metrics.progress(done / total if total else None)
+    return callback
+
+def run_transcriber(command):
+    """
+    运行转录程序，转发它的输出，每收到一段输出就向 dp_metrics 报告一次进度（supervisor 据此判断转录没有卡住）。
+
+    Raises:
+        subprocess.CalledProcessError: 转录程序返回非 0。
+    """
+    # faster-whisper-xxl 是打包的 Python 程序，输出到管道时默认整块缓冲，关闭缓冲才能及时收到进度
+    env = {**os.environ, "PYTHONUNBUFFERED": "1"}
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env) as proc:
+        out = getattr(sys.stdout, 'buffer', None)
+        for chunk in iter(lambda: os.read(proc.stdout.fileno(), 4096), b''):
+            if out is not None:
+                out.write(chunk)
+                out.flush()
+            dp_metrics.progress()
+        returncode = proc.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+def no_track_failure(dp_blbl, bv_info) -> TaskFailure:
+    """没有可用音轨时按接口的错误码分类（没有权限的任务不会重试，见 failure_policy）。"""
+    code = dp_blbl.last_error_code
+    return TaskFailure(classify_api_error(code), f"{bv_info['bvid']} 没有可用的音轨，错误码 {code}")
+
+def download_failure(bv_info, url: str) -> TaskFailure:
+    """下载失败时，链接已经过期的归为 expired_url（重新获取链接后马上重试），否则归为 network。"""
+    from playurl_cache import url_deadline
+    deadline = url_deadline(url)
+    if deadline and deadline <= time.time():
+        return TaskFailure('expired_url', f"{bv_info['bvid']} 的下载链接已过期")
+    return TaskFailure('network', f"下载 {bv_info['bvid']} 的音频失败")
+
+def fetch_audio_link_from_json(bv_info, audio_path: Path, selected: tuple = None):
+    """
+    获取下载链接并把音频下载到 audio_path。
+
+    Args:
+        selected (tuple, optional): 已经选好的 get_audio_track 的结果，为 None 时在这里选择. 默认为 None.
+
+    Raises:
+        TaskFailure: 没有可用的音轨或下载失败。
+    """
+    from dp_bilibili_api import download_file_with_resume
+    dp_blbl, track = selected or get_audio_track(bv_info)
+    if not track:
+        raise no_track_failure(dp_blbl, bv_info)
+    dl_url = track['url']
+    logger.info(f"视频 {bv_info['title']} 的下载链接: {dl_url}")
+    logger.info(f"正在下载 {dl_url} 到 {audio_path}")
+    try:
+        with dp_metrics.stage('download'):
+            ok = download_file_with_resume(dp_blbl.session, dl_url, audio_path, chunk_callback=download_progress(track))
+    finally:
+        discard_audio_track(bv_info)
+    if not ok:
+        raise download_failure(bv_info, dl_url)
+    cache_audio(bv_info, track, audio_path)
+
+def stream_transcribe_from_json(bv_info, audio_path: Path, segments_dir: Path, selected: tuple = None):
+    """
+    边下载边转录。成功时 audio_path 旁边的 .srt/.txt/.text 已经生成，返回 True。
+    下载完成但分段转录失败时直接返回 False；下载中断时用断点续传补全 audio_path 并返回 False，
+    两种情况都由调用方按普通流程转录整个文件。
+
+    Args:
+        selected (tuple, optional): 已经选好的 get_audio_track 的结果，为 None 时在这里选择. 默认为 None.
+
+    Raises:
+        TaskFailure: 没有可用的音轨，或流式转录和续传都失败。
+    """
+    from dp_bilibili_api import download_file_with_resume
+    from stream_transcribe import StreamingTranscriber, STREAMED, DOWNLOADED
+    segment_seconds = get_stream_segment_seconds()
+    dp_blbl, track = selected or get_audio_track(bv_info)
+    if not track:
+        raise no_track_failure(dp_blbl, bv_info)
+    dl_url = track['url']
+    logger.info(f"视频 {bv_info['title']} 的下载链接: {dl_url}")
+    logger.info(f"正在流式下载并转录 {dl_url}，分段时长 {segment_seconds} 秒")
+    transcriber = StreamingTranscriber(build_whisper_command, segments_dir, segment_seconds, logger=logger,
+                                       run_command=run_transcriber)
+    # 下载和转录重叠进行，整体计入 stream 阶段
+    with dp_metrics.stage('stream'):
+        result = transcriber.run(dp_blbl.session, dl_url, audio_path)
+    if result in (STREAMED, DOWNLOADED):
+        discard_audio_track(bv_info)
+        cache_audio(bv_info, track, audio_path)
+        if result == DOWNLOADED:
+            # 文件已经完整，再续传会请求 Range: bytes=<文件大小>-，服务器返回 416 被当成下载失败
+            logger.warning(f"流式转录失败，{audio_path} 已下载完整，按普通流程转录")
+        return result == STREAMED
+    logger.warning(f"流式下载中断，续传 {audio_path} 后按普通流程转录")
+    try:
+        with dp_metrics.stage('download'):
+            resumed = download_file_with_resume(dp_blbl.session, dl_url, audio_path)
+    finally:
+        discard_audio_track(bv_info)
+    if not resumed:
+        raise download_failure(bv_info, dl_url)
+    cache_audio(bv_info, track, audio_path)
+    return False
+
+SUBTITLE_POLICY = {
+    "sources": ["cc"],
+    "languages": ["zh-CN", "zh-Hans", "zh-Hant", "zh-TW", "zh-HK", "ai-zh"],
+    "min_coverage": 0.5,
+}
+
+def get_subtitle_policy():
+    """
+    config.json 中的 "subtitles"：sources 是按优先级排列的字幕来源（"cc" UP 主字幕，"ai" B 站 AI 字幕，
+    AI 字幕需要在 config.json 中用 "cookies_file" 指定登录信息），为空时关闭；languages 是可接受的语言；字幕覆盖的时长不足视频时长的 min_coverage 时不使用。
+    """
+    return {**SUBTITLE_POLICY, **get_config().get("subtitles", {})}
+
+def fetch_subtitle_transcript(bv_info, ws: JobWorkspace):
+    """
+    视频已有符合策略的字幕时，直接在工作目录中生成 .srt/.txt/.text，不需要下载音频和转录。
+
+    Returns:
+        str | None: 使用的字幕来源（"cc" 或 "ai"），没有可用字幕时返回 None。
+    """
+    from transcript_store import RENDERERS, write_view
+    policy = get_subtitle_policy()
+    if not policy["sources"]:
+        return None
+    with dp_metrics.stage('subtitle'):
+        dp_blbl = get_bilibili_client()
+        subtitles = [sub for sub in dp_blbl.get_subtitle_list(bv_info['bvid'], bv_info['cid'])
+                     if sub['url'] and sub['source'] in policy["sources"] and sub['lan'] in policy["languages"]]
+        subtitles.sort(key=lambda sub: (policy["sources"].index(sub['source']), policy["languages"].index(sub['lan'])))
+        for sub in subtitles:
+            segments = dp_blbl.get_subtitle_segments(sub['url'])
+            covered = sum(seg['e'] - seg['s'] for seg in segments) / 1000
+            duration = bv_info.get('duration') or 0
+            if not segments or (duration and covered < duration * policy["min_coverage"]):
+                logger.info(f"{bv_info['bvid']} 的字幕 {sub['lan_doc']} 只覆盖 {covered:.0f}/{duration} 秒，不使用")
+                continue
+            for suffix, render in RENDERERS.items():
+                write_view(ws.audio.with_suffix(suffix), render(segments))
+            ws.audio.with_suffix('.source').write_text(sub['source'], encoding='utf-8')
+            logger.info(f"{bv_info['bvid']} 使用已有的{sub['source'].upper()}字幕 {sub['lan_doc']}，跳过下载和转录")
+            return sub['source']
+    return None
+
+def dedupe_by_fingerprint(bv_info, ws: JobWorkspace, lookup: bool = True):
+    """
+    计算已下载音频的指纹并保存到工作目录（转录完成后加入索引，见 index_fingerprint），
+    lookup 为 True 时在指纹索引中查找近似重复的已转录视频，找到时直接生成它的转录结果。
+
+    Returns:
+        str | None: 重复视频的 bvid，没有重复时返回 None。
+    """
+    from audio_fingerprint import get_fingerprint_index, fingerprint_file, sync_shared
+    try:
+        index = get_fingerprint_index()
+        if index is None:
+            return None
+        fp = fingerprint_file(ws.audio, logger)
+        if not fp:
+            return None
+        ws.audio.with_suffix('.fp').write_bytes(fp.tobytes())
+        if not lookup:
+            return None
+        sync_shared(index, logger)
+        match = index.lookup(fp, bv_info.get('duration') or 0, exclude=bv_info['bvid'])
+    except Exception as e:
+        logger.warning(f"{bv_info['bvid']} 的指纹去重失败，按普通流程转录: {e}")
+        return None
+    if match is None:
+        return None
+    from audio_fingerprint import ITEM_SECONDS, load_shared_transcript
+    from transcript_store import Transcript, write_view
+    data = match['transcript']
+    if not data:
+        # 其他机器转录的视频，结果要从队列仓库读取
+        try:
+            data = load_shared_transcript(match['bvid'])
+        except Exception as e:
+            logger.warning(f"读取 {match['bvid']} 的转录结果失败: {e}")
+            data = None
+        if not data:
+            logger.info(f"{bv_info['bvid']} 与其他机器转录的 {match['bvid']} 音频相同，但队列仓库中已经没有它的结果，按普通流程转录")
+            return None
+    transcript = Transcript.loads(data)
+    # 本视频的第 i 个指纹项对应已转录视频的第 i + offset 项，时间轴按偏移平移（片头长度不同的转载）
+    shift_ms = -round(match['offset'] * ITEM_SECONDS * 1000)
+    if shift_ms:
+        transcript = transcript.shifted(shift_ms, int((bv_info.get('duration') or 0) * 1000) or None)
+    for suffix in (ws.srt, ws.txt, ws.text):
+        write_view(suffix, transcript.render(suffix.suffix))
+    ws.audio.with_suffix('.source').write_text('duplicate', encoding='utf-8')
+    metrics = dp_metrics.current()
+    if isinstance(metrics, dp_metrics.TaskMetrics):
+        metrics.set('duplicate_of', match['bvid'])
+    score = f"位错误率 {match['ber']:.3f}" if match['ber'] is not None else f"对齐的检索词 {match['votes']:.0%}"
+    logger.info(f"{bv_info['bvid']} 与已转录的 {match['bvid']} 音频相同（{score}，"
+                f"时间轴平移 {shift_ms / 1000:.1f} 秒），复用转录结果")
+    return match['bvid']
+
+def index_fingerprint(bv_info, ws: JobWorkspace):
+    """把转录完成的视频的指纹和结果加入指纹索引，并发布给其他机器（见 audio_fingerprint.publish_entry）。"""
+    fp_file = ws.audio.with_suffix('.fp')
+    if not fp_file.exists():
+        return
+    import array
+    from audio_fingerprint import get_fingerprint_index, publish_entry
+    from transcript_store import Transcript, read_view
+    index = get_fingerprint_index()
+    if index is None:
+        return
+    try:
+        fp = array.array('I')
+        fp.frombytes(fp_file.read_bytes())
+        views = {p.suffix: read_view(p) for p in (ws.srt, ws.txt, ws.text) if p.exists()}
+        transcript = Transcript.from_views(views, {'bvid': bv_info['bvid']})
+        data = transcript.dumps()
+        index.add(bv_info['bvid'], bv_info.get('duration') or 0, fp, data)
+        publish_entry(bv_info['bvid'], bv_info.get('duration') or 0, fp)
+    except Exception as e:
+        logger.warning(f"{bv_info['bvid']} 的指纹加入索引失败: {e}")
+
+def get_output_name(bv_info):
+    title = bv_info['title']
+    invalid_chars = '<>:"/\\|?*'
+    sanitized_title = title.translate(str.maketrans(invalid_chars, '_' * len(invalid_chars)))[0:50]
+    # 将B站API返回的UTC时间戳转换为东八区（UTC+8）时间
+    dt_utc8 = datetime.fromtimestamp(bv_info['pubdate'], tz=timezone(timedelta(hours=8)))
+    return f"[{dt_utc8.strftime('%Y-%m-%d_%H-%M-%S')}][{bv_info['up_name']}][{sanitized_title}][{bv_info['bvid']}]"
+
+def parse_line(line: str):
+    """解析任务行，返回需要处理的 bv_info，无效或需要跳过的行返回 None。"""
+    try:
+        bv_info = json.loads(line)
+    except json.JSONDecodeError:
+        print("该行不是有效的 JSON 字符串，跳过。")
+        return None
+    print(f'该行是有效的 JSON 字符串。{bv_info.get("bvid")}, {bv_info.get("cid")}')
+    if bv_info.get('status') != 'normal':
+        print(f"状态是{bv_info.get('status')}, 跳过")
+        return None
+    return bv_info
+
+def download_job(bv_info, ws: JobWorkspace, transcriber: str = None) -> bool:
+    """
+    下载阶段：视频有可用的字幕时直接生成结果（见 fetch_subtitle_transcript），否则把音频下载到工作目录，
+    本地音频缓存（见 audio_cache）中有同一音轨的音频时直接使用。启用流式转录时同时完成转录（流式转录依赖 faster-whisper-xxl，CPU 模式下不使用）。
+    音频与已转录的视频重复时直接复用其结果（见 audio_fingerprint）。
+
+    Args:
+        transcriber (str, optional): 转录方式，见 get_transcriber. 默认为 None.
+
+    Returns:
+        bool: 音频或转录结果已就绪返回 True。
+
+    Raises:
+        TaskFailure: 下载失败，kind 是失败类型（见 failure_policy）。
+    """
+    try:
+        if fetch_subtitle_transcript(bv_info, ws):
+            return True
+    except Exception as e:
+        logger.warning(f"获取 {bv_info['bvid']} 的字幕失败，下载音频转录: {e}")
+    # 先按 audio_track 策略选好音轨，重试或重新转录的任务在本地缓存中有同一音轨的音频时直接使用
+    selected = get_audio_track(bv_info)
+    dp_blbl, track = selected
+    if not track:
+        raise no_track_failure(dp_blbl, bv_info)
+    from audio_cache import get_audio_cache
+    audio_cache = get_audio_cache()
+    if audio_cache and audio_cache.fetch(bv_info['bvid'], bv_info['cid'], track['id'], ws.audio):
+        logger.info(f"{bv_info['bvid']} 使用本地缓存的音频（音轨 {track['id']}），跳过下载")
+        dedupe_by_fingerprint(bv_info, ws)
+        return True
+    print(f"开始下载: {bv_info['bvid']}")
+    if get_transcriber(transcriber) != "cpu" and get_stream_segment_seconds() > 0:
+        streamed = stream_transcribe_from_json(bv_info, ws.audio, ws.segments_dir, selected)
     else:
-        # 如果是相对路径，则解析为相对于脚本目录的绝对路径
-        return (SCRIPT_DIR / temp_path).resolve()
+        streamed = False
+        fetch_audio_link_from_json(bv_info, ws.audio, selected)
+    if ws.audio.exists():
+        dp_metrics.incr('bytes_downloaded', ws.audio.stat().st_size)
+    if not ws.audio.exists():
+        if not streamed:
+            raise TaskFailure('network', f"未找到音频文件 '{ws.audio}'")
+        return True
+    # 流式转录已经完成时只保存指纹，转录完成后加入索引
+    dedupe_by_fingerprint(bv_info, ws, lookup=not streamed)
+    return True
 
-def get_output_directory(config):
-    output_path = Path(config.get("output_directory", "output"))
+def transcribe_job(bv_info, ws: JobWorkspace, transcriber: str = None, cpu_conf: dict = None):
+    """
+    转录阶段：调用 faster-whisper-xxl（CPU 模式下用 int8 模型，见 cpu_worker）处理音频（使用字幕或流式转录已完成时跳过），
+    并把结果放进 OUTPUT_DIR。
 
-    if output_path.is_absolute():
-        # 如果是绝对路径，直接使用
-        return output_path
+    Args:
+        transcriber (str, optional): 转录方式，见 get_transcriber. 默认为 None.
+        cpu_conf (dict, optional): CPU 模式的配置. 默认为 cpu_worker.get_cpu_conf().
+    """
+    source_file = ws.audio.with_suffix('.source')
+    if source_file.exists():
+        source = source_file.read_text(encoding='utf-8').strip()
+        print(f"--- 使用已有字幕 ({source}) ---")
+    elif ws.srt.exists():
+        source = 'stream'
+        dp_metrics.incr('audio_seconds', bv_info.get('duration', 0))
+        print("--- 流式转录已完成 ---")
     else:
-        # 如果是相对路径，则解析为相对于脚本目录的绝对路径
-        return (SCRIPT_DIR / output_path).resolve()
-
-TEMP_DIR = get_temp_directory(config)
-if not TEMP_DIR.exists():
-    TEMP_DIR.mkdir(parents=True, exist_ok=True)
-OUTPUT_DIR = get_output_directory(config)
-if not OUTPUT_DIR.exists():
-    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-TEMP_MP3 = TEMP_DIR / "audio.mp3"
-TEMP_SRT = TEMP_MP3.with_suffix(".srt")
-TEMP_TEXT = TEMP_MP3.with_suffix(".text")
-TEMP_TXT = TEMP_MP3.with_suffix(".txt")
-
-def fetch_audio_link_from_json(bv_info):
-    dp_blbl = dp_bilibili(logger=logger)
-    dl_url = dp_blbl.get_audio_download_url(bv_info['bvid'], bv_info['cid'])
-    logger.info(f"视频 {bv_info['title']} 的下载链接: {dl_url}")
-    logger.info(f"正在下载 {dl_url} 到 {TEMP_MP3}")
-    download_file_with_resume(dp_blbl.session, dl_url, TEMP_MP3)
+        source = 'whisper'
+        dp_metrics.incr('audio_seconds', bv_info.get('duration', 0))
+        if get_transcriber(transcriber) == "cpu":
+            from cpu_worker import transcribe_cpu
+            print(f"--- 开始使用 CPU int8 模型转录音频 ---")
+            transcribe_cpu(ws.audio, bv_info.get('duration'), cpu_conf)
+        else:
+            print(f"--- 开始使用 faster-whisper-xxl 转录音频 ---")
+            with dp_metrics.stage('transcribe'):
+                run_transcriber(build_whisper_command(ws.audio))
+        print("--- 音频转录完成 ---")
+    metrics = dp_metrics.current()
+    if isinstance(metrics, dp_metrics.TaskMetrics):
+        metrics.set('transcript_source', source)
+    if source in ('whisper', 'stream'):
+        index_fingerprint(bv_info, ws)
+
+    print(f"--- 开始复制生成的文本文件 ---")
+    with dp_metrics.stage('copy'):
+        ws.promote(get_output_name(bv_info))
+    print(f"已复制生成的文本文件到 {ws.output_dir}")
+
+def report_failure(line: str, kind: str, error: str):
+    """按失败类型把任务放回队列等待重试或移入死信区（见 QueueBackend.fail_task），队列不可用时只记录日志。"""
+    from queue_backend import get_backend
+    try:
+        if get_backend().fail_task(line, kind, error):
+            logger.info(f"任务失败（{kind}），已放回队列等待重试: {error}")
+        else:
+            logger.warning(f"任务失败（{kind}）次数已用完，移入死信区: {error}")
+    except Exception as e:
+        logger.error(f"记录任务失败时出错: {e}")
+
+def set_failure(metrics, kind: str, error: str):
+    metrics.set('status', 'error')
+    metrics.set('failure', kind)
+    metrics.set('error', str(error)[:200])
+
+def process_line(line: str):
+    """
+    在独立的工作目录中处理一个任务行：下载、转录，并把结果原子地放进 OUTPUT_DIR。
+
+    Returns:
+        tuple[str, str]: (状态, 错误信息)。状态是 'ok'、'skipped'（无效或不需要处理的行）或失败类型（见 failure_policy）。
+    """
+    print("-" * 40)
+    print(f"开始处理: {line}")
+    bv_info = parse_line(line)
+    if bv_info is None:
+        return 'skipped', None
+
+    with log_context(task=bv_info['bvid'], bvid=bv_info['bvid']), \
+            dp_metrics.TaskMetrics(bv_info['bvid'], duration=bv_info.get('duration'), pubdate=bv_info.get('pubdate')) as metrics:
+        try:
+            with JobWorkspace(get_jobs_directory(), get_output_directory(), job_id=bv_info['bvid']) as ws:
+                ws.attach_logger(logger)
+                download_job(bv_info, ws)
+                transcribe_job(bv_info, ws)
+                metrics.set('status', 'ok')
+                return 'ok', None
+        except Exception as e:
+            print(f"处理 {line} 时出错: {e}")
+            kind = classify(e)
+            set_failure(metrics, kind, e)
+            return kind, str(e)
+
+def run_next_task(journal: TaskJournal, src_file: Path) -> bool:
+    """
+    从 src_file 导入新任务，领取日志中的下一个任务并处理，结果记录到日志中。
+    失败的任务交给队列按失败类型重试或移入死信区（见 report_failure）。
+
+    Returns:
+        bool: 没有待处理任务时返回 False。
+    """
+    journal.import_file(src_file)
+    claimed = journal.claim()
+    if claimed is None:
+        return False
+    task_id, line = claimed
+    # 处理当前任务的同时提前获取下一个任务的下载链接
+    for next_line in journal.lines('pending')[:1]:
+        next_info = parse_line(next_line)
+        if next_info:
+            prefetch_audio_track(next_info)
+    status, error = process_line(line)
+    if status == 'ok':
+        journal.complete(task_id, 'ok')
+    elif status == 'skipped':
+        journal.fail(task_id, 'skipped')
+    else:
+        report_failure(line, status, error)
+        journal.fail(task_id, status)
+    return True
 
 def process_input():
-    src_file = Path(config.get("bv_list_file", "/content/drive/MyDrive/audio2txt/input.txt"))
-    whisper = '/content/drive/MyDrive/Faster-Whisper-XXL/faster-whisper-xxl'
+    src_file = get_bv_list_file()
 
     # 启动时检查文件是否存在。如果不存在，则创建示例文件并退出。
     if not src_file.exists():
         print(f"错误：未找到输入文件 '{src_file}'。")
         return False
-    
-    while True:
-        # 在每次循环开始时，都重新读取文件以获取最新内容
-        with open(src_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-
-        # 寻找第一个有效行进行处理
-        line_with_newline = None
-        for current_line_obj in lines:
-            if current_line_obj.strip() and not current_line_obj.strip().startswith('#'):
-                line_with_newline = current_line_obj
-                break
-
-        # 如果没有找到有效行，说明所有任务都已处理完毕，退出循环
-        if line_with_newline is None:
-            print('没有找到有效行，所有任务处理完毕，退出。')
-            break
-
-        # 删除已处理的这一行，并保存回文件
-        lines.remove(line_with_newline)
-        with open(src_file, 'w', encoding='utf-8') as f:
-            f.writelines(lines)
-    
-        line = line_with_newline.strip()
-
-        print("-" * 40)
-        print(f"开始处理: {line}")
-        try:
-            print("--- 开始删除音频文件 ---")
-            try:
-                TEMP_MP3.unlink()
-                print(f"已删除音频文件: {TEMP_MP3}")
-            except FileNotFoundError:
-                pass  # 文件不存在，是正常情况
-            except Exception as e:
-                print(f"删除音频文件 {TEMP_MP3} 时出错: {e}")
-            # 步骤 1: 下载音频
-            print(f"开始下载: {line}")
-            max_attempts = 10
-            delay = 5
-            try:
-                bv_info = json.loads(line)
-                print(f'该行是有效的 JSON 字符串。{bv_info.get("bvid")}, {bv_info.get("cid")}')
-                if bv_info['status'] == 'normal':
-                    fetch_audio_link_from_json(bv_info)
-                else:
-                    print(f"状态是{bv_info['status']}, 跳过")
-                    continue
-            except json.JSONDecodeError:
-                print("该行不是有效的 JSON 字符串。")
-                status, audio_link, audio_json = fetch_audio_link_from_line(line, max_attempts, delay)
-                
-            # 步骤 2: 调用 faster-whisper-xxl 处理音频
-            if TEMP_MP3.exists():
-                print("--- 开始删除转换后的文本文件 ---")
-                try:
-                    TEMP_SRT.unlink()
-                    TEMP_TXT.unlink()
-                    TEMP_TEXT.unlink()
-                except FileNotFoundError:
-                    pass  # 文件不存在，是正常情况
-                except Exception as e:
-                    print(f"删除文本文件时出错: {e}")
-                print(f"--- 开始使用 faster-whisper-xxl 转录音频 ---")
-                whisper_command = [
-                    whisper,
-                    TEMP_MP3,
-                    '-m', 'large-v2',
-                    '-l', 'Chinese',
-                    '--vad_method', 'pyannote_v3',
-                    '--ff_vocal_extract', 'mdx_kim2',
-                    '--sentence',
-                    '-v', 'true',
-                    '-o', 'source',
-                    '-f', 'txt', 'srt', 'text'
-                ]
-                subprocess.run(whisper_command, check=True)
-                print("--- 音频转录完成 ---")
-            else:
-                print(f"警告: 未找到音频文件 '{TEMP_MP3}'，跳过转录步骤。")
-                continue
 
-            print(f"--- 开始复制生成的文本文件 ---")
-            title = bv_info['title']
-            invalid_chars = '<>:"/\\|?*'
-            sanitized_title = title.translate(str.maketrans(invalid_chars, '_' * len(invalid_chars)))[0:50]
-            # 将B站API返回的UTC时间戳转换为东八区（UTC+8）时间
-            dt_utc8 = datetime.fromtimestamp(bv_info['pubdate'], tz=timezone(timedelta(hours=8)))
-            fn = f"[{dt_utc8.strftime('%Y-%m-%d_%H-%M-%S')}][{bv_info['up_name']}][{sanitized_title}][{bv_info['bvid']}]"
-            output_srt = OUTPUT_DIR / f"{fn}.srt"
-            output_txt = output_srt.with_suffix('.txt')
-            output_text = output_srt.with_suffix('.text')
-            shutil.copy(TEMP_SRT, output_srt)
-            shutil.copy(TEMP_TXT, output_txt)
-            shutil.copy(TEMP_TEXT, output_text)            
-            print(f"已复制生成的文本文件到 {OUTPUT_DIR}")
-            
-        except Exception as e:
-            print(f"处理 {line} 时出错: {e}")
-        
-        time.sleep(10)
+    cleanup_stale_workspaces(get_jobs_directory())
+    journal = TaskJournal(get_journal_file())
+    # 上次运行时崩溃的进程领取的任务重新放回待处理队列
+    recovered = journal.recover()
+    if recovered:
+        logger.info(f"恢复 {recovered} 个未完成的任务")
+    while run_next_task(journal, src_file):
+        # 两个任务之间的间隔，避免请求过于频繁
+        time.sleep(get_config().get("task_interval", 10))
+    # 如果没有找到有效行，说明所有任务都已处理完毕，退出循环
+    print('没有找到有效行，所有任务处理完毕，退出。')
 
 if __name__ == "__main__":
-    process_input()
\ No newline at end of file
+    get_config()
+    process_input()
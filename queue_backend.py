@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+任务队列后端。
+
+QueueBackend 定义了工作进程使用的操作：领取（claim）、确认（ack）、放回（nack）、延长租约（extend_lease）、
+发布结果（publish_results），以及生产者使用的 add_tasks。在 config.json 中选择后端：
+
+    "queue": {"backend": "git"}                                     默认，队列仓库的 to_stt/from_stt，多台机器共用
+    "queue": {"backend": "sqlite", "sqlite_path": "/path/queue.sqlite3", "lease_seconds": 3600, "claim_candidates": 64}
+                                                                    只用于单台机器，见下文
+
+git 后端每次领取都要提交并推送，多台机器同时领取时推送会被拒绝并重试，吞吐量受限于推送的串行化。
+两种后端都按 task_priority 的优先级选择任务。sqlite 后端在一个事务中原子地领取任务，不需要重试；领取的任务有租约，到期没有确认或延长的任务会被重新领取。
+
+注意：sqlite 后端不解决多台机器（例如多个 Colab 实例）之间的领取冲突，也没有提供共享的存储。数据库使用 WAL 模式，
+必须放在本地磁盘上，不能放在 Google Drive、NFS 等网络或 FUSE 文件系统上，所以只能被一台机器上的进程共用。
+它适合一台多 GPU/多核服务器上的多个工作进程（supervisor、local_runner、cpu_worker）；多台机器组成的集群
+只能使用 git 后端，上面的推送冲突仍然存在（server_out_queue 的候选缓存和推送重试只是降低冲突的代价）。
+
+sqlite 后端领取时不扫描整个队列：入队（以及失败后放回）时按 task_priority 计算不随时间变化的优先级存入 priority 列，
+retry_after 也存成列，领取时用索引取出优先级最高的 claim_candidates 个、满足时长条件的优先级最高的 claim_candidates 个、
+入队最早的 claim_candidates 个（排队老化和防止饿死）和租约过期的任务，只对这些候选按完整的策略打分。
+
+命令行：
+    python queue_backend.py add <tasks.txt>...
+    python queue_backend.py stats
+    python queue_backend.py dead-letters
+    python queue_backend.py export-results <dir>       (sqlite)
+"""
+
+import argparse
+import json
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+LIMIT_TYPES = ("less_than", "better_greater_than")
+# git 后端的心跳：每台机器一个 ref，指向只包含 HEARTBEAT_FILE 的提交
+HEARTBEAT_REF = "refs/fleet"
+HEARTBEAT_FILE = "status.json"
+
+def task_id_of(line: str) -> str:
+    """任务 id 就是任务行中的 bvid。"""
+    return json.loads(line)['bvid']
+
+def bvid_of_output(path: Path):
+    """从结果文件名 [...][BVxxx].srt 中取出 bvid，取不到时返回 None。"""
+    name = Path(path).name
+    end = name.rfind(']')
+    start = name.rfind('[', 0, end)
+    if start < 0 or end < 0:
+        return None
+    bvid = name[start + 1:end]
+    return bvid if bvid.startswith('BV') else None
+
+class QueueBackend:
+    name = ""
+
+    def claim(self, duration_limit=1800, limit_type="less_than"):
+        """
+        领取一个任务。
+
+        Returns:
+            str | None: 任务行（JSON 字符串），没有符合条件的任务时返回 None。
+        """
+        raise NotImplementedError
+
+    def ack(self, task_id: str):
+        """确认任务已完成。"""
+        raise NotImplementedError
+
+    def nack(self, task_id: str, line: str, requeue: bool = True):
+        """放弃任务。requeue 为 True 时放回队列，其他机器可以重新领取。"""
+        raise NotImplementedError
+
+    def nack_lines(self, lines, requeue: bool = True):
+        """放弃多个任务。"""
+        for line in lines:
+            self.nack(task_id_of(line), line, requeue)
+
+    def extend_lease(self, task_id: str, seconds: float = None):
+        """延长任务的租约，长时间运行的任务需要定期调用。"""
+        raise NotImplementedError
+
+    def publish_results(self, files, compress=None):
+        """发布结果文件并确认对应的任务，成功后删除本地文件。"""
+        raise NotImplementedError
+
+    def publish_metrics(self):
+        """发布本机的统计记录（见 dp_metrics），没有共享位置的后端什么也不做。"""
+        pass
+
+    def add_tasks(self, lines) -> int:
+        """添加任务，返回新增的任务数。"""
+        raise NotImplementedError
+
+    def requeue(self, task_id: str, line: str):
+        """用新的任务行（例如带上失败记录和 retry_after）把任务放回队列。"""
+        raise NotImplementedError
+
+    def dead_letter(self, task_id: str, record: dict):
+        """把任务移入死信区，不会再被领取。record 见 failure_policy.dead_letter_record。"""
+        raise NotImplementedError
+
+    def dead_letters(self) -> list:
+        """返回死信区中的记录。"""
+        raise NotImplementedError
+
+    def fail_task(self, line: str, kind: str, error: str) -> bool:
+        """
+        按失败类型（见 failure_policy）处理失败的任务：还可以重试时带着退避时间放回队列，否则移入死信区。
+
+        Args:
+            line (str): 领取到的任务行。
+            kind (str): 失败类型。
+            error (str): 错误信息。
+
+        Returns:
+            bool: 放回队列返回 True，移入死信区返回 False。
+        """
+        import dp_metrics
+        from failure_policy import get_failure_policy, dead_letter_record
+        new_line, retry, delay = get_failure_policy().record(line, kind, error)
+        if retry:
+            self.requeue(task_id_of(line), new_line)
+            dp_metrics.incr('task_retries')
+        else:
+            self.dead_letter(task_id_of(line), dead_letter_record(new_line, kind, error, dp_metrics.get_worker_id()))
+            dp_metrics.incr('dead_letters')
+        return retry
+
+    def publish_heartbeat(self, record: dict):
+        """发布本机的心跳（见 fleet），每台机器只保留最新的一条。"""
+        raise NotImplementedError
+
+    def heartbeats(self) -> list:
+        """返回所有机器最新的心跳。"""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+class GitQueueBackend(QueueBackend):
+    """原来的 git 队列：领取即从 to_stt 删除一行并推送，结果推送到 from_stt。没有租约。"""
+    name = "git"
+
+    def claim(self, duration_limit=1800, limit_type="less_than"):
+        from server_out_queue import claim_task
+        return claim_task(duration_limit, limit_type)
+
+    def ack(self, task_id: str):
+        # 结果推送到 from_stt 就代表完成，不需要额外的操作
+        pass
+
+    def nack(self, task_id: str, line: str, requeue: bool = True):
+        if requeue:
+            from server_out_queue import return_tasks
+            return_tasks([line])
+
+    def nack_lines(self, lines, requeue: bool = True):
+        # 一次提交放回所有任务
+        if requeue and lines:
+            from server_out_queue import return_tasks
+            return_tasks(list(lines))
+
+    def extend_lease(self, task_id: str, seconds: float = None):
+        pass
+
+    def publish_results(self, files, compress=None):
+        from server_in_queue import upload_batch
+        upload_batch(files, compress)
+        return True
+
+    def publish_metrics(self):
+        from server_in_queue import upload_metrics
+        upload_metrics()
+
+    def add_tasks(self, lines) -> int:
+        from server_out_queue import return_tasks
+        now = int(time.time())
+        tasks = []
+        for line in lines:
+            line = line.strip()
+            if line:
+                # 记录入队时间，用于优先级的排队老化（见 task_priority）
+                bv_info = json.loads(line)
+                bv_info.setdefault('queued_at', now)
+                tasks.append(json.dumps(bv_info, ensure_ascii=False))
+        lines = tasks
+        if lines:
+            return_tasks(lines, prefix="tasks")
+        return len(lines)
+
+    def requeue(self, task_id: str, line: str):
+        from server_out_queue import return_tasks
+        return_tasks([line], prefix="retry")
+
+    def dead_letter(self, task_id: str, record: dict):
+        from server_out_queue import dead_letter
+        dead_letter([record])
+
+    def dead_letters(self) -> list:
+        from dp_config import get_queue_directory
+        records = []
+        for f in sorted((get_queue_directory() / "dead_letter").glob("*.jsonl")):
+            with open(f, 'r', encoding='utf-8') as fp:
+                records.extend(json.loads(line) for line in fp if line.strip())
+        return records
+
+    def publish_heartbeat(self, record: dict):
+        # 心跳不进入队列分支的历史，也不经过 repo_lock：每台机器强制推送自己的 refs/fleet/<机器 id>，
+        # 不会和领取、上传争用推送，失败时放弃，下一次心跳再推送
+        from dp_config import get_queue_directory
+        from git_utils import push_ref_file
+        data = json.dumps(record, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        # 机器 id 可能是邮箱或主机名，ref 名中不能有空格等字符
+        name = re.sub(r"[^\w.@-]", "_", record['worker']).strip(".") or "worker"
+        push_ref_file(get_queue_directory(), f"{HEARTBEAT_REF}/{name}", HEARTBEAT_FILE, data,
+                      f"心跳 {record.get('bvid') or '空闲'}")
+
+    def heartbeats(self) -> list:
+        from dp_config import get_queue_directory
+        from git_utils import fetch_ref_files
+        records = []
+        for data in fetch_ref_files(get_queue_directory(), HEARTBEAT_REF, HEARTBEAT_FILE).values():
+            try:
+                records.append(json.loads(data))
+            except json.JSONDecodeError:
+                continue
+        return records
+
+    def stats(self) -> dict:
+        from dp_config import get_queue_directory
+        src_dir = get_queue_directory() / "to_stt"
+        pending = 0
+        for f in src_dir.glob("*"):
+            if f.is_file() and not f.name.startswith('.'):
+                with open(f, 'r', encoding='utf-8') as fp:
+                    pending += sum(1 for line in fp if line.strip())
+        dead = 0
+        for f in (get_queue_directory() / "dead_letter").glob("*.jsonl"):
+            with open(f, 'r', encoding='utf-8') as fp:
+                dead += sum(1 for line in fp if line.strip())
+        return {'pending': pending, 'dead': dead}
+
+class SQLiteQueueBackend(QueueBackend):
+    """单机队列：数据库在本地磁盘上，只供同一台机器的工作进程共用，不能用于多台机器的集群。"""
+    name = "sqlite"
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        id TEXT UNIQUE NOT NULL,
+        line TEXT NOT NULL,
+        duration INTEGER NOT NULL DEFAULT 0,
+        state TEXT NOT NULL DEFAULT 'pending',
+        owner TEXT,
+        lease_until REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created REAL NOT NULL,
+        updated REAL NOT NULL,
+        priority REAL NOT NULL DEFAULT 0,
+        retry_after REAL NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_tasks_state ON tasks(state, duration);
+    CREATE TABLE IF NOT EXISTS results (
+        name TEXT PRIMARY KEY,
+        task_id TEXT,
+        data BLOB NOT NULL,
+        created REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS dead_letters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task_id TEXT NOT NULL,
+        record TEXT NOT NULL,
+        created REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS heartbeats (
+        worker TEXT PRIMARY KEY,
+        record TEXT NOT NULL,
+        updated REAL NOT NULL
+    );
+    """
+
+    # 旧版本创建的数据库没有这些列，打开时补上
+    COLUMNS = {'priority': "REAL NOT NULL DEFAULT 0", 'retry_after': "REAL NOT NULL DEFAULT 0"}
+    INDEXES = """
+    CREATE INDEX IF NOT EXISTS idx_tasks_priority ON tasks(state, priority DESC);
+    CREATE INDEX IF NOT EXISTS idx_tasks_created ON tasks(state, created);
+    CREATE INDEX IF NOT EXISTS idx_tasks_lease ON tasks(state, lease_until);
+    """
+
+    def __init__(self, path: Path, lease_seconds: float = 3600, owner: str = None, candidates: int = 64):
+        """
+        Args:
+            path (Path): 数据库文件路径，本机所有工作进程共用，必须在本地磁盘上。
+            lease_seconds (float, optional): 领取后的租约时长（秒）. 默认为 3600.
+            owner (str, optional): 领取者标识. 默认为 主机名:进程号.
+            candidates (int, optional): 领取时每一类候选最多取出的任务数. 默认为 64.
+        """
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.candidates = candidates
+        self._local = threading.local()
+        self._parsed = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = self._db()
+        db.executescript(self.SCHEMA)
+        existing = {row[1] for row in db.execute("PRAGMA table_info(tasks)")}
+        for column, definition in self.COLUMNS.items():
+            if column not in existing:
+                db.execute(f"ALTER TABLE tasks ADD COLUMN {column} {definition}")
+        db.executescript(self.INDEXES)
+
+    def _db(self):
+        # sqlite 连接不能跨线程使用，每个线程一个连接
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def _transaction(self):
+        db = self._db()
+        # IMMEDIATE 在事务开始时就获取写锁，两个进程不会选中同一个任务
+        db.execute("BEGIN IMMEDIATE")
+        return db
+
+    def claim(self, duration_limit=1800, limit_type="less_than"):
+        if limit_type not in LIMIT_TYPES:
+            raise ValueError(f"未知的 limit_type: {limit_type}")
+        from task_priority import get_policy
+        now = time.time()
+        db = self._transaction()
+        try:
+            rows = self._candidate_rows(db, duration_limit, limit_type, now)
+            selected = get_policy().select([(seq, self._parse(seq, line), created) for seq, line, created in rows],
+                                           duration_limit, limit_type, now)
+            if selected is None:
+                db.execute("COMMIT")
+                return None
+            seq, line, _ = rows[selected[0]]
+            db.execute("UPDATE tasks SET state = 'claimed', owner = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE seq = ?",
+                       (self.owner, now + self.lease_seconds, now, seq))
+            db.execute("COMMIT")
+            return line
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _candidate_rows(self, db, duration_limit, limit_type, now):
+        """用索引取出有限个候选任务，写锁持有期间的开销与队列长度无关。"""
+        pending = "SELECT seq, line, created FROM tasks WHERE state = 'pending' AND retry_after <= ?"
+        expired = "SELECT seq, line, created FROM tasks WHERE state = 'claimed' AND lease_until < ? AND retry_after <= ?"
+        if limit_type == "less_than":
+            cond, cond_params = " AND duration < ?", (duration_limit,)
+        else:
+            cond, cond_params = "", ()
+        # 指定按排序列的索引扫描，否则查询计划会按时长索引取出所有满足时长条件的任务再排序
+        by_priority = pending.replace("FROM tasks", "FROM tasks INDEXED BY idx_tasks_priority")
+        by_created = pending.replace("FROM tasks", "FROM tasks INDEXED BY idx_tasks_created")
+        queries = [
+            (by_priority + cond + " ORDER BY priority DESC LIMIT ?", (now, *cond_params, self.candidates)),
+            (by_created + cond + " ORDER BY created LIMIT ?", (now, *cond_params, self.candidates)),
+            (expired + cond + " ORDER BY lease_until LIMIT ?", (now, now, *cond_params, self.candidates)),
+        ]
+        if limit_type == "better_greater_than":
+            # 优先选长任务，没有时在上面的候选中退而求其次
+            queries.append((by_priority + " AND duration > ? ORDER BY priority DESC LIMIT ?", (now, duration_limit, self.candidates)))
+        rows = {}
+        for sql, params in queries:
+            for seq, line, created in db.execute(sql, params):
+                rows[seq] = (seq, line, created)
+        return list(rows.values())
+
+    @staticmethod
+    def _static_priority(bv_info: dict) -> float:
+        # 入队时的得分（不含排队老化），发布时间的衰减对同一时期入队的任务影响相同，足够用于预选候选
+        from task_priority import get_policy
+        return get_policy().score(bv_info, queued_at=0)
+
+    def _parse(self, seq, line):
+        # 按 seq 缓存解析结果，任务行只在失败重试时改变（见 requeue）
+        cached = self._parsed.get(seq)
+        if cached is None or cached[0] != line:
+            cached = self._parsed[seq] = (line, json.loads(line))
+        return cached[1]
+
+    def _set_state(self, task_id, state, only_owner=False):
+        sql = "UPDATE tasks SET state = ?, owner = NULL, lease_until = NULL, updated = ? WHERE id = ?"
+        params = [state, time.time(), task_id]
+        if only_owner:
+            sql += " AND owner = ?"
+            params.append(self.owner)
+        self._db().execute(sql, params)
+
+    def ack(self, task_id: str):
+        self._set_state(task_id, 'done')
+
+    def nack(self, task_id: str, line: str, requeue: bool = True):
+        self._set_state(task_id, 'pending' if requeue else 'failed', only_owner=True)
+
+    def extend_lease(self, task_id: str, seconds: float = None):
+        seconds = self.lease_seconds if seconds is None else seconds
+        self._db().execute("UPDATE tasks SET lease_until = ?, updated = ? WHERE id = ? AND state = 'claimed' AND owner = ?",
+                           (time.time() + seconds, time.time(), task_id, self.owner))
+
+    def publish_results(self, files, compress=None):
+        files = [Path(f) for f in files if Path(f).exists()]
+        if not files:
+            return True
+        now = time.time()
+        db = self._transaction()
+        try:
+            for f in files:
+                task_id = bvid_of_output(f)
+                db.execute("INSERT OR REPLACE INTO results (name, task_id, data, created) VALUES (?, ?, ?, ?)",
+                           (f.name, task_id, f.read_bytes(), now))
+                if task_id:
+                    db.execute("UPDATE tasks SET state = 'done', owner = NULL, lease_until = NULL, updated = ? WHERE id = ?", (now, task_id))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        for f in files:
+            f.unlink(missing_ok=True)
+        return True
+
+    def add_tasks(self, lines) -> int:
+        now = time.time()
+        added = 0
+        db = self._transaction()
+        try:
+            for line in lines:
+                line = line.strip()
+                if not line:
+                    continue
+                bv_info = json.loads(line)
+                cur = db.execute("INSERT OR IGNORE INTO tasks (id, line, duration, created, updated, priority, retry_after) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (bv_info['bvid'], line, int(bv_info.get('duration', 0)), now, now,
+                                  self._static_priority(bv_info), bv_info.get('retry_after') or 0))
+                added += cur.rowcount
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return added
+
+    def requeue(self, task_id: str, line: str):
+        bv_info = json.loads(line)
+        self._db().execute("UPDATE tasks SET line = ?, state = 'pending', owner = NULL, lease_until = NULL, updated = ?, "
+                           "priority = ?, retry_after = ? WHERE id = ?",
+                           (line, time.time(), self._static_priority(bv_info), bv_info.get('retry_after') or 0, task_id))
+
+    def dead_letter(self, task_id: str, record: dict):
+        now = time.time()
+        db = self._transaction()
+        try:
+            db.execute("UPDATE tasks SET state = 'dead', owner = NULL, lease_until = NULL, updated = ? WHERE id = ?", (now, task_id))
+            db.execute("INSERT INTO dead_letters (task_id, record, created) VALUES (?, ?, ?)",
+                       (task_id, json.dumps(record, ensure_ascii=False), now))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def dead_letters(self) -> list:
+        return [json.loads(record) for record, in self._db().execute("SELECT record FROM dead_letters ORDER BY id")]
+
+    def publish_heartbeat(self, record: dict):
+        self._db().execute("INSERT OR REPLACE INTO heartbeats (worker, record, updated) VALUES (?, ?, ?)",
+                           (record['worker'], json.dumps(record, ensure_ascii=False), time.time()))
+
+    def heartbeats(self) -> list:
+        return [json.loads(record) for record, in self._db().execute("SELECT record FROM heartbeats ORDER BY worker")]
+
+    def export_results(self, dst_dir: Path) -> int:
+        """把数据库中的结果文件写到 dst_dir，返回写出的文件数。"""
+        dst_dir = Path(dst_dir)
+        dst_dir.mkdir(parents=True, exist_ok=True)
+        count = 0
+        for name, data in self._db().execute("SELECT name, data FROM results ORDER BY name"):
+            (dst_dir / name).write_bytes(data)
+            count += 1
+        return count
+
+    def stats(self) -> dict:
+        result = {state: n for state, n in self._db().execute("SELECT state, COUNT(*) FROM tasks GROUP BY state")}
+        result['expired_leases'] = self._db().execute(
+            "SELECT COUNT(*) FROM tasks WHERE state = 'claimed' AND lease_until < ?", (time.time(),)).fetchone()[0]
+        result['results'] = self._db().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return result
+
+_backend = None
+_lock = threading.Lock()
+
+def get_backend() -> QueueBackend:
+    """按 config.json 中的 "queue" 设置创建后端，同一个进程共用一个实例。"""
+    global _backend
+    with _lock:
+        if _backend is None:
+            from dp_config import get_config, resolve_path
+            conf = get_config().get("queue", {})
+            backend = conf.get("backend", "git")
+            if backend == "git":
+                _backend = GitQueueBackend()
+            elif backend == "sqlite":
+                from dp_metrics import get_worker_id
+                # 同一台机器上的所有进程用同一个领取者标识，supervisor 主进程可以为工作进程领取的任务延长租约
+                _backend = SQLiteQueueBackend(resolve_path(conf.get("sqlite_path", "queue.sqlite3")), conf.get("lease_seconds", 3600),
+                                              owner=get_worker_id(), candidates=conf.get("claim_candidates", 64))
+            else:
+                raise ValueError(f"未知的队列后端: {backend}")
+        return _backend
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="任务队列后端工具")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_add = sub.add_parser("add", help="从文件添加任务（每行一个 JSON 任务）")
+    p_add.add_argument("files", type=Path, nargs="+")
+    sub.add_parser("stats", help="队列状态")
+    sub.add_parser("dead-letters", help="列出死信区中的任务和错误信息")
+    p_export = sub.add_parser("export-results", help="导出 sqlite 后端中的结果文件")
+    p_export.add_argument("directory", type=Path)
+    args = parser.parse_args(argv)
+
+    backend = get_backend()
+    if args.cmd == "add":
+        lines = []
+        for f in args.files:
+            lines.extend(f.read_text(encoding='utf-8').splitlines())
+        print(f"添加 {backend.add_tasks(lines)} 个任务到 {backend.name} 队列")
+    elif args.cmd == "stats":
+        print(json.dumps({'backend': backend.name, **backend.stats()}, ensure_ascii=False))
+    elif args.cmd == "dead-letters":
+        for record in backend.dead_letters():
+            print(json.dumps(record, ensure_ascii=False))
+    elif args.cmd == "export-results":
+        if not isinstance(backend, SQLiteQueueBackend):
+            parser.error("只有 sqlite 后端需要导出结果，git 后端的结果在队列仓库的 from_stt 中")
+        print(f"导出 {backend.export_results(args.directory)} 个文件")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
+import os
+import threading
 import time
 from pathlib import Path
 import shutil
 
+import dp_metrics
 from dp_logging import setup_logger
-from git_utils import reset_repo, push_changes, set_logger as git_utils_set_logger
+from dp_config import ID_FILE, get_config, get_queue_directory, get_output_directory, get_temp_directory
+from git_utils import reset_repo, push_changes, repo_lock, set_logger as git_utils_set_logger
 
 logger = setup_logger(Path(__file__).stem)
 git_utils_set_logger(logger)
@@ -15,74 +21,403 @@ def set_logger(logger_instance):
     global logger
     logger = logger_instance
 
-# --- Configuration ---
-# Get the directory where the script is located
-SCRIPT_DIR = Path(__file__).parent.resolve()
-
-# Define directories relative to the script's location
-ID_FILE= SCRIPT_DIR / "id"
-
-def get_config():
-    """Get the queue directory from the config file."""
-    config_file = SCRIPT_DIR / "config.json"
-    if not config_file.exists():
-        logger.error(f"配置文件 {config_file} 不存在。")
-        shutil.copy(SCRIPT_DIR / "config_sample.json", config_file)
-        logger.info(f"已将 config_sample.json 复制到 {config_file}")
-
-    import json
-    with open(config_file, 'r', encoding='utf-8') as f:
-        config = json.load(f)
-
-    return config
-config = get_config()
-
-def get_output_directory(config):
-    output_path = Path(config.get("output_directory", "output"))
-
-    if output_path.is_absolute():
-        # 如果是绝对路径，直接使用
-        return output_path
-    else:
-        # 如果是相对路径，则解析为相对于脚本目录的绝对路径
-        return (SCRIPT_DIR / output_path).resolve()
-OUTPUT_DIR = get_output_directory(config)
-
-def get_queue_directory(config):
-    queue_path = Path(config.get("queue_directory", "queue"))
-
-    if queue_path.is_absolute():
-        # 如果是绝对路径，直接使用
-        return queue_path
-    else:
-        # 如果是相对路径，则解析为相对于脚本目录的绝对路径
-        return (SCRIPT_DIR / queue_path).resolve()
+OUTPUT_SUFFIXES = ('.srt', '.txt', '.text')
 
-def in_queue():
-    queue_dir = get_queue_directory(config)
-    
+def get_upload_config():
+    return get_config().get("upload", {})
+
+def get_commit_id():
+    id = ""
+    if ID_FILE.exists():
+        with ID_FILE.open('r', encoding='utf-8') as f_id:
+            id = f"{f_id.read().strip()}, "
+    return id
+
+def file_digest(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class UploadManifest:
+    """
+    记录已经推送到远程仓库的结果文件：{源文件名: 内容的 sha256}，保存在 TEMP_DIR/upload_manifest.json。
+
+    推送成功后记录，同名同内容的文件再次上传时直接删除，不需要重置仓库和提交。
+    只记录推送成功的文件：暂存到 from_stt 但没有推送的内容会在下次 reset_repo 时被清除，不能当作已上传。
+    """
+    def __init__(self, path: Path, max_entries=100000):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.pushed = {}
+        self._digests = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            try:
+                self.pushed = json.loads(self.path.read_text(encoding='utf-8'))
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"无法读取上传记录 {self.path}，重新开始记录: {e}")
+
+    def digest(self, path: Path) -> str:
+        """文件内容的 sha256，按路径/大小/修改时间缓存，同一个文件只读一次。"""
+        st = path.stat()
+        key = (str(path), st.st_size, st.st_mtime_ns)
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = self._digests[key] = file_digest(path)
+        return digest
+
+    def is_pushed(self, path: Path) -> bool:
+        with self._lock:
+            return self.pushed.get(path.name) == self.digest(path)
+
+    def mark_pushed(self, files):
+        with self._lock:
+            for f in files:
+                self.pushed.pop(f.name, None)
+                self.pushed[f.name] = self.digest(f)
+            # 超过上限时丢弃最早的记录，丢弃的只是优化，不影响正确性
+            while len(self.pushed) > self.max_entries:
+                self.pushed.pop(next(iter(self.pushed)))
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            tmp.write_text(json.dumps(self.pushed, ensure_ascii=False), encoding='utf-8')
+            os.replace(tmp, self.path)
+
+_manifest = None
+
+def get_upload_manifest() -> UploadManifest:
+    global _manifest
+    if _manifest is None:
+        _manifest = UploadManifest(get_temp_directory() / "upload_manifest.json")
+    return _manifest
+
+def promote_file(src: Path, dst: Path, manifest: UploadManifest = None) -> bool:
+    """
+    把 src 放到 dst：内容相同时跳过，否则优先硬链接（同一个文件系统时不复制数据），失败时复制。
+    不用 rename：推送失败后 reset_repo 会清掉 from_stt 中未提交的文件，源文件必须保留到推送成功。
+
+    Returns:
+        bool: dst 有变化返回 True。
+    """
+    if dst.exists() and dst.stat().st_size == src.stat().st_size:
+        src_digest = manifest.digest(src) if manifest else file_digest(src)
+        if file_digest(dst) == src_digest:
+            return False
+    dst.unlink(missing_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+    return True
+
+def group_outputs(files):
+    """按去掉后缀的文件名分组，返回 {base_name: [files]}。"""
+    groups = {}
+    for f in files:
+        base = f.name[:-len(f.suffix)] if f.suffix in OUTPUT_SUFFIXES else f.name
+        groups.setdefault(base, []).append(f)
+    return groups
+
+def pack_group(base_name, files, dst_dir: Path) -> Path:
+    """
+    把同一个视频的 .srt/.txt/.text 打包成 dst_dir / f"{base_name}.tar.xz"。
+
+    归档中的时间戳、属主和顺序都是固定的，同样的内容总是得到同样的字节，重复上传不会产生新的 git 对象。
+    """
+    import io
+    import tarfile
+    dst = dst_dir / f"{base_name}.tar.xz"
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:xz') as tar:
+        for f in sorted(files, key=lambda x: x.name):
+            data = f.read_bytes()
+            info = tarfile.TarInfo(f.name)
+            info.size = len(data)
+            info.mtime = 0
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+    data = buf.getvalue()
+    if not (dst.exists() and dst.read_bytes() == data):
+        dst.write_bytes(data)
+    return dst
+
+def stage_files(files, dst_dir: Path, compress: bool, compact: bool = False, manifest: UploadManifest = None):
+    """
+    把结果文件放到（或打包到）dst_dir。内容和 dst_dir 中已有文件相同的跳过。
+    compact 为 True 时完整的 .srt/.txt/.text 组保存为一个紧凑格式文件（见 transcript_store），优先于 compress。
+
+    Returns:
+        int: 实际写入的文件数。
+    """
+    changed = 0
+    for base, group in group_outputs(files).items():
+        complete = {f.suffix for f in group} == set(OUTPUT_SUFFIXES)
+        if compact and complete:
+            from transcript_store import COMPACT_SUFFIX, pack_files
+            dst = dst_dir / f"{base}{COMPACT_SUFFIX}"
+            before = dst.read_bytes() if dst.exists() else None
+            pack_files(next(f for f in group if f.suffix == '.srt'), dst)
+            if dst.read_bytes() != before:
+                changed += 1
+            continue
+        if compress and complete:
+            dst = dst_dir / f"{base}.tar.xz"
+            before = dst.read_bytes() if dst.exists() else None
+            pack_group(base, group, dst_dir)
+            if dst.read_bytes() != before:
+                changed += 1
+            continue
+        for f in group:
+            if promote_file(f, dst_dir / f.name, manifest):
+                changed += 1
+    return changed
+
+METRICS_PUSHED_FILE = "pushed.json"
+
+def _read_metrics_pushed() -> dict:
+    try:
+        return json.loads((dp_metrics.METRICS_DIR / METRICS_PUSHED_FILE).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+def _write_metrics_pushed(pushed: dict):
+    tmp = dp_metrics.METRICS_DIR / (METRICS_PUSHED_FILE + ".tmp")
+    tmp.write_text(json.dumps(pushed), encoding='utf-8')
+    os.replace(tmp, dp_metrics.METRICS_DIR / METRICS_PUSHED_FILE)
+
+def stage_metrics(dst_dir: Path) -> dict:
+    """
+    把本机统计记录文件中还没推送的完整行追加到 dst_dir 中的同名文件（每台机器每天一个文件）。
+    需要在 repo_lock 中、reset_repo 之后调用，推送成功后把返回值交给 mark_metrics。
+
+    Returns:
+        dict: {文件名: 已暂存到的字节位置}，没有新记录时为空。
+    """
+    if not dp_metrics.METRICS_DIR.exists():
+        return {}
+    pushed = _read_metrics_pushed()
+    known = dict(pushed)
+    staged = {}
+    for f in sorted(dp_metrics.METRICS_DIR.glob("*.jsonl")):
+        dst = dst_dir / f.name
+        done = known.get(f.name)
+        if done is None or f.stat().st_size < done:
+            # 没有推送记录的文件（包括旧版本按会话命名、整个复制过的文件）：仓库中已有的相同前缀已经推送过
+            done = 0
+            if dst.exists():
+                head = dst.read_bytes()
+                with open(f, 'rb') as fh:
+                    if fh.read(len(head)) == head:
+                        done = len(head)
+            known[f.name] = done
+        with open(f, 'rb') as fh:
+            fh.seek(done)
+            data = fh.read()
+        end = data.rfind(b'\n') + 1
+        if not end:
+            continue
+        dst_dir.mkdir(parents=True, exist_ok=True)
+        with open(dst, 'ab') as out:
+            out.write(data[:end])
+        staged[f.name] = done + end
+    if known != pushed:
+        _write_metrics_pushed(known)
+    return staged
+
+def mark_metrics(staged: dict):
+    """
+    推送成功后记录 stage_metrics 暂存到的位置，下次只暂存之后追加的内容。
+    全部推送的前几天的文件（当天的文件还会追加）删除。需要在 repo_lock 中调用。
+    """
+    if not staged:
+        return
+    pushed = {**_read_metrics_pushed(), **staged}
+    today = time.strftime('%Y%m%d')
+    for name, offset in list(pushed.items()):
+        f = dp_metrics.METRICS_DIR / name
+        try:
+            size = f.stat().st_size
+        except FileNotFoundError:
+            del pushed[name]
+            continue
+        # 文件名是 <worker>_<日期>.jsonl，旧版本是 <worker>_<日期>-<时间>-<pid>.jsonl
+        if size == offset and name[:-len(".jsonl")].rsplit('_', 1)[-1][:8] < today:
+            f.unlink()
+            del pushed[name]
+    _write_metrics_pushed(pushed)
+
+def split_batches(files, max_files):
+    """按 group_outputs 分组切分，同一个视频的文件总在同一批中，每批最多约 max_files 个文件。"""
+    batch = []
+    for group in group_outputs(files).values():
+        if batch and len(batch) + len(group) > max_files:
+            yield batch
+            batch = []
+        batch.extend(group)
+    if batch:
+        yield batch
+
+def upload_batch(files, compress=None, compact=None):
+    """
+    上传一批结果文件到队列仓库的 from_stt，推送成功（或内容已经在仓库中）后删除本地文件。
+
+    已经推送过的同名同内容文件（见 UploadManifest）直接删除，不操作仓库。其余文件每 max_files_per_commit 个
+    一次重置、提交和推送，推送失败只重试失败的那一批，重试是幂等的。
+    """
+    upload_config = get_upload_config()
+    if compress is None:
+        compress = upload_config.get("compress", False)
+    if compact is None:
+        compact = upload_config.get("compact", False)
+    manifest = get_upload_manifest()
+    files = [f for f in files if f.exists()]
+    pushed = [f for f in files if manifest.is_pushed(f)]
+    if pushed:
+        logger.info(f"{len(pushed)} 个文件已经推送过，直接删除")
+        for f in pushed:
+            f.unlink(missing_ok=True)
+    pushed = set(pushed)
+    files = [f for f in files if f not in pushed]
+    for batch in split_batches(files, upload_config.get("max_files_per_commit", 500)):
+        _upload_one_batch(batch, compress, compact, manifest)
+
+def _upload_one_batch(files, compress, compact, manifest):
+    queue_dir = get_queue_directory()
     while True:
         try:
-            reset_repo(queue_dir)
-            input_files = sorted([f for f in OUTPUT_DIR.glob("*") if not f.name.startswith(".") and f.is_file()])
-            if input_files:
-                logger.info(f"复制 {len(input_files)} 个已处理的文件到 {queue_dir / 'from_stt'}")
-                for input_file in input_files:
-                    shutil.copy(input_file, queue_dir / "from_stt" / input_file.name)
-                id = ""
-                if ID_FILE.exists():
-                    with ID_FILE.open('r', encoding='utf-8') as f_id:
-                        id = f"{f_id.read().strip()}, "
-                push_changes(queue_dir, f"{id}上传 {len(input_files)} 个已处理的文件")
-                for input_file in input_files:
-                    input_file.unlink()
-            else:
-                logger.info(f"{OUTPUT_DIR} 目录中没有已处理的文件，退出")
-                break
+            files = [f for f in files if f.exists()]
+            if not files:
+                return
+            with repo_lock(queue_dir):
+                reset_repo(queue_dir)
+                with dp_metrics.stage('copy_to_queue'):
+                    changed = stage_files(files, queue_dir / "from_stt", compress, compact, manifest)
+                    metrics = stage_metrics(queue_dir / "metrics")
+                    from audio_fingerprint import stage_shared, mark_shared
+                    shared = stage_shared(queue_dir / "fingerprints")
+                if changed:
+                    logger.info(f"上传 {len(files)} 个已处理的文件到 {queue_dir / 'from_stt'}，其中 {changed} 个有变化")
+                    with dp_metrics.stage('upload'):
+                        pushed = push_changes(queue_dir, f"{get_commit_id()}上传 {len(files)} 个已处理的文件")
+                    if not pushed:
+                        raise RuntimeError("推送失败")
+                    mark_metrics(metrics)
+                    mark_shared(shared)
+                else:
+                    logger.info(f"{len(files)} 个文件已经在仓库中，跳过提交")
+            manifest.mark_pushed(files)
+            for f in files:
+                f.unlink(missing_ok=True)
+            return
         except Exception as e:
             logger.error(f"发生错误: {e}")
             time.sleep(10)
             logger.info("10秒后重试...")
 
+def upload_metrics(attempts: int = 3):
+    """
+    只推送统计记录（见 stage_metrics），用于结果已经上传完、但会话记录刚刚写入的情况。
+    在进程退出前调用，推送失败时最多尝试 attempts 次。
+    """
+    queue_dir = get_queue_directory()
+    for _ in range(attempts):
+        try:
+            with repo_lock(queue_dir):
+                reset_repo(queue_dir)
+                metrics = stage_metrics(queue_dir / "metrics")
+                if not metrics:
+                    return
+                with dp_metrics.stage('upload'):
+                    pushed = push_changes(queue_dir, f"{get_commit_id()}上传统计记录")
+                if pushed:
+                    mark_metrics(metrics)
+                    logger.info("统计记录已上传")
+                    return
+        except Exception as e:
+            logger.error(f"上传统计记录出错: {e}")
+        time.sleep(10)
+    logger.warning(f"上传统计记录失败 {attempts} 次，留在本地，下次上传结果时一起上传")
+
+def list_outputs():
+    return sorted([f for f in get_output_directory().glob("*") if not f.name.startswith(".") and f.is_file()])
+
+def in_queue():
+    from queue_backend import get_backend
+    while True:
+        files = list_outputs()
+        if not files:
+            logger.info(f"{get_output_directory()} 目录中没有已处理的文件，退出")
+            break
+        get_backend().publish_results(files)
+    # 最后一次上传：先写入本进程的会话记录，再推送统计记录
+    dp_metrics.flush_session()
+    get_backend().publish_metrics()
+
+class ResultUploader(threading.Thread):
+    """
+    后台定期上传 OUTPUT_DIR 中的结果。
+
+    完整的 .srt/.txt/.text 组（或等待超过 incomplete_timeout 的不完整组）进入待上传列表，
+    待上传数量达到 batch_size 或最早的文件等待超过 max_age 秒时上传一批。
+    """
+    def __init__(self, batch_size=None, max_age=None, poll_interval=None, incomplete_timeout=None, compress=None):
+        super().__init__(name="result-uploader", daemon=True)
+        upload_config = get_upload_config()
+        self.batch_size = batch_size or upload_config.get("batch_size", 20)
+        self.max_age = max_age or upload_config.get("max_age", 600)
+        self.poll_interval = poll_interval or upload_config.get("poll_interval", 30)
+        self.incomplete_timeout = incomplete_timeout or upload_config.get("incomplete_timeout", 600)
+        self.compress = upload_config.get("compress", False) if compress is None else compress
+        self.first_seen = {}
+        self._stop_event = threading.Event()
+
+    def _ready_files(self, final=False):
+        now = time.time()
+        files = list_outputs()
+        for f in files:
+            self.first_seen.setdefault(f, now)
+        self.first_seen = {f: t for f, t in self.first_seen.items() if f.exists()}
+        ready = []
+        for base, group in group_outputs(files).items():
+            complete = {f.suffix for f in group} == set(OUTPUT_SUFFIXES)
+            waited = now - min(self.first_seen[f] for f in group)
+            if complete or final or waited >= self.incomplete_timeout:
+                ready.extend(group)
+        return ready
+
+    def poll(self, final=False):
+        ready = self._ready_files(final)
+        if not ready:
+            return 0
+        oldest = min(self.first_seen[f] for f in ready)
+        groups = len(group_outputs(ready))
+        if final or groups >= self.batch_size or time.time() - oldest >= self.max_age:
+            logger.info(f"后台上传 {groups} 组结果")
+            from queue_backend import get_backend
+            get_backend().publish_results(ready, self.compress)
+            return groups
+        return 0
+
+    def run(self):
+        while not self._stop_event.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"后台上传出错: {e}")
+
+    def stop(self, flush=True):
+        """停止后台线程，flush 为 True 时把剩余结果全部上传。"""
+        self._stop_event.set()
+        self.join()
+        if flush:
+            self.poll(final=True)
+            # 会话记录在 atexit 时才写入就赶不上最后一次上传了，这里先写入再推送
+            dp_metrics.flush_session()
+            from queue_backend import get_backend
+            get_backend().publish_metrics()
+
 if __name__ == "__main__":
-    in_queue()
\ No newline at end of file
+    get_config()
+    in_queue()
@@ -3,11 +3,13 @@
 
 import time
 from pathlib import Path
-import shutil
 import json
 
+import dp_metrics
 from dp_logging import setup_logger
-from git_utils import reset_repo, push_changes, set_logger as git_utils_set_logger
+from dp_config import ID_FILE, get_config, get_queue_directory, get_bv_list_file
+from task_priority import get_policy
+from git_utils import reset_repo, push_changes, repo_lock, file_added_times, set_logger as git_utils_set_logger
 
 logger = setup_logger(Path(__file__).stem)
 git_utils_set_logger(logger)
@@ -16,154 +18,222 @@ def set_logger(logger_instance):
     global logger
     logger = logger_instance
 
-# --- Configuration ---
-# Get the directory where the script is located
-SCRIPT_DIR = Path(__file__).parent.resolve()
+def get_commit_id():
+    id = ""
+    if ID_FILE.exists():
+        with ID_FILE.open('r', encoding='utf-8') as f_id:
+            id = f"{f_id.read().strip()}, "
+    return id
 
-# Define directories relative to the script's location
-ID_FILE= SCRIPT_DIR / "id"
+_task_file_cache = {}
 
-def get_config():
-    """Get the queue directory from the config file."""
-    config_file = SCRIPT_DIR / "config.json"
-    if not config_file.exists():
-        logger.error(f"配置文件 {config_file} 不存在。")
-        shutil.copy(SCRIPT_DIR / "config_sample.json", config_file)
-        logger.info(f"已将 config_sample.json 复制到 {config_file}")
+def load_task_file(path: Path):
+    """
+    解析任务文件，按文件的 inode/修改时间/大小缓存。reset_repo 只会改写有变化的文件，没变的文件不用重新解析。
 
-    import json
-    with open(config_file, 'r', encoding='utf-8') as f:
-        config = json.load(f)
+    Returns:
+        list[tuple]: (行号, 任务行, 解析后的字典) 列表，跳过空行和无法解析的行。
+    """
+    st = path.stat()
+    key = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _task_file_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+    entries = []
+    with open(path, 'r', encoding='utf-8') as file:
+        for line_index, line in enumerate(file):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append((line_index, line, json.loads(line)))
+            except json.JSONDecodeError:
+                logger.warning(f"{path.name} 第 {line_index + 1} 行无法解析，跳过: {line}")
+    _task_file_cache[path] = (key, entries)
+    return entries
 
-    return config
-config = get_config()
+_queued_at_cache = {}
 
-def get_queue_directory(config):
-    queue_path = Path(config.get("queue_directory", "queue"))
+def file_queued_at(queue_dir: Path, input_files) -> dict:
+    """
+    任务文件的入队时间：文件加入仓库的提交时间，历史中查不到（例如浅克隆）时取文件修改时间。
+    加入时间不会变，按文件名缓存，只为新出现的文件查询 git 历史。
 
-    if queue_path.is_absolute():
-        # 如果是绝对路径，直接使用
-        return queue_path
-    else:
-        # 如果是相对路径，则解析为相对于脚本目录的绝对路径
-        return (SCRIPT_DIR / queue_path).resolve()
+    Returns:
+        dict[str, float]: 文件名 -> 入队时间（Unix 时间戳）。
+    """
+    missing = [f for f in input_files if f.name not in _queued_at_cache]
+    if missing:
+        paths = {f.relative_to(queue_dir).as_posix(): f for f in missing}
+        try:
+            added = file_added_times(queue_dir, list(paths))
+        except Exception as e:
+            logger.warning(f"查询任务文件的加入时间失败，使用文件修改时间: {e}")
+            added = {}
+        for path, f in paths.items():
+            _queued_at_cache[f.name] = added.get(path) or f.stat().st_mtime
+    return {f.name: _queued_at_cache[f.name] for f in input_files}
 
-def out_queue(duration_limit=1800, limit_type="less_than"):
+_task_group_cache = {}
+
+def task_group(input_file: Path, queued_at: float):
+    """
+    把任务文件转换成 task_priority 的一组候选，按文件的 inode/修改时间/大小缓存，键同时用作优先级排序的缓存键。
+
+    Returns:
+        tuple[tuple, list[tuple]]: (键, (order, bv_info, queued_at) 列表)，order 是 (文件名, 行号)。
+    """
+    st = input_file.stat()
+    key = (input_file.name, st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _task_group_cache.get(input_file)
+    if cached and cached[0] == key:
+        return cached
+    candidates = [((input_file.name, line_index), bv_info, queued_at) for line_index, _, bv_info in load_task_file(input_file)]
+    _task_group_cache[input_file] = (key, candidates)
+    return key, candidates
+
+def claim_task(duration_limit=1800, limit_type="less_than"):
+    """
+    从队列中领取一个任务：按优先级（见 task_priority）在 to_stt 中选出一行，删除该行并推送到远程仓库。
+
+    Returns:
+        str | None: 领取到的任务行（JSON 字符串），没有符合条件的任务时返回 None。
+    """
     if limit_type not in ["less_than", "better_greater_than"]:
         logger.error(f"未知的 limit_type: {limit_type}，应为 'less_than' 或 'better_greater_than'")
-        return False
+        return None
     
-    queue_dir = get_queue_directory(config)
-    bv_list_file = Path(config.get("bv_list_file", "/content/drive/MyDrive/audio2txt/input.txt"))
+    queue_dir = get_queue_directory()
     
     src_dir = queue_dir / "to_stt"
     
     while True:
         try:
-            reset_repo(queue_dir)
-            input_files = sorted([f for f in src_dir.glob("*") if not f.name.startswith(".") and f.is_file()])
-            if not input_files:
-                logger.info(f"{src_dir} 目录中没有待处理的文件，退出")
-                break
-            found = False
-            second_found = False
-            if limit_type == "less_than":
-                select_line = ""
-                select_line_index = 0
-                select_file = ""
-                # 逐个检查文件中的每一行，寻找时长小于 duration_limit 的任务
-                for input_file in input_files:
-                    with open(input_file, 'r', encoding='utf-8') as file:
-                        lines = file.readlines()
-                    for line_index, line in enumerate(lines):
-                        line = line.strip()
-                        bv_info = json.loads(line)
-                        if bv_info["duration"] < duration_limit:
-                            select_line = line
-                            select_line_index = line_index
-                            select_file = input_file
-                            found = True
-                            break
-                    if found:
-                        break
-            elif limit_type == "better_greater_than":
-                select_line = ""
-                select_line_index = 0
-                select_file = ""
-                second_select_line = ""
-                second_select_line_index = 0
-                second_select_file = ""
-                # 逐个检查文件中的每一行，寻找时长大于 duration_limit 的任务
-                for input_file in input_files:
-                    with open(input_file, 'r', encoding='utf-8') as file:
-                        lines = file.readlines()
-                    for line_index, line in enumerate(lines):
-                        line = line.strip()
-                        bv_info = json.loads(line)
-                        if bv_info["duration"] > duration_limit:
-                            select_line = line
-                            select_line_index = line_index
-                            select_file = input_file
-                            found = True
-                            break
-                        elif not second_select_line:
-                            second_select_line = line
-                            second_select_line_index = line_index
-                            second_select_file = input_file
-                    if found:
-                        break
-                
-                if not found:
-                    logger.info(f"没有找到时长大于 {duration_limit} 秒的视频, 找其他的视频")
-                    select_line = second_select_line
-                    select_line_index = second_select_line_index
-                    select_file = second_select_file
-                    second_found = True
-                    found = True
-            else:
-                logger.error(f"未知的 limit_type: {limit_type}")
-                break
-                                
-            # 找到了符合条件的行
-            if found:
-                if limit_type == "less_than":
-                    logger.info(f"找到时长小于 {duration_limit} 秒的任务: {select_line}，从 {select_file.name} 中移除该行")
-                elif limit_type == "better_greater_than":
-                    if second_found:
-                        logger.info(f"没有找到时长大于 {duration_limit} 秒的任务, 选择时长小于 {duration_limit} 秒的任务: {select_line}，从 {select_file.name} 中移除该行")
+            with repo_lock(queue_dir):
+                reset_repo(queue_dir)
+                input_files = sorted([f for f in src_dir.glob("*") if not f.name.startswith(".") and f.is_file()])
+                if not input_files:
+                    logger.info(f"{src_dir} 目录中没有待处理的文件，退出")
+                    break
+                queued_at = file_queued_at(queue_dir, input_files)
+                groups = [task_group(input_file, queued_at[input_file.name]) for input_file in input_files]
+                selected = get_policy().select_groups(groups, duration_limit, limit_type)
+                # 找到了符合条件的行
+                if selected is not None:
+                    file_index, index, second_found = selected
+                    select_file = input_files[file_index]
+                    select_line_index, select_line, bv_info = load_task_file(select_file)[index]
+                    if limit_type == "less_than":
+                        logger.info(f"找到时长小于 {duration_limit} 秒的任务: {select_line}，从 {select_file.name} 中移除该行")
+                    elif limit_type == "better_greater_than":
+                        if second_found:
+                            logger.info(f"没有找到时长大于 {duration_limit} 秒的任务, 选择时长小于 {duration_limit} 秒的任务: {select_line}，从 {select_file.name} 中移除该行")
+                        else:
+                            logger.info(f"找到时长大于 {duration_limit} 秒的任务: {select_line}，从 {select_file.name} 中移除该行")
+                    with select_file.open('r', encoding='utf-8') as f:
+                        lines = f.readlines()
+                    remaining_lines = lines[:select_line_index] + lines[select_line_index + 1:]
+                    if not remaining_lines:
+                        logger.info(f"文件 {select_file.name} 是空文件，已删除")
+                        select_file.unlink()
                     else:
-                        logger.info(f"找到时长大于 {duration_limit} 秒的任务: {select_line}，从 {select_file.name} 中移除该行")
-                with select_file.open('r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                remaining_lines = lines[:select_line_index] + lines[select_line_index + 1:]
-                if not remaining_lines:
-                    logger.info(f"文件 {select_file.name} 是空文件，已删除")
-                    select_file.unlink()
+                        with select_file.open('w', encoding='utf-8') as f_in:
+                            f_in.writelines(remaining_lines)
                 else:
-                    with select_file.open('w', encoding='utf-8') as f_in:
-                        f_in.writelines(remaining_lines)
-                with bv_list_file.open('w', encoding='utf-8') as f_dst:
-                    logger.info(f"写入 {select_line} 到 {bv_list_file.name}")
-                    f_dst.write(select_line + "\n")
-                commit_msg = f"处理 {select_file.name} 里的 {select_line}"
-            else:
-                logger.info(f"没有找到时长小于 {duration_limit} 秒的任务，退出")
-                break
+                    logger.info(f"没有找到时长小于 {duration_limit} 秒的任务，退出")
+                    break
             
-            id = ""
-            if ID_FILE.exists():
-                with ID_FILE.open('r', encoding='utf-8') as f_id:
-                    id = f"{f_id.read().strip()}, "
-            commit_msg = f"{id}处理 {select_file.name} 里的 {select_line}"
+                commit_msg = f"{get_commit_id()}处理 {select_file.name} 里的 {select_line}"
             
-            push_changes(queue_dir, commit_msg)
-            return found
+                if push_changes(queue_dir, commit_msg):
+                    if not bv_info.get('queued_at') and queued_at[select_file.name]:
+                        # 把文件的入队时间写进任务行，放回或重试时（写入同一个文件）保留原来的排队老化
+                        select_line = json.dumps({**bv_info, 'queued_at': int(queued_at[select_file.name])}, ensure_ascii=False)
+                    return select_line
+                logger.warning("推送失败，任务可能已被其他机器领取，重新选择...")
+        except Exception as e:
+            logger.error(f"发生错误: {e}")
+            time.sleep(10)
+            logger.info("10秒后重试...")
+    return None
+
+def return_tasks(lines, prefix="returned"):
+    """
+    把任务行追加到 to_stt/<prefix>_<worker>.txt（每台机器每种用途一个文件）并推送，其他机器可以重新领取。
+    推送失败会重置仓库后重试。任务行中的 queued_at 保持不变（见 claim_task），重新入队不会重置排队老化。
+
+    Args:
+        lines (list[str]): 任务行。
+        prefix (str, optional): 文件名的前缀. 默认为 "returned".
+    """
+    queue_dir = get_queue_directory()
+    dst = queue_dir / "to_stt" / f"{prefix}_{dp_metrics.get_worker_id()}.txt"
+    _append_and_push(dst, lines, f"放回 {len(lines)} 个任务到 {dst.name}")
+
+def dead_letter(records):
+    """
+    把重试次数用完的任务（见 failure_policy）连同错误信息追加到队列仓库的 dead_letter/<worker>.jsonl 并推送，
+    不会再被领取。
+
+    Args:
+        records (list[dict]): failure_policy.dead_letter_record 生成的记录。
+    """
+    queue_dir = get_queue_directory()
+    dst = queue_dir / "dead_letter" / f"{dp_metrics.get_worker_id()}.jsonl"
+    lines = [json.dumps(record, ensure_ascii=False) for record in records]
+    _append_and_push(dst, lines, f"{len(lines)} 个任务移入死信区 {dst.name}")
+
+def _append_and_push(dst: Path, lines, message: str):
+    # 推送失败会重置仓库后重新写入，直到成功
+    queue_dir = get_queue_directory()
+    while True:
+        try:
+            with repo_lock(queue_dir):
+                reset_repo(queue_dir)
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                with dst.open('a', encoding='utf-8') as f:
+                    f.writelines(line + "\n" for line in lines)
+                if push_changes(queue_dir, f"{get_commit_id()}{message}"):
+                    logger.info(message)
+                    return
+            logger.warning("推送失败，重试...")
         except Exception as e:
             logger.error(f"发生错误: {e}")
             time.sleep(10)
             logger.info("10秒后重试...")
 
+def route_limits(duration_limit=1800, limit_type="less_than", transcriber=None, cpu_conf=None):
+    """
+    按本机的转录模式调整领取条件：CPU 模式（见 cpu_worker）只领取能在期限内转录完的任务，
+    时长上限按本机记录的实时率计算，每次领取时重新计算。
+
+    Args:
+        transcriber (str, optional): 转录方式，默认取 config.json 中的 "transcriber"（见 process_input.get_transcriber）.
+        cpu_conf (dict, optional): CPU 模式的配置. 默认为 cpu_worker.get_cpu_conf().
+
+    Returns:
+        tuple[int, str]: (duration_limit, limit_type)。
+    """
+    if (transcriber or get_config().get("transcriber")) != "cpu":
+        return duration_limit, limit_type
+    from cpu_worker import max_task_duration
+    return min(duration_limit, max_task_duration(cpu_conf)), "less_than"
+
+def out_queue(duration_limit=1800, limit_type="less_than"):
+    from queue_backend import get_backend
+    bv_list_file = get_bv_list_file()
+    duration_limit, limit_type = route_limits(duration_limit, limit_type)
+    with dp_metrics.stage('claim'):
+        select_line = get_backend().claim(duration_limit, limit_type)
+    if not select_line:
+        return False
+    with bv_list_file.open('w', encoding='utf-8') as f_dst:
+        logger.info(f"写入 {select_line} 到 {bv_list_file.name}")
+        f_dst.write(select_line + "\n")
+    return True
+
 if __name__ == "__main__":
+    get_config()
     if out_queue():
         exit(0)
     else:
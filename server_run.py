@@ -1,14 +1,22 @@
 from pathlib import Path
 
 from dp_logging import setup_logger
+from dp_config import get_config
 from server_out_queue import out_queue, set_logger as server_out_queue_set_logger
-from server_in_queue import in_queue
+from server_in_queue import in_queue, ResultUploader
 from process_input import process_input
+from fleet import start_heartbeat
 
 logger = setup_logger(Path(__file__).stem)
 server_out_queue_set_logger(logger)
 
 def main():
+    # 配置只在这里读取一次，三个阶段共用
+    get_config()
+    # 处理期间在后台分批上传结果，避免进程中途退出时丢失全部结果
+    uploader = ResultUploader()
+    uploader.start()
+    heartbeat = start_heartbeat(logger)
     count = 0
     while True:
         any_input_file = out_queue()
@@ -21,7 +29,10 @@ def main():
         if count >= 3:
             logger.info("已处理3轮，退出.")
             break
+    uploader.stop(flush=False)
     in_queue()
+    if heartbeat:
+        heartbeat.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
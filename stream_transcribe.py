@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+边下载边转录。
+
+下载线程把音频写入磁盘的同时，把数据通过管道送给 ffmpeg，ffmpeg 按固定时长切成 16kHz 单声道的 wav 分段。
+每个分段完成后立刻交给 faster-whisper-xxl 转录，最后把各分段的 .srt/.txt/.text 按时间偏移合并。
+这样第一个分段的转录在下载完成之前就已经开始。
+
+下载失败时，已经写入磁盘的部分文件保持原样，下一次可以用 download_file_with_resume 断点续传
+（续传走非流式路径）。
+"""
+
+import csv
+import re
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+import dp_metrics
+
+# StreamingTranscriber.run 的结果
+STREAMED = "streamed"        # 下载完成，所有分段都已转录并合并
+DOWNLOADED = "downloaded"    # 下载完成，但分段或转录没有完成（例如 ffmpeg 失败），需要按普通流程转录整个文件
+INCOMPLETE = "incomplete"    # 下载没有完成（或没有开始），audio_path 是可续传的部分文件
+
+SRT_TIME_RE = re.compile(r"(\d{2}):(\d{2}):(\d{2}),(\d{3})")
+TEXT_TIME_RE = re.compile(r"(?:(\d+):)?(\d{1,2}):(\d{2})\.(\d{3})")
+
+def _format_srt_time(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    h, ms = divmod(ms, 3600_000)
+    m, ms = divmod(ms, 60_000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+def _format_text_time(seconds: float, with_hours: bool) -> str:
+    ms = int(round(seconds * 1000))
+    h, ms = divmod(ms, 3600_000)
+    m, ms = divmod(ms, 60_000)
+    s, ms = divmod(ms, 1000)
+    if with_hours or h:
+        return f"{h:02d}:{m:02d}:{s:02d}.{ms:03d}"
+    return f"{m:02d}:{s:02d}.{ms:03d}"
+
+def shift_srt(content: str, offset: float, start_index: int):
+    """把一个分段的 srt 内容整体平移 offset 秒，并从 start_index 开始重新编号。返回 (新内容, 下一个编号)。"""
+    blocks = [b for b in re.split(r"\r?\n\r?\n", content.strip()) if b.strip()]
+    out = []
+    index = start_index
+    for block in blocks:
+        lines = block.splitlines()
+        if len(lines) >= 2 and lines[0].strip().isdigit():
+            lines = lines[1:]
+        def repl(m):
+            t = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + int(m.group(3)) + int(m.group(4)) / 1000
+            return _format_srt_time(t + offset)
+        lines[0] = SRT_TIME_RE.sub(repl, lines[0])
+        out.append("\n".join([str(index)] + lines))
+        index += 1
+    return "".join(b + "\n\n" for b in out), index
+
+def shift_text(content: str, offset: float) -> str:
+    """把 .text 文件中行首 [mm:ss.mmm --> mm:ss.mmm] 形式的时间戳平移 offset 秒。"""
+    def repl(m):
+        h = int(m.group(1)) if m.group(1) else 0
+        t = h * 3600 + int(m.group(2)) * 60 + int(m.group(3)) + int(m.group(4)) / 1000
+        return _format_text_time(t + offset, m.group(1) is not None)
+    out = []
+    for line in content.splitlines(keepends=True):
+        if line.startswith("["):
+            end = line.find("]")
+            if end > 0:
+                line = TEXT_TIME_RE.sub(repl, line[:end + 1]) + line[end + 1:]
+        out.append(line)
+    return "".join(out)
+
+class StreamingTranscriber:
+    def __init__(self, build_whisper_command, work_dir: Path, segment_seconds: int = 600, logger=None, ffmpeg="ffmpeg",
+                 run_command=None):
+        """
+        Args:
+            build_whisper_command (callable): build_whisper_command(audio_path) 返回转录单个文件的命令列表，
+                输出文件需要写在音频文件旁边（-o source）。
+            work_dir (Path): 存放分段文件的目录，每次 run 之前会被清空。
+            segment_seconds (int, optional): 每个分段的时长（秒）. 默认为 600.
+            logger (logging.Logger, optional): 日志记录器.
+            ffmpeg (str, optional): ffmpeg 可执行文件. 默认为 "ffmpeg".
+            run_command (callable, optional): run_command(command) 运行转录命令，失败时抛出异常.
+                默认为 subprocess.run(command, check=True).
+        """
+        self.build_whisper_command = build_whisper_command
+        self.work_dir = Path(work_dir)
+        self.segment_seconds = segment_seconds
+        self.logger = logger
+        self.ffmpeg = ffmpeg
+        self.run_command = run_command or (lambda command: subprocess.run(command, check=True))
+
+    def _log(self, level, msg):
+        if self.logger:
+            getattr(self.logger, level)(msg)
+        else:
+            print(msg)
+
+    def _start_ffmpeg(self, segment_list: Path):
+        command = [
+            self.ffmpeg, '-hide_banner', '-loglevel', 'error',
+            '-i', 'pipe:0',
+            '-vn', '-ac', '1', '-ar', '16000',
+            '-f', 'segment',
+            '-segment_time', str(self.segment_seconds),
+            '-reset_timestamps', '1',
+            '-segment_list', str(segment_list),
+            '-segment_list_type', 'csv',
+            str(self.work_dir / 'seg_%04d.wav'),
+        ]
+        return subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def _read_segment_list(self, segment_list: Path):
+        # csv 每行: 文件名,开始时间,结束时间；ffmpeg 只有在分段写完后才追加该行
+        if not segment_list.exists():
+            return []
+        with segment_list.open('r', encoding='utf-8', newline='') as f:
+            return [(row[0], float(row[1]), float(row[2])) for row in csv.reader(f) if len(row) >= 3]
+
+    def run(self, session, url, audio_path: Path) -> str:
+        """
+        下载 url 到 audio_path，并同时转录，结果写到 audio_path 旁边的 .srt/.txt/.text。
+
+        Returns:
+            str: STREAMED：下载和所有分段转录都成功。
+                DOWNLOADED：下载完成，但 ffmpeg 分段失败或没有生成分段，audio_path 是完整的文件，不需要续传。
+                INCOMPLETE：下载失败，audio_path 保留为可续传的部分文件，剩下的分段不再转录；
+                找不到 ffmpeg 时不下载，也返回 INCOMPLETE，由调用方按普通流程下载和转录。
+        """
+        from dp_bilibili_api import download_file_with_resume
+        if shutil.which(self.ffmpeg) is None:
+            self._log('warning', f"找不到 {self.ffmpeg}，不能流式转录")
+            return INCOMPLETE
+        if self.work_dir.exists():
+            shutil.rmtree(self.work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        segment_list = self.work_dir / 'segments.csv'
+
+        ffmpeg_proc = self._start_ffmpeg(segment_list)
+        download_result = {}
+
+        def feed(chunk):
+            ffmpeg_proc.stdin.write(chunk)
+            dp_metrics.progress()
+
+        def download():
+            try:
+                download_result['ok'] = download_file_with_resume(session, url, audio_path, chunk_callback=feed)
+            finally:
+                try:
+                    ffmpeg_proc.stdin.close()
+                except OSError:
+                    pass
+
+        downloader = threading.Thread(target=download, name="stream-download", daemon=True)
+        downloader.start()
+
+        def download_failed():
+            return not downloader.is_alive() and not download_result.get('ok')
+
+        done = []
+        try:
+            while not download_failed():
+                segments = self._read_segment_list(segment_list)
+                pending = segments[len(done):]
+                for name, start, end in pending:
+                    # 下载失败后整个任务要按普通流程重新转录，剩下的分段不用再转录
+                    if download_failed():
+                        break
+                    seg_path = self.work_dir / name
+                    self._log('info', f"流式转录分段 {name} ({start:.1f}s - {end:.1f}s)")
+                    self.run_command(self.build_whisper_command(seg_path))
+                    done.append((seg_path, start))
+                if not pending:
+                    if ffmpeg_proc.poll() is not None and not downloader.is_alive():
+                        # ffmpeg 退出后分段列表已完整，再读一次确认没有遗漏
+                        if len(self._read_segment_list(segment_list)) == len(done):
+                            break
+                    else:
+                        time.sleep(1)
+        except Exception:
+            ffmpeg_proc.kill()
+            raise
+        finally:
+            downloader.join()
+            ffmpeg_proc.wait()
+
+        if not download_result.get('ok'):
+            self._log('error', f"下载失败，保留部分文件 {audio_path} 以便续传")
+            return INCOMPLETE
+        if ffmpeg_proc.returncode != 0:
+            self._log('error', f"ffmpeg 分段失败，返回码 {ffmpeg_proc.returncode}")
+            return DOWNLOADED
+        if not done:
+            self._log('error', "没有生成任何音频分段")
+            return DOWNLOADED
+
+        self._merge(done, audio_path)
+        return STREAMED
+
+    def _merge(self, done, audio_path: Path):
+        srt_parts, txt_parts, text_parts = [], [], []
+        index = 1
+        for seg_path, offset in done:
+            seg_srt = seg_path.with_suffix('.srt')
+            seg_txt = seg_path.with_suffix('.txt')
+            seg_text = seg_path.with_suffix('.text')
+            if seg_srt.exists():
+                part, index = shift_srt(seg_srt.read_text(encoding='utf-8'), offset, index)
+                srt_parts.append(part)
+            if seg_txt.exists():
+                part = seg_txt.read_text(encoding='utf-8')
+                if part and not part.endswith('\n'):
+                    part += '\n'
+                txt_parts.append(part)
+            if seg_text.exists():
+                text_parts.append(shift_text(seg_text.read_text(encoding='utf-8'), offset))
+        audio_path.with_suffix('.srt').write_text("".join(srt_parts), encoding='utf-8')
+        audio_path.with_suffix('.txt').write_text("".join(txt_parts), encoding='utf-8')
+        audio_path.with_suffix('.text').write_text("".join(text_parts), encoding='utf-8')
+        self._log('info', f"已合并 {len(done)} 个分段的转录结果")
@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本机多进程流水线：领取任务 -> 下载 -> 转录，各阶段的工作进程之间用本地队列连接。
+
+- 每个阶段的进程数可配置（config.json 中的 "supervisor" 或命令行参数）。
+- 工作进程崩溃或心跳超时会被重启（连同它启动的转录程序），正在处理的任务按失败类型（见 failure_policy）放回队列或移入死信区。
+  心跳来自工作循环和进度回调，工作卡住时心跳也会停止。
+- 收到 SIGTERM/SIGINT（例如 Colab 被抢占）后停止领取和下载新任务，等待已下载的任务转录完成，
+  超时后把没有完成的任务放回任务队列（放回失败时写回 bv_list_file），最后上传剩余结果。
+- 队列后端有租约时（sqlite），每次输出状态时为本机持有的任务延长租约。
+- 下载或转录失败的任务按失败类型（见 failure_policy）带着退避时间放回队列，重试次数用完时移入死信区。
+- 运行期间由 ResultUploader 在后台分批上传结果。
+- 定期输出各队列长度和各阶段的吞吐量，并在后台发布本机的心跳（见 fleet）。
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from pathlib import Path
+
+from dp_logging import setup_logger
+
+logger = setup_logger(Path(__file__).stem)
+
+HEARTBEAT_INTERVAL = 10
+
+class _Beat:
+    """工作进程的心跳：由工作循环和进度回调（见 dp_metrics.set_progress_hook）触发，工作卡住时心跳也会停止。"""
+
+    def __init__(self, name, status_q):
+        self.name = name
+        self.status_q = status_q
+        self.last = 0.0
+
+    def __call__(self):
+        now = time.monotonic()
+        if now - self.last >= HEARTBEAT_INTERVAL:
+            self.last = now
+            self.status_q.put(('heartbeat', self.name, None))
+
+def _stage_worker(stage, name, in_q, out_q, status_q, stop, options):
+    # 工作进程自成一个进程组：终端的 Ctrl+C 只发给 supervisor，由它统一协调退出；
+    # supervisor 强制结束工作进程时结束整个进程组，转录程序等子进程不会残留。
+    # 信号处理恢复默认，不把 supervisor 的处理函数或 SIG_IGN 传给子进程
+    os.setpgrp()
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    import dp_metrics
+    beat = _Beat(name, status_q)
+    dp_metrics.set_progress_hook(beat)
+    try:
+        if stage == 'fetch':
+            _fetch_loop(name, out_q, status_q, stop, options, beat)
+        elif stage == 'download':
+            _download_loop(name, in_q, out_q, status_q, stop, beat, options)
+        elif stage == 'transcribe':
+            _transcribe_loop(name, in_q, status_q, stop, beat, options)
+    finally:
+        # 子进程通过 os._exit 退出，不会执行 atexit，这里手动写入会话统计
+        dp_metrics.flush_session()
+
+def _fetch_loop(name, out_q, status_q, stop, options, beat):
+    import dp_metrics
+    from queue_backend import get_backend
+    from process_input import prefetch_audio_track
+    from server_out_queue import route_limits
+    backend = get_backend()
+    while not stop.is_set():
+        beat()
+        if out_q.qsize() >= options['prefetch']:
+            time.sleep(1)
+            continue
+        duration_limit, limit_type = route_limits(options['duration_limit'], options['limit_type'],
+                                                  options.get('transcriber'), options.get('cpu_conf'))
+        with dp_metrics.stage('claim'):
+            line = backend.claim(duration_limit, limit_type)
+        if not line:
+            status_q.put(('exhausted', name, None))
+            return
+        out_q.put(line)
+        # 任务在队列中等待下载时，后台提前获取下载链接
+        bv_info = json.loads(line)
+        if bv_info.get('status') == 'normal':
+            prefetch_audio_track(bv_info)
+        status_q.put(('done', name, None))
+
+def _download_loop(name, in_q, out_q, status_q, stop, beat, options):
+    import dp_metrics
+    from dp_config import get_output_directory
+    from process_input import get_jobs_directory, parse_line, download_job, report_failure, set_failure
+    from failure_policy import classify
+    from job_workspace import JobWorkspace
+    while not stop.is_set():
+        beat()
+        try:
+            line = in_q.get(timeout=1)
+        except queue.Empty:
+            continue
+        status_q.put(('start', name, line))
+        bv_info = parse_line(line)
+        ws_dir = None
+        if bv_info:
+            ws = JobWorkspace(get_jobs_directory(), get_output_directory(), job_id=bv_info['bvid'])
+            ws.open()
+            with dp_metrics.TaskMetrics(bv_info['bvid'], part='download', duration=bv_info.get('duration')) as metrics:
+                try:
+                    download_job(bv_info, ws, options.get('transcriber'))
+                    ws_dir = str(ws.dir)
+                    out_q.put((line, ws_dir))
+                    metrics.set('status', 'ok')
+                except Exception as e:
+                    logger.error(f"{name} 下载 {bv_info['bvid']} 失败: {e}")
+                    set_failure(metrics, classify(e), e)
+                    report_failure(line, classify(e), str(e))
+            if ws_dir is None:
+                ws.cleanup(failed=True)
+        status_q.put(('done', name, None))
+
+def _transcribe_loop(name, in_q, status_q, stop, beat, options):
+    import dp_metrics
+    from dp_config import get_output_directory
+    from process_input import get_jobs_directory, parse_line, transcribe_job, report_failure, set_failure
+    from failure_policy import classify
+    from job_workspace import JobWorkspace
+    while not stop.is_set():
+        beat()
+        try:
+            line, ws_dir = in_q.get(timeout=1)
+        except queue.Empty:
+            continue
+        status_q.put(('start', name, (line, ws_dir)))
+        bv_info = parse_line(line)
+        ws = JobWorkspace.from_dir(Path(ws_dir), get_jobs_directory(), get_output_directory())
+        failed = False
+        with dp_metrics.TaskMetrics(bv_info['bvid'], part='transcribe', duration=bv_info.get('duration'),
+                                    pubdate=bv_info.get('pubdate')) as metrics:
+            try:
+                transcribe_job(bv_info, ws, options.get('transcriber'), options.get('cpu_conf'))
+                metrics.set('status', 'ok')
+            except Exception as e:
+                failed = True
+                logger.error(f"{name} 转录 {bv_info['bvid']} 失败: {e}")
+                set_failure(metrics, classify(e), e)
+                report_failure(line, classify(e), str(e))
+            finally:
+                ws.cleanup(failed=failed)
+        status_q.put(('done', name, None))
+
+class Worker:
+    def __init__(self, stage, index):
+        self.stage = stage
+        self.name = f"{stage}-{index}"
+        self.process = None
+        self.last_heartbeat = 0.0
+        self.in_flight = None
+        self.finished = False
+        self.restarts = 0
+
+class Supervisor:
+    STAGES = ('fetch', 'download', 'transcribe')
+
+    def __init__(self, counts: dict, options: dict, heartbeat_timeout=300, drain_timeout=600, status_interval=30):
+        """
+        Args:
+            counts (dict): 各阶段的进程数，例如 {'fetch': 1, 'download': 2, 'transcribe': 1}。
+            options (dict): 传给工作进程的参数：prefetch, duration_limit, limit_type，
+                以及可选的 transcriber 和 cpu_conf（CPU 模式，见 cpu_worker）。
+            heartbeat_timeout (int, optional): 超过该秒数没有心跳的进程会被重启. 默认为 300.
+            drain_timeout (int, optional): 收到退出信号后等待在途任务完成的最长秒数. 默认为 600.
+            status_interval (int, optional): 输出状态的间隔秒数. 默认为 30.
+        """
+        self.counts = counts
+        self.options = options
+        self.heartbeat_timeout = heartbeat_timeout
+        self.drain_timeout = drain_timeout
+        self.status_interval = status_interval
+        self.task_q = multiprocessing.Queue()
+        self.transcribe_q = multiprocessing.Queue()
+        self.status_q = multiprocessing.Queue()
+        self.stops = {stage: multiprocessing.Event() for stage in self.STAGES}
+        self.workers = [Worker(stage, i) for stage in self.STAGES for i in range(counts.get(stage, 0))]
+        self.completed = {stage: 0 for stage in self.STAGES}
+        self.started_at = time.time()
+        self.draining = False
+        self.drain_started = 0.0
+
+    def _queues(self, stage):
+        if stage == 'fetch':
+            return None, self.task_q
+        if stage == 'download':
+            return self.task_q, self.transcribe_q
+        return self.transcribe_q, None
+
+    def _spawn(self, w: Worker):
+        in_q, out_q = self._queues(w.stage)
+        w.process = multiprocessing.Process(
+            target=_stage_worker,
+            args=(w.stage, w.name, in_q, out_q, self.status_q, self.stops[w.stage], self.options),
+            name=w.name,
+        )
+        w.process.start()
+        w.last_heartbeat = time.time()
+        w.in_flight = None
+
+    def _handle_signal(self, signum, frame):
+        if not self.draining:
+            logger.warning(f"收到信号 {signum}，停止领取和下载新任务，等待在途任务完成...")
+            self.draining = True
+            self.drain_started = time.time()
+            self.stops['fetch'].set()
+            self.stops['download'].set()
+
+    def _drain_status(self):
+        by_name = {w.name: w for w in self.workers}
+        while True:
+            try:
+                kind, name, payload = self.status_q.get_nowait()
+            except queue.Empty:
+                return
+            w = by_name.get(name)
+            if w is None:
+                continue
+            w.last_heartbeat = time.time()
+            if kind == 'start':
+                w.in_flight = payload
+            elif kind == 'done':
+                w.in_flight = None
+                self.completed[w.stage] += 1
+            elif kind == 'exhausted':
+                w.finished = True
+
+    def _fail_in_flight(self, w: Worker, kind: str, error: str):
+        # 按失败类型（见 failure_policy）放回任务队列或移入死信区，反复让工作进程崩溃的任务不会无限重试
+        if w.in_flight is None:
+            return
+        from dp_config import get_output_directory
+        from job_workspace import JobWorkspace
+        from process_input import get_jobs_directory, report_failure
+        line, ws_dir = (w.in_flight, None) if isinstance(w.in_flight, str) else w.in_flight
+        logger.warning(f"{w.name} 的在途任务失败（{kind}）: {error}")
+        report_failure(line, kind, error)
+        if ws_dir:
+            JobWorkspace.from_dir(Path(ws_dir), get_jobs_directory(), get_output_directory()).cleanup(failed=True)
+        w.in_flight = None
+
+    @staticmethod
+    def _kill(w: Worker):
+        """强制结束工作进程和它的进程组（转录程序等子进程）。"""
+        try:
+            os.killpg(w.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        if w.process.is_alive():
+            # 还没来得及建立自己的进程组
+            w.process.kill()
+        w.process.join()
+
+    def _check_health(self):
+        now = time.time()
+        for w in self.workers:
+            if w.finished or self.stops[w.stage].is_set():
+                continue
+            alive = w.process.is_alive()
+            if alive and now - w.last_heartbeat < self.heartbeat_timeout:
+                continue
+            if alive:
+                logger.error(f"{w.name} 超过 {self.heartbeat_timeout} 秒没有心跳，强制重启")
+                self._kill(w)
+                kind = 'network' if w.stage == 'download' else 'transcriber_crash'
+                error = f"{w.name} 超过 {self.heartbeat_timeout} 秒没有进展"
+            elif w.process.exitcode == 0:
+                w.finished = True
+                continue
+            else:
+                logger.error(f"{w.name} 异常退出，返回码 {w.process.exitcode}，重启")
+                # 退出的工作进程留下的子进程也要结束
+                self._kill(w)
+                if w.process.exitcode == -signal.SIGKILL:
+                    kind = 'oom'
+                else:
+                    kind = 'transcriber_crash' if w.stage == 'transcribe' else 'unknown'
+                error = f"{w.name} 异常退出，返回码 {w.process.exitcode}"
+            self._fail_in_flight(w, kind, error)
+            w.restarts += 1
+            self._spawn(w)
+
+    def _idle(self):
+        fetch_done = all(w.finished or self.draining for w in self.workers if w.stage == 'fetch')
+        busy = any(w.in_flight is not None for w in self.workers if w.stage != 'fetch')
+        downloads_pending = self.task_q.qsize() > 0 and not self.draining
+        return fetch_done and not busy and not downloads_pending and self.transcribe_q.qsize() == 0
+
+    def print_status(self):
+        elapsed = max(time.time() - self.started_at, 1)
+        lines = [f"--- 运行 {elapsed / 60:.1f} 分钟{'（正在退出）' if self.draining else ''} ---",
+                 f"队列: 待下载 {self.task_q.qsize()}, 待转录 {self.transcribe_q.qsize()}"]
+        for stage in self.STAGES:
+            ws = [w for w in self.workers if w.stage == stage]
+            busy = sum(1 for w in ws if w.in_flight is not None)
+            restarts = sum(w.restarts for w in ws)
+            lines.append(f"{stage}: 完成 {self.completed[stage]}, 吞吐 {self.completed[stage] * 3600 / elapsed:.1f}/小时, "
+                         f"忙碌 {busy}/{len(ws)}, 重启 {restarts}")
+        logger.info("\n".join(lines))
+
+    def _held_lines(self, take=False):
+        """本机持有的任务行：两个队列中的和正在处理的。take 为 True 时同时清空队列。"""
+        lines = []
+        if take:
+            for q in (self.task_q, self.transcribe_q):
+                while True:
+                    try:
+                        item = q.get_nowait()
+                    except queue.Empty:
+                        break
+                    lines.append(item if isinstance(item, str) else item[0])
+        for w in self.workers:
+            if w.in_flight is not None:
+                lines.append(w.in_flight if isinstance(w.in_flight, str) else w.in_flight[0])
+        return lines
+
+    def _extend_leases(self):
+        # 队列里的任务无法不取出就查看，这里只为正在处理的任务延长租约；
+        # 在队列中等待的任务数受 prefetch 限制，等待时间远小于租约
+        from queue_backend import get_backend, task_id_of
+        backend = get_backend()
+        for line in self._held_lines():
+            try:
+                backend.extend_lease(task_id_of(line))
+            except Exception as e:
+                logger.warning(f"延长租约失败: {e}")
+
+    def _return_unfinished(self, bv_list_file: Path):
+        from queue_backend import get_backend
+        lines = self._held_lines(take=True)
+        if lines:
+            backend = get_backend()
+            try:
+                backend.nack_lines(lines)
+                logger.warning(f"{len(lines)} 个未完成的任务已放回 {backend.name} 队列")
+                return
+            except Exception as e:
+                logger.error(f"放回任务失败: {e}")
+            with bv_list_file.open('a', encoding='utf-8') as f:
+                f.writelines(line + "\n" for line in lines)
+            logger.warning(f"{len(lines)} 个未完成的任务已写回 {bv_list_file}")
+
+    def run(self, bv_list_file: Path):
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        for w in self.workers:
+            self._spawn(w)
+        last_status = time.time()
+        idle_ticks = 0
+        while True:
+            time.sleep(1)
+            self._drain_status()
+            self._check_health()
+            if time.time() - last_status >= self.status_interval:
+                self.print_status()
+                self._extend_leases()
+                last_status = time.time()
+            # 任务在队列和工作进程之间交接时状态消息有延迟，连续几次空闲才认为处理完毕
+            idle_ticks = idle_ticks + 1 if self._idle() else 0
+            if idle_ticks >= 3:
+                logger.info("所有任务处理完毕")
+                break
+            if self.draining and time.time() - self.drain_started > self.drain_timeout:
+                logger.warning(f"等待超过 {self.drain_timeout} 秒，强制退出")
+                break
+
+        for stop in self.stops.values():
+            stop.set()
+        for w in self.workers:
+            w.process.join(timeout=5)
+            self._kill(w)
+        self._drain_status()
+        self._return_unfinished(bv_list_file)
+        self.print_status()
+
+def main():
+    from dp_config import get_config, get_bv_list_file
+    config = get_config()
+    conf = config.get("supervisor", {})
+
+    parser = argparse.ArgumentParser(description="本机多进程转录流水线")
+    parser.add_argument("--fetchers", type=int, default=conf.get("fetchers", 1), help="领取任务的进程数")
+    parser.add_argument("--downloaders", type=int, default=conf.get("downloaders", 1), help="下载音频的进程数")
+    parser.add_argument("--transcribers", type=int, default=conf.get("transcribers", 1), help="转录的进程数")
+    parser.add_argument("--prefetch", type=int, default=conf.get("prefetch", 2), help="预先领取的任务数")
+    parser.add_argument("--duration-limit", type=int, default=conf.get("duration_limit", 1800), help="领取任务的时长限制（秒）")
+    parser.add_argument("--limit-type", default=conf.get("limit_type", "less_than"), choices=["less_than", "better_greater_than"])
+    parser.add_argument("--heartbeat-timeout", type=int, default=conf.get("heartbeat_timeout", 300))
+    parser.add_argument("--drain-timeout", type=int, default=conf.get("drain_timeout", 600))
+    parser.add_argument("--status-interval", type=int, default=conf.get("status_interval", 30))
+    parser.add_argument("--no-upload", action="store_true", help="退出时不上传结果")
+    args = parser.parse_args()
+
+    counts = {'fetch': args.fetchers, 'download': args.downloaders, 'transcribe': args.transcribers}
+    options = {'prefetch': args.prefetch, 'duration_limit': args.duration_limit, 'limit_type': args.limit_type}
+    logger.info(f"启动流水线: {json.dumps(counts)}")
+    supervisor = Supervisor(counts, options, args.heartbeat_timeout, args.drain_timeout, args.status_interval)
+    bv_list_file = get_bv_list_file()
+    uploader = None
+    if not args.no_upload:
+        from server_in_queue import ResultUploader
+        uploader = ResultUploader()
+        uploader.start()
+    from fleet import start_heartbeat
+    heartbeat = start_heartbeat(logger)
+    supervisor.run(bv_list_file)
+
+    if uploader:
+        uploader.stop(flush=True)
+    if heartbeat:
+        heartbeat.stop()
+
+if __name__ == "__main__":
+    main()
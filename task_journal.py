@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本地任务日志（journal）。
+
+任务的每次状态变化（add/claim/done/fail/release）都作为一行 JSON 追加到日志文件并 fsync，
+内存中维护每个任务的最新状态和待处理队列，取任务和完成任务都是 O(1) 的追加写入，不再重写整个 input.txt。
+进程崩溃后重新打开日志，被已经不存在的进程领取的任务会回到待处理状态，不会丢失。
+
+input.txt 只作为导入来源：import_file() 把其中的有效行导入日志后从文件中删除，注释行保留。
+多个进程共用同一个日志时用文件锁互斥，每次操作前先读取其他进程追加的新记录。
+记录数远多于任务数时重写日志（compaction），只保留每个任务的最新状态。
+失败后放回队列的任务记录各类失败的次数，可以指定等待时间（not_before），到期之前不会被领取。
+
+命令行：
+    python task_journal.py status <journal>
+    python task_journal.py list <journal> [--state pending]
+    python task_journal.py import <journal> <input.txt>
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import socket
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from pathlib import Path
+
+STATES = ('pending', 'claimed', 'done', 'failed')
+
+def task_id_of(line: str) -> str:
+    return hashlib.sha1(line.strip().encode('utf-8')).hexdigest()[:16]
+
+def _owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _owner_alive(owner: str) -> bool:
+    host, _, pid = (owner or "").rpartition(':')
+    if host != socket.gethostname():
+        # 其他机器的进程无法判断，视为仍在运行
+        return True
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class TaskJournal:
+    def __init__(self, path: Path, max_attempts: int = 3, compact_ratio: int = 4, compact_min: int = 1000):
+        """
+        Args:
+            path (Path): 日志文件路径，应放在本地磁盘上。
+            max_attempts (int, optional): fail(retry=True) 时最多尝试的次数. 默认为 3.
+            compact_ratio (int, optional): 记录数超过任务数的这个倍数时压缩日志. 默认为 4.
+            compact_min (int, optional): 记录数少于这个值时不压缩. 默认为 1000.
+        """
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(f".{self.path.name}.lock")
+        self.max_attempts = max_attempts
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+        self.tasks = OrderedDict()
+        self.pending = deque()
+        self.records = 0
+        self._offset = 0
+        self._inode = None
+        self._imported = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._locked():
+            pass
+
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """读取其他进程追加的新记录；日志被压缩过（inode 变化）时重新读取整个文件。"""
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            self.path.touch()
+            st = self.path.stat()
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            self.tasks.clear()
+            self.pending.clear()
+            self.records = 0
+            self._offset = 0
+            self._inode = st.st_ino
+        if st.st_size == self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # 只处理完整的行，崩溃时写了一半的最后一行忽略
+        end = data.rfind(b"\n") + 1
+        for raw in data[:end].splitlines():
+            try:
+                self._apply(json.loads(raw))
+            except (json.JSONDecodeError, KeyError):
+                continue
+            self.records += 1
+        self._offset += end
+
+    def _apply(self, rec):
+        op = rec['op']
+        tid = rec['id']
+        if op == 'add':
+            self.tasks[tid] = {'line': rec['line'], 'state': 'pending', 'attempts': rec.get('attempts', 0), 'added': rec.get('ts'),
+                               'failures': rec.get('failures') or {}, 'not_before': rec.get('not_before')}
+            self.tasks.move_to_end(tid)
+            self.pending.append(tid)
+            return
+        task = self.tasks.get(tid)
+        if task is None:
+            return
+        if op == 'claim':
+            task.update(state='claimed', owner=rec.get('owner'), attempts=task['attempts'] + 1)
+        elif op == 'release':
+            task.update(state='pending', owner=None, not_before=rec.get('not_before'))
+            if rec.get('status'):
+                self._count_failure(task, rec['status'])
+            self.pending.append(tid)
+        elif op == 'done':
+            task.update(state='done', status=rec.get('status', 'ok'), owner=None)
+        elif op == 'fail':
+            task.update(state='failed', status=rec.get('status', 'error'), owner=None)
+            self._count_failure(task, task['status'])
+
+    @staticmethod
+    def _count_failure(task, status):
+        task['failures'] = {**task.get('failures', {}), status: task.get('failures', {}).get(status, 0) + 1}
+
+    def _append(self, *recs):
+        now = round(time.time(), 3)
+        data = "".join(json.dumps({'ts': now, **rec}, ensure_ascii=False, separators=(',', ':')) + "\n" for rec in recs)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        for rec in recs:
+            self._apply({'ts': now, **rec})
+        self.records += len(recs)
+        self._offset = self.path.stat().st_size
+
+    def add(self, line: str) -> bool:
+        """添加任务。同样的任务已经在待处理或处理中时跳过，返回 False。"""
+        line = line.strip()
+        tid = task_id_of(line)
+        with self._locked():
+            task = self.tasks.get(tid)
+            if task and task['state'] in ('pending', 'claimed'):
+                return False
+            self._append({'op': 'add', 'id': tid, 'line': line})
+            return True
+
+    def import_file(self, src_file: Path):
+        """
+        把 src_file 中的有效行导入日志，并从文件中删除这些行（保留注释和空行）。
+        文件的大小和修改时间没有变化时不会重新读取。
+
+        Returns:
+            list[str]: 新导入的任务行。
+        """
+        src_file = Path(src_file)
+        try:
+            st = src_file.stat()
+        except FileNotFoundError:
+            return []
+        if self._imported.get(src_file) == (st.st_size, st.st_mtime_ns):
+            return []
+        with self._locked():
+            with open(src_file, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+            keep = []
+            recs = []
+            seen = set()
+            for line in lines:
+                stripped = line.strip()
+                if not stripped or stripped.startswith('#'):
+                    keep.append(line)
+                    continue
+                tid = task_id_of(stripped)
+                task = self.tasks.get(tid)
+                if tid in seen or (task and task['state'] in ('pending', 'claimed')):
+                    continue
+                seen.add(tid)
+                recs.append({'op': 'add', 'id': tid, 'line': stripped})
+            if recs:
+                self._append(*recs)
+            if len(keep) != len(lines):
+                tmp = src_file.with_name(f".{src_file.name}.tmp")
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    f.writelines(keep)
+                os.replace(tmp, src_file)
+            st = src_file.stat()
+            self._imported[src_file] = (st.st_size, st.st_mtime_ns)
+            self._maybe_compact()
+        return [rec['line'] for rec in recs]
+
+    def claim(self, owner: str = None):
+        """
+        领取下一个待处理任务。
+
+        Returns:
+            tuple[str, str] | None: (任务 id, 任务行)，没有待处理任务时返回 None。
+        """
+        with self._locked():
+            now = time.time()
+            # 还没到重试时间的任务留在队列前面，保持原来的顺序
+            deferred = []
+            try:
+                while self.pending:
+                    tid = self.pending.popleft()
+                    task = self.tasks.get(tid)
+                    if task is None or task['state'] != 'pending':
+                        continue
+                    if (task.get('not_before') or 0) > now:
+                        deferred.append(tid)
+                        continue
+                    self._append({'op': 'claim', 'id': tid, 'owner': owner or _owner()})
+                    return tid, task['line']
+                return None
+            finally:
+                self.pending.extendleft(reversed(deferred))
+
+    def next_retry(self):
+        """
+        Returns:
+            float | None: 等待重试的任务中最早可以领取的时间，没有等待重试的任务时返回 None。
+        """
+        with self._locked():
+            times = [task['not_before'] for task in self.tasks.values() if task['state'] == 'pending' and task.get('not_before')]
+            return min(times) if times else None
+
+    def failures(self, task_id: str) -> dict:
+        """任务各类失败（fail 的 status）的次数。"""
+        with self._locked():
+            task = self.tasks.get(task_id)
+            return dict(task.get('failures', {})) if task else {}
+
+    def complete(self, task_id: str, status: str = 'ok'):
+        with self._locked():
+            self._append({'op': 'done', 'id': task_id, 'status': status})
+            self._maybe_compact()
+
+    def fail(self, task_id: str, status: str = 'error', retry: bool = False, delay: float = 0) -> bool:
+        """
+        标记任务失败。retry 为 True 且尝试次数没有超过 max_attempts 时放回待处理队列末尾。
+
+        Args:
+            status (str, optional): 失败的状态或类型，按类型累计失败次数（见 failures）. 默认为 'error'.
+            delay (float, optional): 放回队列时，至少等待该秒数才会被再次领取. 默认为 0.
+
+        Returns:
+            bool: 任务被放回队列返回 True。
+        """
+        with self._locked():
+            task = self.tasks.get(task_id)
+            if retry and task and task['attempts'] < self.max_attempts:
+                rec = {'op': 'release', 'id': task_id, 'status': status}
+                if delay > 0:
+                    rec['not_before'] = round(time.time() + delay, 3)
+                self._append(rec)
+                return True
+            self._append({'op': 'fail', 'id': task_id, 'status': status})
+            self._maybe_compact()
+            return False
+
+    def recover(self, all_claims: bool = False) -> int:
+        """
+        把领取者进程已经不存在的任务放回待处理队列。
+
+        Args:
+            all_claims (bool, optional): 为 True 时不检查领取者，放回所有处理中的任务（单进程启动时使用）.
+
+        Returns:
+            int: 放回的任务数。
+        """
+        with self._locked():
+            recs = [{'op': 'release', 'id': tid} for tid, task in self.tasks.items()
+                    if task['state'] == 'claimed' and (all_claims or not _owner_alive(task.get('owner')))]
+            if recs:
+                self._append(*recs)
+            return len(recs)
+
+    def counts(self):
+        with self._locked():
+            result = {state: 0 for state in STATES}
+            for task in self.tasks.values():
+                result[task['state']] += 1
+            return result
+
+    def lines(self, state: str = 'pending'):
+        with self._locked():
+            return [task['line'] for task in self.tasks.values() if task['state'] == state]
+
+    def _maybe_compact(self):
+        if self.records < self.compact_min or self.records < self.compact_ratio * max(len(self.tasks), 1):
+            return
+        self.compact()
+
+    def compact(self):
+        """重写日志，每个任务只保留能还原其最新状态的记录。调用方需持有锁。"""
+        recs = []
+        for tid, task in self.tasks.items():
+            # claim 记录重放时会把尝试次数加一
+            attempts = task['attempts'] - (1 if task['state'] == 'claimed' else 0)
+            rec = {'op': 'add', 'id': tid, 'line': task['line'], 'attempts': attempts, 'ts': task.get('added')}
+            failures = dict(task.get('failures') or {})
+            if task['state'] == 'failed' and failures.get(task.get('status')):
+                # fail 记录重放时会把这一类的失败次数加一
+                failures[task['status']] -= 1
+            failures = {k: v for k, v in failures.items() if v}
+            if failures:
+                rec['failures'] = failures
+            if task['state'] == 'pending' and task.get('not_before'):
+                rec['not_before'] = task['not_before']
+            recs.append(rec)
+            if task['state'] == 'claimed':
+                recs.append({'op': 'claim', 'id': tid, 'owner': task.get('owner')})
+            elif task['state'] == 'done':
+                recs.append({'op': 'done', 'id': tid, 'status': task.get('status')})
+            elif task['state'] == 'failed':
+                recs.append({'op': 'fail', 'id': tid, 'status': task.get('status')})
+        tmp = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp, 'w', encoding='utf-8') as f:
+            for rec in recs:
+                f.write(json.dumps(rec, ensure_ascii=False, separators=(',', ':')) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._inode = None
+        self._refresh()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="任务日志工具")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_status = sub.add_parser("status", help="各状态的任务数")
+    p_status.add_argument("journal", type=Path)
+    p_list = sub.add_parser("list", help="列出某个状态的任务")
+    p_list.add_argument("journal", type=Path)
+    p_list.add_argument("--state", default="pending", choices=STATES)
+    p_import = sub.add_parser("import", help="从 input.txt 导入任务")
+    p_import.add_argument("journal", type=Path)
+    p_import.add_argument("src", type=Path)
+    args = parser.parse_args(argv)
+
+    journal = TaskJournal(args.journal)
+    if args.cmd == "status":
+        print(json.dumps(journal.counts(), ensure_ascii=False))
+    elif args.cmd == "list":
+        for line in journal.lines(args.state):
+            print(line)
+    elif args.cmd == "import":
+        print(f"导入 {len(journal.import_file(args.src))} 个任务")
+
+if __name__ == "__main__":
+    main()
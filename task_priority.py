@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+to_stt 任务的优先级。
+
+    score = UP/分组权重 × 时长类别权重 × (1 + fresh_boost × 0.5 ** (发布至今的时间 / fresh_half_life)) + 排队老化
+
+刚发布的视频得分最高，随发布时间指数衰减到基础权重。在 config.json 中配置（以下是默认值）：
+
+    "priority": {
+        "fresh_boost": 4.0,
+        "fresh_half_life": 86400,
+        "up_weights": {},                 UP 主名字或 mid -> 权重，例如 {"某UP": 3.0}
+        "group_weights": {},              任务行中 group 字段 -> 权重
+        "duration_classes": [[600, 1.5], [1800, 1.0], [null, 0.7]],
+        "aging_per_hour": 0.05,
+        "max_wait": 259200,
+        "rescore_interval": 600
+    }
+
+失败后等待重试的任务（任务行中的 retry_after 晚于当前时间，见 failure_policy）不会被选中。
+
+入队时间优先取任务行中的 queued_at，没有时由队列后端提供：git 后端取任务文件加入仓库的提交时间
+（查不到时取文件修改时间），sqlite 后端取入队时间。防止饿死：
+- 每排队一小时得分增加 aging_per_hour；
+- 排队超过 max_wait 秒的任务不看得分，最早入队的先领取，老的积压任务一定能处理完。为 0 时关闭。
+
+得分只在入队时间变化时才变化，不需要每次领取都重新计算：select_groups 按组（例如一个任务文件）缓存
+排好序的列表，组的内容不变时最多每 rescore_interval 秒重新计算一次，领取时用 heapq.merge 逐个合并
+各组的列表，找到第一个满足条件的任务就停止。
+"""
+
+import heapq
+import threading
+import time
+
+DEFAULT_POLICY = {
+    "fresh_boost": 4.0,
+    "fresh_half_life": 86400,
+    "up_weights": {},
+    "group_weights": {},
+    "duration_classes": [[600, 1.5], [1800, 1.0], [None, 0.7]],
+    "aging_per_hour": 0.05,
+    "max_wait": 259200,
+    "rescore_interval": 600,
+}
+
+class PriorityPolicy:
+    def __init__(self, conf: dict = None):
+        conf = {**DEFAULT_POLICY, **(conf or {})}
+        self.fresh_boost = float(conf["fresh_boost"])
+        self.fresh_half_life = float(conf["fresh_half_life"])
+        self.up_weights = {str(k): float(v) for k, v in conf["up_weights"].items()}
+        self.group_weights = {str(k): float(v) for k, v in conf["group_weights"].items()}
+        self.duration_classes = [(limit, float(weight)) for limit, weight in conf["duration_classes"]]
+        self.aging_per_hour = float(conf["aging_per_hour"])
+        self.max_wait = float(conf["max_wait"])
+        self.rescore_interval = float(conf["rescore_interval"])
+        # 组的键 -> (计算时间, 按得分排序的列表, 按入队时间排序的列表)
+        self._ranked = {}
+        self._lock = threading.Lock()
+
+    def duration_weight(self, duration) -> float:
+        for limit, weight in self.duration_classes:
+            if limit is None or duration < limit:
+                return weight
+        return 1.0
+
+    def up_weight(self, bv_info: dict) -> float:
+        weight = 1.0
+        for key in (bv_info.get('mid'), bv_info.get('up_name')):
+            if key is not None and str(key) in self.up_weights:
+                weight = self.up_weights[str(key)]
+                break
+        group = bv_info.get('group')
+        if group is not None and str(group) in self.group_weights:
+            weight *= self.group_weights[str(group)]
+        return weight
+
+    def score(self, bv_info: dict, now: float = None, queued_at: float = None) -> float:
+        """
+        计算任务的优先级得分，越大越先领取。
+
+        Args:
+            bv_info (dict): 任务行解析后的字典。
+            now (float, optional): 当前时间. 默认为 time.time().
+            queued_at (float, optional): 入队时间，默认取任务行中的 queued_at，没有时不计算老化.
+
+        Returns:
+            float: 得分。
+        """
+        now = time.time() if now is None else now
+        pubdate = bv_info.get('pubdate') or 0
+        fresh = 0.0
+        if pubdate > 0 and self.fresh_half_life > 0:
+            fresh = self.fresh_boost * 0.5 ** (max(now - pubdate, 0) / self.fresh_half_life)
+        score = self.up_weight(bv_info) * self.duration_weight(bv_info.get('duration', 0)) * (1 + fresh)
+        if queued_at is None:
+            queued_at = bv_info.get('queued_at')
+        if queued_at:
+            score += self.aging_per_hour * max(now - queued_at, 0) / 3600
+        return score
+
+    def _rank(self, key, candidates, now):
+        with self._lock:
+            cached = self._ranked.get(key) if key is not None else None
+        if cached and now - cached[0] < self.rescore_interval:
+            return cached[1], cached[2]
+        by_score = []
+        by_age = []
+        for i, (order, bv_info, queued_at) in enumerate(candidates):
+            queued_at = bv_info.get('queued_at') or queued_at
+            by_score.append((-self.score(bv_info, now, queued_at), order, i))
+            if queued_at:
+                by_age.append((queued_at, order, i))
+        by_score.sort()
+        by_age.sort()
+        if key is not None:
+            with self._lock:
+                self._ranked[key] = (now, by_score, by_age)
+        return by_score, by_age
+
+    def select_groups(self, groups, duration_limit=1800, limit_type="less_than", now=None):
+        """
+        从分组的候选任务中选出一个。组的键不变时复用缓存的排序结果，键应在组的内容变化时改变
+        （例如任务文件的 inode/修改时间/大小），为 None 时不缓存。
+
+        Args:
+            groups (list[tuple]): (键, 候选列表) 列表，候选是 (order, bv_info, queued_at)，
+                order 是原来的领取顺序（越小越早，各组之间可比较），queued_at 是任务行中没有 queued_at 时使用的入队时间，可以为 None。
+            duration_limit (int, optional): 时长限制（秒）. 默认为 1800.
+            limit_type (str, optional): "less_than" 只选时长小于限制的任务；
+                "better_greater_than" 优先选时长大于限制的任务，没有时选其他任务中得分最高的. 默认为 "less_than".
+
+        Returns:
+            tuple[int, int, bool] | None: (组下标, 组内候选下标, 是否是 better_greater_than 的退而求其次)，没有符合条件的任务时返回 None。
+        """
+        now = time.time() if now is None else now
+        ranked = [self._rank(key, candidates, now) for key, candidates in groups]
+        keys = {key for key, _ in groups if key is not None}
+        with self._lock:
+            # 只保留本次出现的组，文件变化后旧的缓存不再有用
+            for key in [k for k in self._ranked if k not in keys]:
+                del self._ranked[key]
+
+        def merged(which):
+            return heapq.merge(*[((*entry, g) for entry in lists[which]) for g, lists in enumerate(ranked)])
+
+        def fits(g, i):
+            bv_info = groups[g][1][i][1]
+            # 在退避中的任务不参与选择
+            if (bv_info.get('retry_after') or 0) > now:
+                return None
+            duration = bv_info.get('duration', 0)
+            if limit_type == "less_than":
+                return duration < duration_limit or None
+            return duration > duration_limit
+
+        if self.max_wait > 0:
+            for queued_at, _, i, g in merged(1):
+                if now - queued_at < self.max_wait:
+                    break
+                ok = fits(g, i)
+                if ok is not None:
+                    return g, i, limit_type == "better_greater_than" and not ok
+        fallback = None
+        for _, _, i, g in merged(0):
+            ok = fits(g, i)
+            if ok:
+                return g, i, False
+            if ok is False and fallback is None:
+                fallback = g, i
+        if fallback is not None:
+            return (*fallback, True)
+        return None
+
+    def select(self, candidates, duration_limit=1800, limit_type="less_than", now=None):
+        """
+        从候选任务中选出一个，不缓存排序结果，适合候选数量有限的情况（例如 sqlite 后端按索引取出的候选）。
+
+        Args:
+            candidates (list[tuple]): (order, bv_info, queued_at) 列表，含义见 select_groups。
+
+        Returns:
+            tuple[int, bool] | None: (候选下标, 是否是 better_greater_than 的退而求其次)，没有符合条件的任务时返回 None。
+        """
+        selected = self.select_groups([(None, candidates)], duration_limit, limit_type, now)
+        if selected is None:
+            return None
+        return selected[1], selected[2]
+
+_policy = None
+_policy_lock = threading.Lock()
+
+def get_policy() -> PriorityPolicy:
+    """按 config.json 中的 "priority" 设置创建策略，同一个进程共用一个实例。"""
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            from dp_config import get_config
+            _policy = PriorityPolicy(get_config().get("priority"))
+        return _policy
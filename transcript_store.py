@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+紧凑的转录结果格式。
+
+一个视频只保存一个 <name>.seg.jsonl.gz 文件：第一行是头部信息，之后每行一个分段 {"s": 开始毫秒, "e": 结束毫秒, "t": 文本}。
+.srt/.txt/.text 三种视图按 faster-whisper 的写法按需生成。
+打包时会检查生成的视图是否与原文件逐字节一致，不一致的视图把原文保存在头部的 "raw" 中，保证还原结果总是一致。
+
+命令行：
+    python transcript_store.py pack <name>.srt [-o <name>.seg.jsonl.gz]
+    python transcript_store.py pack-dir <dir> [--delete]
+    python transcript_store.py render <name>.seg.jsonl.gz [-f srt txt text] [-o <dir>]
+"""
+
+import argparse
+import gzip
+import io
+import json
+import re
+import sys
+from pathlib import Path
+
+COMPACT_SUFFIX = ".seg.jsonl.gz"
+VIEW_SUFFIXES = ('.srt', '.txt', '.text')
+FORMAT_VERSION = 1
+
+SRT_TIME_RE = re.compile(r"(\d+):(\d{2}):(\d{2})[,.](\d{3})\s*-->\s*(\d+):(\d{2}):(\d{2})[,.](\d{3})")
+
+def format_timestamp(ms: int, always_include_hours: bool = False, decimal_marker: str = '.') -> str:
+    """与 whisper.utils.format_timestamp 相同的时间格式。"""
+    hours, ms = divmod(ms, 3_600_000)
+    minutes, ms = divmod(ms, 60_000)
+    seconds, ms = divmod(ms, 1000)
+    hours_marker = f"{hours:02d}:" if always_include_hours or hours > 0 else ""
+    return f"{hours_marker}{minutes:02d}:{seconds:02d}{decimal_marker}{ms:03d}"
+
+def render_srt(segments) -> str:
+    out = []
+    for i, seg in enumerate(segments, start=1):
+        start = format_timestamp(seg['s'], always_include_hours=True, decimal_marker=',')
+        end = format_timestamp(seg['e'], always_include_hours=True, decimal_marker=',')
+        out.append(f"{i}\n{start} --> {end}\n{seg['t']}\n\n")
+    return "".join(out)
+
+def render_txt(segments) -> str:
+    return "".join(f"{seg['t']}\n" for seg in segments)
+
+def render_text(segments) -> str:
+    return "".join(f"[{format_timestamp(seg['s'])} --> {format_timestamp(seg['e'])}] {seg['t']}\n" for seg in segments)
+
+RENDERERS = {'.srt': render_srt, '.txt': render_txt, '.text': render_text}
+
+def parse_srt(content: str):
+    """解析 srt 内容，返回分段列表。"""
+    segments = []
+    for block in re.split(r"\r?\n\r?\n", content.strip("\ufeff\r\n")):
+        lines = block.splitlines()
+        for i, line in enumerate(lines):
+            m = SRT_TIME_RE.search(line)
+            if m:
+                g = [int(x) for x in m.groups()]
+                start = ((g[0] * 60 + g[1]) * 60 + g[2]) * 1000 + g[3]
+                end = ((g[4] * 60 + g[5]) * 60 + g[6]) * 1000 + g[7]
+                segments.append({'s': start, 'e': end, 't': "\n".join(lines[i + 1:])})
+                break
+    return segments
+
+class Transcript:
+    def __init__(self, segments, meta=None, raw=None):
+        """
+        Args:
+            segments (list[dict]): 分段列表，每个分段为 {'s': 开始毫秒, 'e': 结束毫秒, 't': 文本}。
+            meta (dict, optional): 附加信息，例如 bvid、来源（whisper/cc/ai）。
+            raw (dict, optional): 无法由分段还原的视图原文，格式为 {suffix: content}。
+        """
+        self.segments = segments
+        self.meta = meta or {}
+        self.raw = raw or {}
+
+    def render(self, suffix: str) -> str:
+        if suffix in self.raw:
+            return self.raw[suffix]
+        return RENDERERS[suffix](self.segments)
+
+    def dumps(self) -> bytes:
+        header = {'v': FORMAT_VERSION, 'meta': self.meta}
+        if self.raw:
+            header['raw'] = self.raw
+        buf = io.StringIO()
+        buf.write(json.dumps(header, ensure_ascii=False, separators=(',', ':')) + "\n")
+        for seg in self.segments:
+            buf.write(json.dumps({'s': seg['s'], 'e': seg['e'], 't': seg['t']}, ensure_ascii=False, separators=(',', ':')) + "\n")
+        # mtime 固定为 0，同样的内容得到同样的字节
+        return gzip.compress(buf.getvalue().encode('utf-8'), compresslevel=9, mtime=0)
+
+    @classmethod
+    def loads(cls, data: bytes):
+        lines = gzip.decompress(data).decode('utf-8').splitlines()
+        header = json.loads(lines[0])
+        if header.get('v') != FORMAT_VERSION:
+            raise ValueError(f"不支持的格式版本: {header.get('v')}")
+        segments = [json.loads(line) for line in lines[1:] if line]
+        return cls(segments, header.get('meta'), header.get('raw'))
+
+    def shifted(self, ms: int, duration_ms: int = None):
+        """
+        所有分段平移 ms 毫秒，去掉平移后落在 [0, duration_ms] 之外的分段，跨边界的分段截断到边界。
+        raw 中的原文不能平移，平移后的结果只由分段生成。
+
+        Returns:
+            Transcript: 新的 Transcript。
+        """
+        segments = []
+        for seg in self.segments:
+            s, e = seg['s'] + ms, seg['e'] + ms
+            if e <= 0 or (duration_ms and s >= duration_ms):
+                continue
+            s = max(s, 0)
+            if duration_ms:
+                e = min(e, duration_ms)
+            segments.append({'s': s, 'e': e, 't': seg['t']})
+        return Transcript(segments, dict(self.meta))
+
+    def save(self, path: Path):
+        Path(path).write_bytes(self.dumps())
+
+    @classmethod
+    def load(cls, path: Path):
+        return cls.loads(Path(path).read_bytes())
+
+    @classmethod
+    def from_views(cls, views: dict, meta=None):
+        """
+        从已有的视图内容构造，views 为 {suffix: content}，必须包含 '.srt'。
+        其他视图如果不能由分段逐字节还原，就把原文保存在 raw 中。
+        """
+        t = cls(parse_srt(views['.srt']), meta)
+        for suffix, content in views.items():
+            if RENDERERS[suffix](t.segments) != content:
+                t.raw[suffix] = content
+        return t
+
+def read_view(path: Path) -> str:
+    # newline='' 保留原始换行符，保证逐字节还原
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        return f.read()
+
+def write_view(path: Path, content: str):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(content)
+
+def pack_files(srt_path: Path, dst: Path = None, meta=None) -> Path:
+    """把 srt_path 及同名的 .txt/.text 打包成紧凑格式，返回输出文件路径。"""
+    srt_path = Path(srt_path)
+    base = srt_path.name[:-len('.srt')]
+    views = {}
+    for suffix in VIEW_SUFFIXES:
+        p = srt_path.with_name(base + suffix)
+        if p.exists():
+            views[suffix] = read_view(p)
+    if meta is None:
+        m = re.search(r"\[(BV\w+)\]$", base)
+        meta = {'bvid': m.group(1)} if m else {}
+    t = Transcript.from_views(views, meta)
+    dst = Path(dst) if dst else srt_path.with_name(base + COMPACT_SUFFIX)
+    t.save(dst)
+    return dst
+
+def render_file(path: Path, suffixes=VIEW_SUFFIXES, out_dir: Path = None):
+    """把紧凑格式文件还原为指定视图，返回输出文件列表。"""
+    path = Path(path)
+    base = path.name[:-len(COMPACT_SUFFIX)]
+    out_dir = Path(out_dir) if out_dir else path.parent
+    out_dir.mkdir(parents=True, exist_ok=True)
+    t = Transcript.load(path)
+    outputs = []
+    for suffix in suffixes:
+        dst = out_dir / f"{base}{suffix}"
+        write_view(dst, t.render(suffix))
+        outputs.append(dst)
+    return outputs
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="转录结果紧凑格式工具")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_pack = sub.add_parser("pack", help="把 .srt/.txt/.text 打包成一个文件")
+    p_pack.add_argument("srt", type=Path)
+    p_pack.add_argument("-o", "--output", type=Path)
+    p_dir = sub.add_parser("pack-dir", help="打包目录中所有完整的 .srt/.txt/.text 组")
+    p_dir.add_argument("directory", type=Path)
+    p_dir.add_argument("--delete", action="store_true", help="打包并校验后删除原文件")
+    p_render = sub.add_parser("render", help="从紧凑格式生成视图")
+    p_render.add_argument("files", type=Path, nargs="+")
+    p_render.add_argument("-f", "--formats", nargs="+", default=[s[1:] for s in VIEW_SUFFIXES], choices=[s[1:] for s in VIEW_SUFFIXES])
+    p_render.add_argument("-o", "--output-dir", type=Path)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "pack":
+        print(pack_files(args.srt, args.output))
+    elif args.cmd == "pack-dir":
+        packed = 0
+        fallback = 0
+        for srt in sorted(args.directory.glob("*.srt")):
+            base = srt.name[:-len('.srt')]
+            views = [srt.with_name(base + s) for s in VIEW_SUFFIXES]
+            if not all(v.exists() for v in views):
+                continue
+            dst = pack_files(srt)
+            t = Transcript.load(dst)
+            if any(t.render(v.suffix) != read_view(v) for v in views):
+                print(f"校验失败，保留原文件: {srt}", file=sys.stderr)
+                continue
+            packed += 1
+            fallback += 1 if t.raw else 0
+            if args.delete:
+                for v in views:
+                    v.unlink()
+        print(f"打包 {packed} 组，其中 {fallback} 组包含无法由分段还原的原文")
+    elif args.cmd == "render":
+        suffixes = ['.' + f for f in args.formats]
+        for f in args.files:
+            for out in render_file(f, suffixes, args.output_dir):
+                print(out)
+
+if __name__ == "__main__":
+    main()